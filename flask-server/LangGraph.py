@@ -2,7 +2,8 @@
 LangGraph-powered Terraform RAG: demonstrates more powerful features than basic RAG.
 
 Features demonstrated:
-1. ROUTING - Classify question type (simple / complex / analysis) and route to different strategies
+1. ROUTING - Classify question type (simple / complex / analysis) and route to different strategies;
+   attribute / dependency lookups are answered straight from the graph
 2. MULTI-QUERY (analysis) - Decompose broad questions into sub-questions, RAG each in parallel, synthesize
 3. AGENTIC RAG - Retrieve → Critique → Refine loop (iterate if answer is incomplete)
 4. TOOL USE - RAG wrapped as a LangChain tool that the graph can invoke
@@ -21,19 +22,34 @@ from __future__ import annotations
 import nest_asyncio
 nest_asyncio.apply()
 
+import asyncio
+import contextvars
+import functools
+import inspect
 import json
 import logging
 import os
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from operator import add
-from typing import Annotated, Any, Literal, Optional, TypedDict
+from typing import Annotated, Any, Callable, Literal, Optional, TypedDict
 
 from langchain_anthropic import ChatAnthropic
 from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
+from langgraph.config import get_stream_writer
 from langgraph.graph import END, START, StateGraph
 
+from graph_lookup import KeywordMatcher, get_lookup
+from graph_provider import get_graph
+from llm_cache import LLM_CACHE_ENABLED, LangChainLLMCache, llm_response_cache
+from llm_scheduler import llm_scheduler
+from metrics import LANGGRAPH_NODE_SECONDS
+import tracing
+
 logger = logging.getLogger(__name__)
 
 # ---------------------------------------------------------------------------
@@ -51,7 +67,7 @@ class TerraformRAGState(TypedDict):
     mock: Optional[bool]
 
     # Routing
-    route: Optional[str]  # "simple" | "complex" | "analysis"
+    route: Optional[str]  # "simple" | "complex" | "analysis" | "lookup"
 
     # RAG results
     rag_answer: Optional[str]
@@ -187,10 +203,33 @@ MOCK_ENRICHMENT = {
 # LLM & Tools
 # ---------------------------------------------------------------------------
 
-llm = ChatAnthropic(
+class ScheduledChatAnthropic(ChatAnthropic):
+    """
+    ChatAnthropic whose remote calls take a slot from the process-wide llm_scheduler.
+    Cache lookups happen before _generate, so cache hits never queue.
+    """
+
+    def _generate(self, *args, **kwargs):
+        return llm_scheduler.call(super()._generate, *args, **kwargs)
+
+    async def _agenerate(self, *args, **kwargs):
+        return await llm_scheduler.acall(super()._agenerate, *args, **kwargs)
+
+    def _stream(self, *args, **kwargs):
+        return llm_scheduler.stream(super()._stream, *args, **kwargs)
+
+    def _astream(self, *args, **kwargs):
+        return llm_scheduler.astream(super()._astream, *args, **kwargs)
+
+
+llm = ScheduledChatAnthropic(
     model=os.environ.get("ANTHROPIC_MODEL", "claude-sonnet-4-20250514"),
     api_key=os.environ.get("ANTHROPIC_API_KEY", ""),
     temperature=0,
+    # Retries happen in llm_scheduler (which releases the slot while backing off)
+    max_retries=0,
+    # Prompts are fully determined by their inputs, so identical calls are served from the local cache
+    cache=LangChainLLMCache(llm_response_cache) if LLM_CACHE_ENABLED else None,
 )
 
 
@@ -200,10 +239,71 @@ def terraform_rag_query(question: str) -> str:
     Query the Terraform infrastructure graph RAG.
     Use this to get answers about resources, dependencies, and the Terraform plan.
     """
-    from rag import get_query_engine
+    from rag import get_query_engine, capture_retrieval_trace
 
     engine = get_query_engine()
-    response = engine.query(question)
+    # Each call records its own retrieval trace (merged into the caller's, if any)
+    with tracing.span("rag.query", **{"rag.question": question}), capture_retrieval_trace():
+        response = engine.query(question)
+    return str(response)
+
+
+# LLM calls whose output becomes the user-facing answer carry this tag, so
+# stream_langgraph() can forward their tokens and skip intermediate calls
+# (decomposition, critique, follow-up questions)
+FINAL_ANSWER_TAG = "final_answer"
+
+
+def _final_answer_llm():
+    return llm.with_config(tags=[FINAL_ANSWER_TAG])
+
+
+def _stream_writer():
+    """The graph's custom stream writer, or a no-op when a node is called outside a graph run."""
+    try:
+        return get_stream_writer()
+    except RuntimeError:
+        return lambda chunk: None
+
+
+def _stream_tokens(config: Optional[RunnableConfig]) -> bool:
+    return bool((config or {}).get("configurable", {}).get("stream_tokens"))
+
+
+def _stream_rag_answer(question: str) -> str:
+    """terraform_rag_query, forwarding answer tokens to the graph's custom stream as they arrive."""
+    from rag import stream_query
+
+    writer = _stream_writer()
+    tokens = []
+    for kind, value in stream_query(question):
+        if kind == "token":
+            tokens.append(value)
+            writer({"node": "rag_retrieve", "text": value})
+    return "".join(tokens)
+
+
+# ---------------------------------------------------------------------------
+# Async execution: coroutines instead of one OS thread per sub-question. The
+# only limit on in-flight calls is the process-wide llm_scheduler (and
+# embed_scheduler), which the LLM clients and the embedding model go through
+# ---------------------------------------------------------------------------
+
+
+async def _allm(messages: list, final: bool = False) -> str:
+    model = _final_answer_llm() if final else llm
+    response = await model.ainvoke(messages)
+    return response.content if hasattr(response, "content") else str(response)
+
+
+async def aterraform_rag_query(question: str) -> str:
+    """Async counterpart of terraform_rag_query (awaits the query engine's aquery)."""
+    from rag import get_query_engine, capture_retrieval_trace
+
+    # The first call may build the index; keep that off the event loop
+    engine = await asyncio.to_thread(get_query_engine)
+    with tracing.span("rag.query", **{"rag.question": question}), capture_retrieval_trace():
+        response = await engine.aquery(question)
     return str(response)
 
 
@@ -212,53 +312,92 @@ def terraform_rag_query(question: str) -> str:
 # ---------------------------------------------------------------------------
 
 
+# Router vocabulary: a question containing any analysis phrase is "analysis", else any
+# complex phrase makes it "complex", else "simple" (substring matches, like the Express router)
+ROUTE_PHRASES: dict[str, list[str]] = {
+    "analysis": [
+        "bug",
+        "error",
+        "issue",
+        "correct",
+        "wrong",
+        "problem",
+        "analyze",
+        "lambda",
+        "event_source",
+        "event source mapping",
+        "trigger",
+        "consumer",
+        "missing",
+    ],
+    "complex": ["depend", "use", "connect", "link", "chain", "impact"],
+}
+_route_matcher = KeywordMatcher((phrase, route) for route, phrases in ROUTE_PHRASES.items() for phrase in phrases)
+
+# Answer attribute / dependency questions straight from the graph when it can (no RAG, no LLM)
+GRAPH_LOOKUP_ENABLED = os.environ.get("GRAPH_LOOKUP", "1").lower() in ("1", "true", "yes")
+
+
+def _graph_lookup(question: str):
+    """LookupAnswer for the question from the current graph, or None to fall back to RAG."""
+    try:
+        return get_lookup(get_graph()).answer(question)
+    except ImportError:
+        return None
+
+
+def classify_question(question: str) -> str:
+    """Keyword route for a question: "analysis", "complex" or "simple"."""
+    labels = _route_matcher.labels(question)
+    if "analysis" in labels:
+        return "analysis"
+    if "complex" in labels:
+        return "complex"
+    return "simple"
+
+
+def answered_from_graph(question: str) -> bool:
+    """True when router() will answer this question from the graph (so no RAG index is needed)."""
+    return GRAPH_LOOKUP_ENABLED and classify_question(question.lower()) != "analysis" and _graph_lookup(question) is not None
+
+
 def router(state: TerraformRAGState) -> TerraformRAGState:
     """
     Classify the question and route to the appropriate strategy.
     - simple: direct lookup (e.g. "what is X?")
     - complex: needs graph traversal + potential refinement (e.g. "what depends on X?")
     - analysis: broad question needing multiple retrievals (e.g. "are there bugs?")
+    - lookup: simple/complex question answered exactly from the graph, skipping RAG and the LLM
     """
     question = state["question"].lower()
-
-    if any(
-        phrase in question
-        for phrase in [
-            "bug",
-            "error",
-            "issue",
-            "correct",
-            "wrong",
-            "problem",
-            "analyze",
-            "lambda",
-            "event_source",
-            "event source mapping",
-            "trigger",
-            "consumer",
-            "missing",
-        ]
-    ):
-        route = "analysis"
-    elif any(
-        phrase in question
-        for phrase in ["depend", "use", "connect", "link", "chain", "impact"]
-    ):
-        route = "complex"
-    else:
-        route = "simple"
+    route = classify_question(question)
+
+    if route != "analysis" and GRAPH_LOOKUP_ENABLED and not state.get("mock"):
+        hit = _graph_lookup(state["question"])
+        if hit is not None:
+            logger.info("[LangGraph] Router: %s -> lookup (%s)", question[:50], hit.kind)
+            return {
+                "route": "lookup",
+                "rag_answer": hit.answer,
+                "trace": [
+                    "[router] Classified as 'lookup'",
+                    f"[lookup] Answered {hit.kind} question from the graph ({len(hit.paths)} resources)",
+                ],
+            }
 
     logger.info("[LangGraph] Router: %s -> %s", question[:50], route)
 
     return {"route": route, "trace": [f"[router] Classified as '{route}'"]}
 
 
-def rag_retrieve(state: TerraformRAGState) -> TerraformRAGState:
+def rag_retrieve(state: TerraformRAGState, config: Optional[RunnableConfig] = None) -> TerraformRAGState:
     """Call the graph RAG to get an initial answer."""
     question = state["question"]
 
     if state.get("mock"):
         answer = MOCK_RAG_ANSWER
+    elif _stream_tokens(config):
+        answer = _stream_rag_answer(question)
     else:
         answer = terraform_rag_query.invoke({"question": question})
 
@@ -316,15 +455,6 @@ CONNECTION_CHECKS: dict[tuple[str, str], list[str]] = {
 }
 
 
-def _extract_resource_type(path: str) -> str | None:
-    """Extract Terraform resource type from path (e.g. aws_lambda_function, aws_sqs_queue)."""
-    parts = path.split(".")
-    for part in parts:
-        if part.startswith("aws_") and "." not in part:
-            return part
-    return None
-
-
 # Pairs where we inject checklist questions if BOTH types exist in graph
 # (connections may be indirect via IAM policies, so edge-based scan can miss them)
 CO_PRESENCE_CHECKS: list[tuple[str, str]] = [
@@ -335,51 +465,30 @@ CO_PRESENCE_CHECKS: list[tuple[str, str]] = [
 
 def _get_connection_check_questions() -> list[str]:
     """
-    Scan the graph for connected resource pairs, infer types, and return
-    checklist questions from CONNECTION_CHECKS. Also adds questions when
+    Map the graph's connected resource-type pairs (precomputed by graph_provider)
+    to checklist questions from CONNECTION_CHECKS. Also adds questions when
     key resource types co-exist (e.g. Lambda + SQS) even without direct edges.
     Dedupes and returns unique questions.
     """
     try:
-        from app import build_graph3_nodes
+        graph = get_graph()
     except ImportError:
         return []
 
-    nodes = build_graph3_nodes()
     seen_questions: set[str] = set()
     result: list[str] = []
 
-    # Collect all resource types present in the graph
-    types_present: set[str] = set()
-    for path in nodes:
-        t = _extract_resource_type(path)
-        if t:
-            types_present.add(t)
-
-    # 1. Edge-based: iterate connected pairs
-    for path, node_data in nodes.items():
-        source_type = _extract_resource_type(path)
-        if not source_type:
-            continue
-
-        edges = list(node_data.get("edges_new", [])) + list(node_data.get("edges_existing", []))
-        for target_path in edges:
-            if target_path not in nodes:
-                continue
-            target_type = _extract_resource_type(target_path)
-            if not target_type:
-                continue
-
-            key = (source_type, target_type)
-            questions = CONNECTION_CHECKS.get(key) or CONNECTION_CHECKS.get(("*", "*"), [])
-            for q in questions:
-                if q not in seen_questions:
-                    seen_questions.add(q)
-                    result.append(q)
+    # 1. Edge-based: connected type pairs, precomputed once per graph version
+    for key in graph.type_pairs:
+        questions = CONNECTION_CHECKS.get(key) or CONNECTION_CHECKS.get(("*", "*"), [])
+        for q in questions:
+            if q not in seen_questions:
+                seen_questions.add(q)
+                result.append(q)
 
     # 2. Co-presence: if Lambda + SQS (or similar) exist, add their checklist
     for src, tgt in CO_PRESENCE_CHECKS:
-        if src in types_present and tgt in types_present:
+        if src in graph.types_present and tgt in graph.types_present:
             key = (src, tgt)
             questions = CONNECTION_CHECKS.get(key, [])
             for q in questions:
@@ -395,12 +504,8 @@ def _get_connection_check_questions() -> list[str]:
 # ---------------------------------------------------------------------------
 
 
-def decompose_question(question: str) -> list[str]:
-    """
-    LLM decomposes a broad question into 3-5 specific sub-questions.
-    Each targets a different concern: deployment, security, networking, dependencies, etc.
-    """
-    prompt = f"""Given this Terraform/infrastructure question, decompose it into 3-5 specific sub-questions.
+def _decompose_prompt(question: str) -> str:
+    return f"""Given this Terraform/infrastructure question, decompose it into 3-5 specific sub-questions.
 Each sub-question should target a different concern. Use these categories when relevant:
 - Terraform deployment issues (syntax, plan errors, state)
 - Security issues (IAM, permissions, exposed resources)
@@ -413,8 +518,9 @@ Original question: {question}
 Return a JSON array of strings only. Example: ["question 1?", "question 2?", "question 3?"]
 Output only the JSON array, no other text."""
 
-    response = llm.invoke([HumanMessage(content=prompt)])
-    text = (response.content if hasattr(response, "content") else str(response)).strip()
+
+def _parse_sub_questions(text: str) -> list[str]:
+    text = text.strip()
 
     # Extract JSON array (handle markdown code blocks)
     match = re.search(r"\[[\s\S]*?\]", text)
@@ -439,96 +545,125 @@ Output only the JSON array, no other text."""
     ]
 
 
-def decompose(state: TerraformRAGState) -> TerraformRAGState:
-    """Generate sub-questions from broad analysis question, plus connection-checklist questions."""
-    if state.get("mock"):
-        sub_questions = list(MOCK_SUB_QUESTIONS)
-        return {
-            "sub_questions": sub_questions,
-            "trace": [f"[decompose] Generated {len(sub_questions)} sub-questions"],
-        }
+def decompose_question(question: str) -> list[str]:
+    """
+    LLM decomposes a broad question into 3-5 specific sub-questions.
+    Each targets a different concern: deployment, security, networking, dependencies, etc.
+    """
+    response = llm.invoke([HumanMessage(content=_decompose_prompt(question))])
+    return _parse_sub_questions(response.content if hasattr(response, "content") else str(response))
 
-    question = state["question"]
-    sub_questions = decompose_question(question)
 
-    # Inject rule-based connection checklist questions from graph scan
-    checklist_questions = _get_connection_check_questions()
-    seen = {sq.lower().strip() for sq in sub_questions}
-    added = 0
-    for q in checklist_questions:
-        if q.lower().strip() not in seen:
-            sub_questions.append(q)
-            seen.add(q.lower().strip())
-            added += 1
+def _question_key(question: str) -> str:
+    return question.lower().strip()
 
-    if added:
-        logger.info(
-            "[LangGraph] Added %d connection-checklist questions (total: %d)",
-            added,
-            len(sub_questions),
-        )
-    logger.info("[LangGraph] Decomposed into %d sub-questions: %s", len(sub_questions), sub_questions)
 
+def _analysis_result(
+    sub_questions: list[str], checklist_questions: list[str], sub_answers: list[dict[str, str]]
+) -> TerraformRAGState:
+    """Sub-answers in question order: the LLM's sub-questions, then the checklist questions they don't cover."""
+    added = len(sub_answers) - len({_question_key(sq) for sq in sub_questions})
+    if added:
+        logger.info("[LangGraph] Added %d connection-checklist questions (total: %d)", added, len(sub_answers))
+    trace = [f"[decompose] Generated {len(sub_questions)} sub-questions"]
+    if added:
+        trace.append(f"[checklist] Added {added} connection-checklist questions")
+    trace.append(f"[multi_rag] Retrieved {len(sub_answers)} sub-answers in parallel")
     return {
-        "sub_questions": sub_questions,
-        "trace": [f"[decompose] Generated {len(sub_questions)} sub-questions"],
+        "sub_questions": [a["question"] for a in sub_answers],
+        "sub_answers": sub_answers,
+        "trace": trace,
     }
 
 
-def multi_rag_retrieve(state: TerraformRAGState) -> TerraformRAGState:
-    """Run RAG for each sub-question in parallel, collect answers."""
-    sub_questions = state.get("sub_questions", [])
+def _decompose_step(sub_questions: list[str]) -> dict:
+    """Custom-stream "step" chunk for the decomposition, sent before its sub-questions are retrieved."""
+    return {"node": "decompose", "trace": [f"[decompose] Generated {len(sub_questions)} sub-questions"]}
+
+
+def _rag_sub_answer(sq: str) -> dict[str, str]:
+    return {"question": sq, "answer": terraform_rag_query.invoke({"question": sq})}
+
+
+def _retrieve_sub_answers(
+    questions: list[str], node: str, then: Optional[Callable[[], list[str]]] = None
+) -> list[dict[str, str]]:
+    """
+    RAG each question on a thread pool; each answer goes to the graph's custom stream as it lands.
+    `then`, if given, runs on the pool alongside them, and the questions it returns start
+    retrieving as soon as it returns. A question is retrieved once however often it's asked
+    (case-insensitively). Answers come back in question order, `then`'s questions first.
+    """
+    writer = _stream_writer()
+    started: set[str] = set()
+    answers: dict[str, dict[str, str]] = {}
+
+    # One extra worker for `then`, so it never queues behind retrievals
+    with ThreadPoolExecutor(max_workers=6 + (then is not None)) as executor:
+        def start(new_questions: list[str]) -> set:
+            futures = set()
+            for sq in new_questions:
+                if _question_key(sq) not in started:
+                    started.add(_question_key(sq))
+                    # In a copy of this context so per-request state (retrieval traces) follows it
+                    futures.add(executor.submit(contextvars.copy_context().run, _rag_sub_answer, sq))
+            return futures
+
+        later = executor.submit(contextvars.copy_context().run, then) if then is not None else None
+        pending = start(questions) | ({later} if later is not None else set())
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future is later:
+                    pending |= start(future.result())
+                else:
+                    sub_answer = future.result()
+                    answers[_question_key(sub_answer["question"])] = sub_answer
+                    writer({"node": node, "sub_answer": sub_answer})
+
+    asked = (later.result() if later is not None else []) + list(questions)
+    return [answers[key] for key in dict.fromkeys(_question_key(sq) for sq in asked)]
+
 
+def multi_rag_retrieve(state: TerraformRAGState) -> TerraformRAGState:
+    """
+    Decompose the question and RAG every sub-question, all on one thread pool. The
+    rule-based connection-checklist questions don't depend on the LLM, so they start
+    retrieving while it decomposes; its sub-questions start as soon as it returns,
+    except ones a checklist question already covers. A "decompose" step goes to the
+    custom stream as soon as the sub-questions are known.
+    """
+    writer = _stream_writer()
     if state.get("mock"):
         # Build a lookup from mock sub-answers
         mock_lookup = {a["question"]: a["answer"] for a in MOCK_SUB_ANSWERS}
         sub_answers = [
             {"question": sq, "answer": mock_lookup.get(sq, MOCK_RAG_ANSWER)}
-            for sq in sub_questions
+            for sq in MOCK_SUB_QUESTIONS
         ]
-        return {
-            "sub_answers": sub_answers,
-            "trace": [f"[multi_rag] Retrieved {len(sub_answers)} sub-answers in parallel"],
-        }
-
-    def _rag_one(sq: str) -> dict[str, str]:
-        ans = terraform_rag_query.invoke({"question": sq})
-        return {"question": sq, "answer": ans}
+        writer(_decompose_step(MOCK_SUB_QUESTIONS))
+        return _analysis_result(list(MOCK_SUB_QUESTIONS), [], sub_answers)
 
-    sub_answers = []
-    with ThreadPoolExecutor(max_workers=min(6, len(sub_questions))) as executor:
-        futures = {executor.submit(_rag_one, sq): sq for sq in sub_questions}
-        for future in as_completed(futures):
-            sub_answers.append(future.result())
+    question = state["question"]
+    sub_questions: list[str] = []
 
-    # Preserve order of sub_questions
-    order = {sq: i for i, sq in enumerate(sub_questions)}
-    sub_answers.sort(key=lambda x: order.get(x["question"], 999))
-
-    return {
-        "sub_answers": sub_answers,
-        "trace": [f"[multi_rag] Retrieved {len(sub_answers)} sub-answers in parallel"],
-    }
+    def decompose() -> list[str]:
+        sub_questions.extend(decompose_question(question))
+        logger.info("[LangGraph] Decomposed into %d sub-questions: %s", len(sub_questions), sub_questions)
+        writer(_decompose_step(sub_questions))
+        return sub_questions
 
+    checklist_questions = _get_connection_check_questions()
+    sub_answers = _retrieve_sub_answers(checklist_questions, "multi_rag_retrieve", then=decompose)
+    return _analysis_result(sub_questions, checklist_questions, sub_answers)
 
-def synthesize(state: TerraformRAGState) -> TerraformRAGState:
-    """LLM synthesizes sub-answers into one coherent answer."""
-    if state.get("mock"):
-        synthesized = MOCK_SYNTHESIZED_ANSWER
-        sub_answers = state.get("sub_answers", [])
-        return {
-            "synthesized_answer": synthesized,
-            "trace": [f"[synthesize] Combined {len(sub_answers)} answers ({len(synthesized)} chars)"],
-        }
-
-    question = state["question"]
-    sub_answers = state.get("sub_answers", [])
 
+def _synthesize_prompt(question: str, sub_answers: list[dict[str, str]]) -> str:
     chunks = []
     for i, item in enumerate(sub_answers, 1):
         chunks.append(f"### {i}. {item['question']}\n{item['answer']}")
 
-    synthesize_prompt = f"""Original question: {question}
+    return f"""Original question: {question}
 
 Below are answers to specific sub-questions about the Terraform infrastructure.
 Synthesize them into one coherent, well-structured answer. Group by concern if helpful.
@@ -539,8 +674,21 @@ Sub-question answers:
 
 Synthesized answer:"""
 
-    response = llm.invoke([HumanMessage(content=synthesize_prompt)])
-    synthesized = response.content if hasattr(response, "content") else str(response)
+
+def synthesize(state: TerraformRAGState) -> TerraformRAGState:
+    """
+    LLM synthesizes sub-answers into one coherent answer. It starts once the last
+    sub-answer lands: there's no partial synthesis of the answers that arrived
+    first, since that took another LLM call and handed this one a summary in place
+    of the answers themselves. Streams see each sub-answer as it lands instead.
+    """
+    sub_answers = state.get("sub_answers", [])
+    if state.get("mock"):
+        synthesized = MOCK_SYNTHESIZED_ANSWER
+    else:
+        prompt = _synthesize_prompt(state["question"], sub_answers)
+        response = _final_answer_llm().invoke([HumanMessage(content=prompt)])
+        synthesized = response.content if hasattr(response, "content") else str(response)
 
     return {
         "synthesized_answer": synthesized,
@@ -548,23 +696,8 @@ Synthesized answer:"""
     }
 
 
-def critique(state: TerraformRAGState) -> TerraformRAGState:
-    """
-    LLM critiques the RAG answer: is it complete and faithful to the context?
-    Returns needs_refinement=True if the answer seems incomplete or uncertain.
-    """
-    if state.get("mock"):
-        critique_text = MOCK_CRITIQUE_RESPONSE
-        return {
-            "critique": critique_text,
-            "needs_refinement": False,
-            "trace": ["[critique] needs_refinement=False"],
-        }
-
-    question = state["question"]
-    answer = state.get("rag_answer", "")
-
-    messages = [
+def _critique_messages(question: str, answer: str) -> list:
+    return [
         SystemMessage(
             content="You are a strict quality assessor. Evaluate if the answer fully addresses the question "
             "using ONLY the provided context. Answer with a JSON object: {\"complete\": true/false, \"reason\": \"brief explanation\"}."
@@ -575,9 +708,8 @@ def critique(state: TerraformRAGState) -> TerraformRAGState:
         ),
     ]
 
-    response = llm.invoke(messages)
-    critique_text = response.content if hasattr(response, "content") else str(response)
 
+def _critique_result(critique_text: str) -> TerraformRAGState:
     # Parse simple JSON (robust fallback)
     needs_refinement = True
     if "true" in critique_text.lower() and "complete" in critique_text.lower():
@@ -590,6 +722,43 @@ def critique(state: TerraformRAGState) -> TerraformRAGState:
     }
 
 
+def critique(state: TerraformRAGState) -> TerraformRAGState:
+    """
+    LLM critiques the RAG answer: is it complete and faithful to the context?
+    Returns needs_refinement=True if the answer seems incomplete or uncertain.
+    """
+    if state.get("mock"):
+        critique_text = MOCK_CRITIQUE_RESPONSE
+        return {
+            "critique": critique_text,
+            "needs_refinement": False,
+            "trace": ["[critique] needs_refinement=False"],
+        }
+
+    response = llm.invoke(_critique_messages(state["question"], state.get("rag_answer", "")))
+    return _critique_result(response.content if hasattr(response, "content") else str(response))
+
+
+def _follow_up_prompt(question: str, initial_answer: str, critique_text: str) -> str:
+    # Refined question: ask for supplemental info based on critique
+    return (
+        f"Original question: {question}\n\n"
+        f"Initial answer (may be incomplete): {initial_answer}\n\n"
+        f"Critique: {critique_text}\n\n"
+        "Generate a more specific follow-up question to retrieve missing information. "
+        "One short question only, no explanation."
+    )
+
+
+def _refined_synthesis_prompt(question: str, initial_answer: str, supplemental: str) -> str:
+    return (
+        f"Original question: {question}\n\n"
+        f"Initial answer: {initial_answer}\n\n"
+        f"Supplemental info (from follow-up): {supplemental}\n\n"
+        "Combine into one complete, concise answer. Do not repeat yourself."
+    )
+
+
 def refine(state: TerraformRAGState) -> TerraformRAGState:
     """
     If critique said the answer is incomplete, do a follow-up RAG with a refined question
@@ -603,15 +772,7 @@ def refine(state: TerraformRAGState) -> TerraformRAGState:
     initial_answer = state.get("rag_answer", "")
     critique_text = state.get("critique", "")
 
-    # Refined question: ask for supplemental info based on critique
-    refine_prompt = (
-        f"Original question: {question}\n\n"
-        f"Initial answer (may be incomplete): {initial_answer}\n\n"
-        f"Critique: {critique_text}\n\n"
-        "Generate a more specific follow-up question to retrieve missing information. "
-        "One short question only, no explanation."
-    )
-    messages = [HumanMessage(content=refine_prompt)]
+    messages = [HumanMessage(content=_follow_up_prompt(question, initial_answer, critique_text))]
     response = llm.invoke(messages)
     follow_up = response.content if hasattr(response, "content") else str(response)
     follow_up = follow_up.strip().strip('"').strip("'")[:200]
@@ -620,14 +781,8 @@ def refine(state: TerraformRAGState) -> TerraformRAGState:
     supplemental = terraform_rag_query.invoke({"question": follow_up})
 
     # Synthesize combined answer
-    synthesize_prompt = (
-        f"Original question: {question}\n\n"
-        f"Initial answer: {initial_answer}\n\n"
-        f"Supplemental info (from follow-up): {supplemental}\n\n"
-        "Combine into one complete, concise answer. Do not repeat yourself."
-    )
-    messages = [HumanMessage(content=synthesize_prompt)]
-    response = llm.invoke(messages)
+    messages = [HumanMessage(content=_refined_synthesis_prompt(question, initial_answer, supplemental))]
+    response = _final_answer_llm().invoke(messages)
     refined = response.content if hasattr(response, "content") else str(response)
 
     return {"refined_answer": refined, "trace": [f"[refine] Synthesized {len(refined)} chars"]}
@@ -648,11 +803,16 @@ def format_final(state: TerraformRAGState) -> TerraformRAGState:
 # ---------------------------------------------------------------------------
 
 
-def route_after_router(state: TerraformRAGState) -> Literal["decompose", "rag_retrieve"]:
-    """Analysis -> multi-query path. Simple/complex -> single RAG path."""
+def route_after_router(state: TerraformRAGState) -> Literal["multi_rag_retrieve", "rag_retrieve", "format_final"]:
+    """
+    Analysis -> multi-query path (decomposition and retrieval pipelined in one node).
+    Lookup -> already answered from the graph. Simple/complex -> single RAG path.
+    """
     route = state.get("route", "simple")
     if route == "analysis":
-        return "decompose"
+        return "multi_rag_retrieve"
+    if route == "lookup":
+        return "format_final"
     return "rag_retrieve"
 
 
@@ -699,30 +859,176 @@ def refine_then_format(state: TerraformRAGState) -> TerraformRAGState:
     return result
 
 
+# ---------------------------------------------------------------------------
+# Async nodes (used by the graph from build_terraform_langgraph(use_async=True));
+# mock mode defers to the sync nodes so both modes return identical output
+# ---------------------------------------------------------------------------
+
+
+async def arag_retrieve(state: TerraformRAGState) -> TerraformRAGState:
+    if state.get("mock"):
+        return rag_retrieve(state)
+
+    answer = await aterraform_rag_query(state["question"])
+    return {"rag_answer": answer, "trace": [f"[rag] Retrieved answer ({len(answer)} chars)"]}
+
+
+async def _aretrieve_sub_answers(
+    questions: list[str], node: str, then: Optional[Callable[[], Any]] = None
+) -> list[dict[str, str]]:
+    """Async counterpart of _retrieve_sub_answers: `then` is a coroutine function returning more questions."""
+    writer = _stream_writer()
+    tasks: dict[str, asyncio.Task] = {}
+
+    async def _rag_one(sq: str) -> dict[str, str]:
+        sub_answer = {"question": sq, "answer": await aterraform_rag_query(sq)}
+        writer({"node": node, "sub_answer": sub_answer})
+        return sub_answer
+
+    def start(new_questions: list[str]) -> None:
+        for sq in new_questions:
+            if _question_key(sq) not in tasks:
+                tasks[_question_key(sq)] = asyncio.create_task(_rag_one(sq))
+
+    later = asyncio.create_task(then()) if then is not None else None
+    try:
+        start(questions)
+        asked = (await later if later is not None else []) + list(questions)
+        start(asked)
+        # llm_scheduler caps how many reach the model at once
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in [*tasks.values(), *([later] if later is not None else [])]:
+            task.cancel()
+        raise
+    return [tasks[key].result() for key in dict.fromkeys(_question_key(sq) for sq in asked)]
+
+
+async def amulti_rag_retrieve(state: TerraformRAGState) -> TerraformRAGState:
+    if state.get("mock"):
+        return multi_rag_retrieve(state)
+
+    question = state["question"]
+    sub_questions: list[str] = []
+    writer = _stream_writer()
+
+    async def decompose() -> list[str]:
+        sub_questions.extend(_parse_sub_questions(await _allm([HumanMessage(content=_decompose_prompt(question))])))
+        logger.info("[LangGraph] Decomposed into %d sub-questions: %s", len(sub_questions), sub_questions)
+        writer(_decompose_step(sub_questions))
+        return sub_questions
+
+    checklist_questions = await asyncio.to_thread(_get_connection_check_questions)
+    sub_answers = await _aretrieve_sub_answers(checklist_questions, "multi_rag_retrieve", then=decompose)
+    return _analysis_result(sub_questions, checklist_questions, sub_answers)
+
+
+async def asynthesize(state: TerraformRAGState) -> TerraformRAGState:
+    if state.get("mock"):
+        return synthesize(state)
+
+    sub_answers = state.get("sub_answers", [])
+    synthesized = await _allm([HumanMessage(content=_synthesize_prompt(state["question"], sub_answers))], final=True)
+
+    return {
+        "synthesized_answer": synthesized,
+        "trace": [f"[synthesize] Combined {len(sub_answers)} answers ({len(synthesized)} chars)"],
+    }
+
+
+async def acritique(state: TerraformRAGState) -> TerraformRAGState:
+    if state.get("mock"):
+        return critique(state)
+
+    return _critique_result(await _allm(_critique_messages(state["question"], state.get("rag_answer", ""))))
+
+
+async def arefine_then_format(state: TerraformRAGState) -> TerraformRAGState:
+    if state.get("mock"):
+        return refine_then_format(state)
+
+    question = state["question"]
+    initial_answer = state.get("rag_answer", "")
+
+    follow_up = await _allm([HumanMessage(content=_follow_up_prompt(question, initial_answer, state.get("critique", "")))])
+    follow_up = follow_up.strip().strip('"').strip("'")[:200]
+    supplemental = await aterraform_rag_query(follow_up)
+    refined = await _allm(
+        [HumanMessage(content=_refined_synthesis_prompt(question, initial_answer, supplemental))], final=True
+    )
+
+    return {
+        "refined_answer": refined,
+        "iteration": state.get("iteration", 0) + 1,
+        "trace": [f"[refine] Synthesized {len(refined)} chars"],
+    }
+
+
 # ---------------------------------------------------------------------------
 # Build the graph
 # ---------------------------------------------------------------------------
 
 
-def build_terraform_langgraph() -> StateGraph:
-    """Build and compile the LangGraph workflow."""
+def _timed_node(name: str, fn: Callable) -> Callable:
+    """
+    Wrap a node in a tracing span and time it into langgraph_node_duration_seconds
+    (the signature is kept, so LangGraph still passes config where it's declared).
+    """
+    def finish(span, result) -> None:
+        if isinstance(result, dict):
+            span.set_attribute("langgraph.trace", result.get("trace"))
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                with tracing.span(name, **{"langgraph.node": name}) as span:
+                    result = await fn(*args, **kwargs)
+                    finish(span, result)
+                outcome = "ok"
+                return result
+            finally:
+                LANGGRAPH_NODE_SECONDS.observe(time.perf_counter() - started, node=name, outcome=outcome)
+    else:
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                with tracing.span(name, **{"langgraph.node": name}) as span:
+                    result = fn(*args, **kwargs)
+                    finish(span, result)
+                outcome = "ok"
+                return result
+            finally:
+                LANGGRAPH_NODE_SECONDS.observe(time.perf_counter() - started, node=name, outcome=outcome)
+    return timed
+
+
+def build_terraform_langgraph(use_async: bool = False) -> StateGraph:
+    """Build and compile the LangGraph workflow (use_async=True for the ainvoke-based node set)."""
     builder = StateGraph(TerraformRAGState)
 
+    def add_node(name: str, fn: Callable) -> None:
+        builder.add_node(name, _timed_node(name, fn))
+
     # Nodes
-    builder.add_node("router", router)
-    builder.add_node("decompose", decompose)
-    builder.add_node("multi_rag_retrieve", multi_rag_retrieve)
-    builder.add_node("synthesize", synthesize)
-    builder.add_node("rag_retrieve", rag_retrieve)
-    builder.add_node("critique", critique)
-    builder.add_node("refine", refine_then_format)
-    builder.add_node("format_final", format_final)
+    add_node("router", router)
+    add_node("multi_rag_retrieve", amulti_rag_retrieve if use_async else multi_rag_retrieve)
+    add_node("synthesize", asynthesize if use_async else synthesize)
+    add_node("rag_retrieve", arag_retrieve if use_async else rag_retrieve)
+    add_node("critique", acritique if use_async else critique)
+    add_node("refine", arefine_then_format if use_async else refine_then_format)
+    add_node("format_final", format_final)
 
     # Edges
     builder.add_edge(START, "router")
     builder.add_conditional_edges("router", route_after_router)
-    # Analysis path: decompose -> multi_rag -> synthesize -> format_final
-    builder.add_edge("decompose", "multi_rag_retrieve")
+    # Analysis path: multi_rag_retrieve (decompose + retrieve) -> synthesize -> format_final.
+    # One node, not parallel lanes: LangGraph runs nodes in supersteps, so a sub-question
+    # couldn't start retrieving until every node of the previous step had finished
     builder.add_edge("multi_rag_retrieve", "synthesize")
     builder.add_edge("synthesize", "format_final")
     # Single RAG path
@@ -739,6 +1045,7 @@ def build_terraform_langgraph() -> StateGraph:
 # ---------------------------------------------------------------------------
 
 _graph = None
+_async_graph = None
 
 
 def get_langgraph() -> StateGraph:
@@ -749,14 +1056,16 @@ def get_langgraph() -> StateGraph:
     return _graph
 
 
-def query_with_langgraph(question: str, mock: bool = False) -> dict:
-    """
-    Run a question through the full LangGraph workflow.
-    Returns dict with final_answer, trace, route, and metadata.
-    Pass mock=True to skip real LLM/RAG calls and use deterministic canned responses.
-    """
-    graph = get_langgraph()
-    initial_state: TerraformRAGState = {
+def get_async_langgraph() -> StateGraph:
+    """Return the compiled LangGraph with async nodes, for ainvoke (cached)."""
+    global _async_graph
+    if _async_graph is None:
+        _async_graph = build_terraform_langgraph(use_async=True)
+    return _async_graph
+
+
+def _initial_state(question: str, mock: bool) -> TerraformRAGState:
+    return {
         "question": question,
         "mock": mock,
         "route": None,
@@ -772,8 +1081,8 @@ def query_with_langgraph(question: str, mock: bool = False) -> dict:
         "trace": [],
     }
 
-    result = graph.invoke(initial_state)
 
+def _graph_output(question: str, result: dict) -> dict:
     return {
         "question": question,
         "final_answer": result.get("final_answer"),
@@ -788,32 +1097,274 @@ def query_with_langgraph(question: str, mock: bool = False) -> dict:
     }
 
 
-def parse_analysis_to_resources(
-    analysis_text: str,
-    sub_answers: list[dict[str, str]] | None,
-    resource_paths: list[str],
-    mock: bool = False,
-) -> dict[str, dict[str, Any]]:
+def _serving_index_hash() -> Optional[str]:
+    rag = sys.modules.get("rag")  # not imported yet: no index has been built
+    return rag.index_graph_hash() if rag is not None else None
+
+
+def _lookup_cached_answer(question: str, mock: bool, use_cache: bool) -> tuple[Optional[tuple], Optional[dict]]:
     """
-    Parse LangGraph analysis into per-resource enrichment.
-    Returns dict: path -> { summary, issues, recommendations }
-    Pass mock=True to return deterministic canned enrichment without calling the LLM.
+    Return (cache key, cached output). The key pairs the current graph hash with the hash
+    the serving RAG index was built from, read before the run; it is None for mock runs,
+    which are never cached.
     """
-    if not resource_paths:
-        return {}
-
     if mock:
-        paths_set = set(resource_paths)
-        return {p: dict(v) for p, v in MOCK_ENRICHMENT.items() if p in paths_set}
+        return None, None
+
+    from answer_cache import answer_cache
+    from app import graph_input_hash
+
+    graph_hash = graph_input_hash()
+    key = (graph_hash, _serving_index_hash())
+    if use_cache:
+        cached = answer_cache.get("langgraph", graph_hash, question)
+        if cached is not None:
+            logger.info("[LangGraph] Answer cache hit: %s", question[:50])
+            return key, dict(cached, question=question)
+    return key, None
+
+
+def _store_answer(key: Optional[tuple], question: str, output: dict) -> None:
+    """
+    Cache the output unless the plan changed under it. Lookups answer from the current
+    graph; RAG answers come from the index that was serving when the run started, which
+    lags the files while it rebuilds (an index first built during the run is current).
+    """
+    if key is None:
+        return
+    from app import store_answer
+
+    graph_hash, index_hash = key
+    if output.get("route") != "lookup":
+        graph_hash = index_hash or _serving_index_hash()
+    store_answer("langgraph", graph_hash, question, output)
+
+
+def query_with_langgraph(question: str, mock: bool = False, use_cache: bool = True) -> dict:
+    """
+    Run a question through the full LangGraph workflow.
+    Returns dict with final_answer, trace, route, and metadata.
+    Pass mock=True to skip real LLM/RAG calls and use deterministic canned responses.
+    Non-mock results are served from / stored in the answer cache unless use_cache=False
+    (a bypassed run still refreshes the cached entry).
+    """
+    with tracing.span("langgraph.query", **{"langgraph.mock": mock}) as span:
+        cache_key, cached = _lookup_cached_answer(question, mock, use_cache)
+        span.set_attribute("langgraph.cached", cached is not None)
+        if cached is not None:
+            return cached
+
+        result = get_langgraph().invoke(_initial_state(question, mock))
+
+        output = _graph_output(question, result)
+        span.set_attribute("langgraph.route", output.get("route"))
+        _store_answer(cache_key, question, output)
+        return output
+
+
+def _message_text(message) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+
+def stream_langgraph(question: str, mock: bool = False, use_cache: bool = True):
+    """
+    Streaming query_with_langgraph(). Yields (event, data) pairs:
+      ("step", {"node", "trace"})   as each graph node completes, and for "decompose"
+                                    as soon as the sub-questions are known
+      ("sub_answer", {"node", "sub_answer"})  as each sub-question's RAG answer lands
+      ("token", {"node", "text"})   final-answer tokens as the LLM produces them
+      ("result", {...})             the same dict query_with_langgraph() returns
+    """
+    # The span stays current while the stream is consumed (nodes run inside it)
+    with tracing.span("langgraph.query", **{"langgraph.mock": mock, "langgraph.stream": True}) as span:
+        cache_key, cached = _lookup_cached_answer(question, mock, use_cache)
+        span.set_attribute("langgraph.cached", cached is not None)
+        if cached is not None:
+            yield "result", cached
+            return
+
+        result: dict = {}
+        for mode, chunk in get_langgraph().stream(
+            _initial_state(question, mock),
+            config={"configurable": {"stream_tokens": True}},
+            stream_mode=["updates", "messages", "custom", "values"],
+        ):
+            if mode == "updates":
+                for node, update in chunk.items():
+                    if update:
+                        yield "step", {"node": node, "trace": update.get("trace", [])}
+            elif mode == "messages":
+                message, metadata = chunk
+                text = _message_text(message)
+                if text and FINAL_ANSWER_TAG in (metadata.get("tags") or []):
+                    yield "token", {"node": metadata.get("langgraph_node"), "text": text}
+            elif mode == "custom":
+                if "sub_answer" in chunk:
+                    yield "sub_answer", chunk
+                elif "trace" in chunk:
+                    yield "step", chunk
+                else:
+                    yield "token", chunk
+            else:
+                result = chunk
+
+        output = _graph_output(question, result)
+        span.set_attribute("langgraph.route", output.get("route"))
+        _store_answer(cache_key, question, output)
+        yield "result", output
+
+
+async def aquery_with_langgraph(question: str, mock: bool = False, use_cache: bool = True) -> dict:
+    """
+    Async query_with_langgraph: runs the workflow with ainvoke, async LLM and RAG clients.
+    Sub-questions run as coroutines; their model calls share the process-wide llm_scheduler.
+    """
+    with tracing.span("langgraph.query", **{"langgraph.mock": mock, "langgraph.async": True}) as span:
+        cache_key, cached = _lookup_cached_answer(question, mock, use_cache)
+        span.set_attribute("langgraph.cached", cached is not None)
+        if cached is not None:
+            return cached
+
+        result = await get_async_langgraph().ainvoke(_initial_state(question, mock))
+
+        output = _graph_output(question, result)
+        span.set_attribute("langgraph.route", output.get("route"))
+        _store_answer(cache_key, question, output)
+        return output
+
+
+# ---------------------------------------------------------------------------
+# Per-resource enrichment (/api/graph4): resource paths are sharded so each LLM
+# call returns a small JSON object, shards run concurrently, and only shards
+# whose output failed to parse (e.g. truncated) are retried
+# ---------------------------------------------------------------------------
+
+ENRICH_SHARD_SIZE = int(os.environ.get("ENRICH_SHARD_SIZE", "20"))
+ENRICH_CONCURRENCY = int(os.environ.get("ENRICH_CONCURRENCY", "4"))
+ENRICH_MAX_RETRIES = int(os.environ.get("ENRICH_MAX_RETRIES", "2"))
+
+
+class EnrichmentParseError(ValueError):
+    """The LLM's enrichment output for a shard was not a JSON object."""
+
+
+def _module_of(path: str) -> str:
+    """Module prefix of a resource path ('' for root), e.g. module.vpc.aws_subnet.a -> module.vpc."""
+    parts = path.split(".")
+    for i, part in enumerate(parts):
+        if part.startswith("aws_"):
+            return ".".join(parts[:i])
+    return ".".join(parts[:-1])
 
-    # Build context from sub_answers if available
-    sub_context = ""
-    if sub_answers:
-        chunks = [f"Q: {a.get('question', '')}\nA: {a.get('answer', '')}" for a in sub_answers]
-        sub_context = "\n\n".join(chunks)
 
+def _resource_groups(resource_paths: list[str], nodes: dict[str, Any] | None) -> list[list[str]]:
+    """
+    Group paths that the LLM should see together: connected components of the
+    resource graph when nodes are given, otherwise the Terraform module. Groups
+    keep the order of resource_paths.
+    """
+    paths_set = set(resource_paths)
+    parent = {p: p for p in resource_paths}
+
+    def find(p: str) -> str:
+        while parent[p] != p:
+            parent[p] = parent[parent[p]]
+            p = parent[p]
+        return p
+
+    if nodes:
+        for path in resource_paths:
+            node_data = nodes.get(path) or {}
+            for target in list(node_data.get("edges_new", [])) + list(node_data.get("edges_existing", [])):
+                if target in paths_set:
+                    parent[find(target)] = find(path)
+    else:
+        first_in_module: dict[str, str] = {}
+        for path in resource_paths:
+            parent[path] = first_in_module.setdefault(_module_of(path), path)
+
+    groups: dict[str, list[str]] = {}
+    for path in resource_paths:
+        groups.setdefault(find(path), []).append(path)
+    return list(groups.values())
+
+
+def shard_resource_paths(
+    resource_paths: list[str],
+    nodes: dict[str, Any] | None = None,
+    shard_size: int | None = None,
+) -> list[list[str]]:
+    """Pack resource groups into shards of at most shard_size paths; oversized groups are split."""
+    shard_size = max(1, shard_size or ENRICH_SHARD_SIZE)
+    shards: list[list[str]] = []
+    current: list[str] = []
+    for group in _resource_groups(resource_paths, nodes):
+        for start in range(0, len(group), shard_size):
+            chunk = group[start:start + shard_size]
+            if len(current) + len(chunk) > shard_size:
+                shards.append(current)
+                current = []
+            current.extend(chunk)
+    if current:
+        shards.append(current)
+    return shards
+
+
+def _shard_pattern(resource_paths: list[str]) -> re.Pattern:
+    """
+    Matches a mention of any of the shard's resources: its address, type.name, name,
+    type, and the type in words ("lambda function") or by service ("lambda", "sqs").
+    """
+    terms: set[str] = set()
+    for path in resource_paths:
+        parts = path.split(".")
+        i = next((i for i, part in enumerate(parts) if part.startswith("aws_")), max(len(parts) - 2, 0))
+        rtype, name = parts[i], ".".join(parts[i + 1:])
+        words = rtype.removeprefix("aws_").split("_")
+        terms.update({path, rtype, " ".join(words), words[0]})
+        if name:
+            terms.add(f"{rtype}.{name}")
+        if len(name) >= 3:
+            terms.add(name)
+    alternatives = "|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True) if t)
+    return re.compile(rf"(?<![\w.])(?:{alternatives})(?!\w)", re.IGNORECASE)
+
+
+def _mentioning(text: str, pattern: re.Pattern) -> str:
+    """The lines of text that match pattern, each under its closest markdown heading."""
+    kept: list[str] = []
+    heading = None
+    for line in text.splitlines():
+        if pattern.search(line):
+            if heading is not None:
+                kept.append(heading)
+                heading = None
+            kept.append(line)
+        elif line.lstrip().startswith("#"):
+            heading = line
+    return "\n".join(kept)
+
+
+def _shard_context(
+    analysis_text: str, sub_answers: list[dict[str, str]] | None, resource_paths: list[str]
+) -> tuple[str, str]:
+    """The analysis and sub-answer lines about this shard's resources (the rest is another shard's concern)."""
+    pattern = _shard_pattern(resource_paths)
+    chunks = []
+    for a in sub_answers or []:
+        question, answer = a.get("question", ""), a.get("answer", "")
+        lines = _mentioning(answer, pattern)
+        if lines or pattern.search(question):
+            chunks.append(f"Q: {question}\nA: {lines or answer}")
+    return _mentioning(analysis_text, pattern), "\n\n".join(chunks)
+
+
+def _enrichment_prompt(analysis_text: str, sub_context: str, resource_paths: list[str]) -> str:
     paths_json = json.dumps(resource_paths)
-    prompt = f"""Given this Terraform infrastructure analysis:
+    return f"""Given these excerpts of a Terraform infrastructure analysis:
 
 === SYNTHESIZED ANALYSIS ===
 {analysis_text}
@@ -837,8 +1388,9 @@ Rules:
 - Use empty arrays for issues/recommendations if none
 - Return valid JSON only, no markdown or extra text"""
 
-    response = llm.invoke([HumanMessage(content=prompt)])
-    text = response.content if hasattr(response, "content") else str(response)
+
+def _parse_enrichment(text: str, resource_paths: list[str]) -> dict[str, dict[str, Any]]:
+    """Validate the LLM's JSON against the shard's paths; raises EnrichmentParseError on bad output."""
     text = text.strip()
 
     # Extract JSON (handle markdown code blocks)
@@ -848,22 +1400,95 @@ Rules:
 
     try:
         parsed = json.loads(text)
-        if isinstance(parsed, dict):
-            # Validate structure and ensure paths exist
-            result: dict[str, dict[str, Any]] = {}
-            paths_set = set(resource_paths)
-            for path, val in parsed.items():
-                if path in paths_set and isinstance(val, dict):
-                    result[path] = {
-                        "summary": val.get("summary", ""),
-                        "issues": val.get("issues", []) if isinstance(val.get("issues"), list) else [],
-                        "recommendations": val.get("recommendations", []) if isinstance(val.get("recommendations"), list) else [],
-                    }
-            return result
-    except json.JSONDecodeError:
-        logger.warning("[LangGraph] Failed to parse analysis JSON: %s", text[:200])
+    except json.JSONDecodeError as e:
+        raise EnrichmentParseError(f"invalid JSON ({e}): {text[:200]}") from e
+    if not isinstance(parsed, dict):
+        raise EnrichmentParseError(f"expected a JSON object, got {type(parsed).__name__}")
+
+    result: dict[str, dict[str, Any]] = {}
+    paths_set = set(resource_paths)
+    for path, val in parsed.items():
+        if path in paths_set and isinstance(val, dict):
+            result[path] = {
+                "summary": val.get("summary", ""),
+                "issues": val.get("issues", []) if isinstance(val.get("issues"), list) else [],
+                "recommendations": val.get("recommendations", []) if isinstance(val.get("recommendations"), list) else [],
+            }
+    return result
+
+
+def _enrich_shard(
+    analysis_text: str, sub_answers: list[dict[str, str]] | None, resource_paths: list[str]
+) -> dict[str, dict[str, Any]]:
+    analysis_part, sub_context = _shard_context(analysis_text, sub_answers, resource_paths)
+    if not analysis_part and not sub_context:
+        # Nothing mentions these resources, so there is nothing to extract
+        return {}
+    response = llm.invoke([HumanMessage(content=_enrichment_prompt(analysis_part, sub_context, resource_paths))])
+    return _parse_enrichment(_message_text(response), resource_paths)
+
+
+def parse_analysis_to_resources(
+    analysis_text: str,
+    sub_answers: list[dict[str, str]] | None,
+    resource_paths: list[str],
+    mock: bool = False,
+    nodes: dict[str, Any] | None = None,
+    on_shard: Callable[[dict[str, dict[str, Any]]], None] | None = None,
+) -> dict[str, dict[str, Any]]:
+    """
+    Parse LangGraph analysis into per-resource enrichment.
+    Returns dict: path -> { summary, issues, recommendations }
+    Pass nodes (the graph3 nodes) to shard by connected component instead of by module.
+    Each shard's prompt carries only the analysis and sub-answer lines that mention its resources.
+    on_shard, if given, is called with each shard's enrichment as it lands.
+    Pass mock=True to return deterministic canned enrichment without calling the LLM.
+    """
+    if not resource_paths:
+        return {}
+
+    if mock:
+        paths_set = set(resource_paths)
+        result = {p: dict(v) for p, v in MOCK_ENRICHMENT.items() if p in paths_set}
+        if on_shard:
+            on_shard(result)
+        return result
+
+    pending = shard_resource_paths(resource_paths, nodes)
+    logger.info("[LangGraph] Enriching %d resources in %d shards", len(resource_paths), len(pending))
+    result: dict[str, dict[str, Any]] = {}
+
+    for attempt in range(ENRICH_MAX_RETRIES + 1):
+        failed: list[list[str]] = []
+        with ThreadPoolExecutor(max_workers=max(1, min(ENRICH_CONCURRENCY, len(pending)))) as executor:
+            # Copy the context so the caller's LLM priority (batch for /api/graph4) follows each shard
+            futures = {
+                executor.submit(contextvars.copy_context().run, _enrich_shard, analysis_text, sub_answers, shard): i
+                for i, shard in enumerate(pending)
+            }
+            for future in as_completed(futures):
+                shard = pending[futures[future]]
+                try:
+                    shard_result = future.result()
+                except Exception as e:
+                    logger.warning("[LangGraph] Enrichment shard of %d resources failed: %s", len(shard), e)
+                    failed.append(shard)
+                    continue
+                result.update(shard_result)
+                if on_shard:
+                    on_shard(shard_result)
+
+        if not failed:
+            break
+        # Halve failed shards before retrying: a truncated response usually means too many paths
+        pending = [half for shard in failed for half in (shard[: (len(shard) + 1) // 2], shard[(len(shard) + 1) // 2:]) if half]
+        if attempt < ENRICH_MAX_RETRIES:
+            logger.info("[LangGraph] Retrying %d failed enrichment shards", len(pending))
+    else:
+        logger.warning("[LangGraph] Gave up on %d resources after %d retries", sum(map(len, pending)), ENRICH_MAX_RETRIES)
 
-    return {}
+    # Preserve order of resource_paths
+    return {p: result[p] for p in resource_paths if p in result}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+"""
+Answer cache for the query endpoints.
+
+Answers are keyed on (namespace, graph content hash, normalized question), so a
+plan change never serves a stale answer and "What depends on the S3 bucket?" /
+"what depends on the s3 bucket" share one entry. Optionally, a near-duplicate
+phrasing can also hit when its question embedding is within a cosine-similarity
+threshold of a cached question for the same graph. Entries expire after a TTL
+and the least recently used entry is evicted once the cache is full.
+"""
+
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+# Cosine similarity needed for a near-duplicate question to hit (0 = exact matches only)
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.environ.get("ANSWER_CACHE_SEMANTIC_THRESHOLD", "0"))
+
+
+def normalize_question(question: str) -> str:
+    """Lower-case, collapse whitespace and drop trailing punctuation."""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?!. ")
+
+
+def _cosine(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class AnswerCache:
+    """Thread-safe TTL + LRU answer cache with optional embedding-similarity matching."""
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_seconds: float = 3600,
+        similarity_threshold: float = 0.0,
+        embed_fn: Optional[Callable[[str], list[float]]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._threshold = similarity_threshold
+        self._embed_fn = embed_fn
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> {"value", "expires_at", "embedding"}
+        self._entries: OrderedDict[tuple[str, str, str], dict[str, Any]] = OrderedDict()
+        self._stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self._threshold > 0 and self._embed_fn is not None
+
+    def _embed(self, text: str) -> Optional[list[float]]:
+        try:
+            return self._embed_fn(text)
+        except Exception:
+            logger.exception("[answer-cache] Embedding failed; falling back to exact matching")
+            return None
+
+    def _expire(self, now: float) -> None:
+        expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def get(self, namespace: str, graph_hash: str, question: str) -> Optional[Any]:
+        """Return the cached answer for this question against this graph, or None."""
+        key = (namespace, graph_hash, normalize_question(question))
+        with self._lock:
+            self._expire(self._clock())
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry["value"]
+            has_candidates = any(k[:2] == key[:2] for k in self._entries)
+
+        if self.semantic_enabled and has_candidates:
+            embedding = self._embed(key[2])
+            if embedding is not None:
+                with self._lock:
+                    best_key, best_score = None, self._threshold
+                    for other_key, entry in self._entries.items():
+                        if other_key[:2] != key[:2] or entry["embedding"] is None:
+                            continue
+                        score = _cosine(embedding, entry["embedding"])
+                        if score >= best_score:
+                            best_key, best_score = other_key, score
+                    if best_key is not None:
+                        self._entries.move_to_end(best_key)
+                        self._stats["semantic_hits"] += 1
+                        logger.info("[answer-cache] Semantic hit %.3f: %r ~ %r", best_score, key[2], best_key[2])
+                        return self._entries[best_key]["value"]
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def contains(self, namespace: str, graph_hash: str, question: str) -> bool:
+        """Exact-match membership check that doesn't touch LRU order or hit/miss stats."""
+        key = (namespace, graph_hash, normalize_question(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry["expires_at"] > self._clock()
+
+    def put(self, namespace: str, graph_hash: str, question: str, value: Any) -> None:
+        key = (namespace, graph_hash, normalize_question(question))
+        embedding = self._embed(key[2]) if self.semantic_enabled else None
+        with self._lock:
+            now = self._clock()
+            self._entries[key] = {"value": value, "expires_at": now + self._ttl, "embedding": embedding}
+            self._entries.move_to_end(key)
+            self._expire(now)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+
+def _embed_question(text: str) -> list[float]:
+    from rag import get_embed_model
+
+    return get_embed_model().get_query_embedding(text)
+
+
+# Shared by /api/query and query_with_langgraph()
+answer_cache = AnswerCache(
+    max_entries=ANSWER_CACHE_SIZE,
+    ttl_seconds=ANSWER_CACHE_TTL,
+    similarity_threshold=ANSWER_CACHE_SEMANTIC_THRESHOLD,
+    embed_fn=_embed_question,
+)
@@ -1,17 +1,32 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, has_request_context, jsonify, request, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 from terraformPlan import TerraformPlan
+from answer_cache import answer_cache
+from llm_scheduler import embed_scheduler, llm_priority, llm_scheduler
+from jobs import JobManager, JobStore
+import metrics
+from metrics import HTTP_IN_FLIGHT, HTTP_REQUEST_SECONDS, HTTP_REQUESTS, stats_family
+from graph_profile import PipelineProfiler, no_stage
+import graph_provider
+import graph_profile
+import graph_store
+import workspaces
+from workspaces import DEFAULT_WORKSPACE, UploadTooLarge, WorkspaceNotFound
+import hashlib
 import json
 from pprint import pprint
 import os
 from collections import defaultdict
 import traceback
 import re
+import sys
 import tempfile
+import time
 import pydot
 import networkx as nx
-from sqlalchemy import create_engine, Column, Integer, Text, DateTime
-from sqlalchemy.orm import declarative_base
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy.orm import Session, declarative_base
 from sqlalchemy.sql import func
 
 Base = declarative_base()
@@ -45,18 +60,168 @@ class ContextMenu(Base):
     created_at = Column(DateTime, server_default=func.now())
 
 
+class GraphEnrichment(Base):
+    """Finished /api/graph4 output, keyed by the graph inputs' content hash."""
+    __tablename__ = 'graph_enrichments'
+    graph_hash = Column(String(64), primary_key=True)
+    data = Column(Text)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+GRAPH_DB_PATH = os.environ.get(
+    "GRAPH_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'graph.db')
+)
+_db_engine = None
+
+
+def get_db_engine():
+    """SQLAlchemy engine for graph.db, created (with its tables) on first use."""
+    global _db_engine
+    if _db_engine is None:
+        engine = create_engine(f'sqlite:///{GRAPH_DB_PATH}')
+        Base.metadata.create_all(engine)
+        _db_engine = engine
+    return _db_engine
+
+
 def init_db():
     """Create SQLite database with empty tables for graph state using SQLAlchemy."""
-    db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'graph.db')
-    engine = create_engine(f'sqlite:///{db_path}')
-    Base.metadata.create_all(engine)
+    Base.metadata.create_all(get_db_engine())
+
+
+def load_enrichment(graph_hash):
+    """Stored /api/graph4 nodes for this graph hash, or None."""
+    with Session(get_db_engine()) as session:
+        row = session.get(GraphEnrichment, graph_hash)
+        return json.loads(row.data) if row is not None else None
+
+
+def save_enrichment(graph_hash, nodes):
+    with Session(get_db_engine()) as session:
+        session.merge(GraphEnrichment(graph_hash=graph_hash, data=json.dumps(nodes)))
+        session.commit()
+
+
+# Inputs read by build_graph3_nodes(); the RAG index is rebuilt when these change
+PLAN_FILE = 'planexisting-larger.json'
+DOT_FILE = 'graphexisting.dot'
+
+
+def graph_input_paths():
+    """(plan, DOT) paths of the request's workspace: PLAN_FILE / DOT_FILE next to this module by default."""
+    workspace_id = workspaces.current_workspace()
+    if workspace_id == DEFAULT_WORKSPACE:
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        return os.path.join(current_dir, PLAN_FILE), os.path.join(current_dir, DOT_FILE)
+    workspace = workspaces.registry.get(workspace_id)
+    return workspace.plan_path, workspace.dot_path
+
+
+def graph_input_fingerprint():
+    """Return (path, mtime_ns, size) for each graph input file — changes whenever the plan or DOT changes."""
+    fingerprint = []
+    for path in graph_input_paths():
+        try:
+            st = os.stat(path)
+            fingerprint.append((path, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            fingerprint.append((path, None, None))
+    return tuple(fingerprint)
+
+
+_graph_input_hashes = {}  # workspace -> (fingerprint, sha256 hex)
+
+
+def graph_input_version():
+    """(fingerprint, sha256) of the graph input files, the hash only recomputed when the fingerprint changes."""
+    workspace_id = workspaces.current_workspace()
+    fingerprint = graph_input_fingerprint()
+    cached_fingerprint, digest = _graph_input_hashes.get(workspace_id, (None, None))
+    if cached_fingerprint == fingerprint:
+        return fingerprint, digest
+
+    sha = hashlib.sha256()
+    # Labelled by role rather than path, so identical inputs hash the same in every workspace
+    for name, path in zip((PLAN_FILE, DOT_FILE), graph_input_paths()):
+        sha.update(name.encode())
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+    digest = sha.hexdigest()
+    _graph_input_hashes[workspace_id] = (fingerprint, digest)
+    return fingerprint, digest
+
+
+def graph_input_hash():
+    """sha256 over the graph input files' contents; only re-hashed when their fingerprint changes."""
+    return graph_input_version()[1]
+
+
+def serving_graph_hash():
+    """
+    Hash of the inputs the RAG index now answering queries was built from (None before
+    the first build). A plan change doesn't swap the index until its rebuild finishes,
+    so answers are stored under this, not under graph_input_hash().
+    """
+    from rag import index_graph_hash
+
+    return index_graph_hash()
 
 
 app = Flask(__name__)
 app.json.sort_keys = False
 app.config["JSONIFY_PRETTYPRINT_REGULAR"] = True
+# Request bodies past this are refused before they are read (uploads are the only large ones)
+app.config["MAX_CONTENT_LENGTH"] = int(workspaces.UPLOAD_MAX_REQUEST_MB * 1024 * 1024)
 CORS(app)  # Enable CORS for all routes
 
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_route = request.url_rule.rule if request.url_rule else "unmatched"
+    g.metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc(route=g.metrics_route)
+
+
+@app.before_request
+def select_workspace():
+    """Serve the request from ?workspace= (or a JSON body's "workspace"); unknown workspaces are a 404."""
+    workspace_id = request.args.get("workspace")
+    if workspace_id is None and request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            workspace_id = body.get("workspace")
+    workspace_id = workspace_id or DEFAULT_WORKSPACE
+    if workspace_id != DEFAULT_WORKSPACE and not workspaces.registry.exists(str(workspace_id)):
+        return jsonify({"error": f"Unknown workspace {workspace_id}"}), 404
+    g.workspace_token = workspaces.set_current_workspace(workspace_id)
+
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def reset_workspace(exc):
+    token = g.pop("workspace_token", None)
+    if token is not None:
+        workspaces.reset_current_workspace(token)
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    # Runs once the response is sent; streamed responses (stream_with_context) keep the request open until they end
+    route = g.pop("metrics_route", None)
+    if route is None:
+        return
+    HTTP_IN_FLIGHT.dec(route=route)
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.pop("metrics_started"), method=request.method, route=route)
+    HTTP_REQUESTS.inc(method=request.method, route=route, status=g.pop("metrics_status", 500))
+
+
 @app.route('/')
 def home():
     return jsonify({
@@ -64,6 +229,224 @@ def home():
         "message": "Flask backend is running!"
     })
 
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests (index state included for visibility)."""
+    from rag import get_index_status
+
+    return jsonify({"status": "ok", "index": get_index_status(), "graph": graph_provider.stats()})
+
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 200 once the RAG index is built, 503 while it is cold/building/failed."""
+    from rag import get_index_status
+
+    status = get_index_status()
+    return jsonify({"status": "ready" if status["ready"] else "not ready", "index": status}), (200 if status["ready"] else 503)
+
+
+@app.route('/api/llm/scheduler')
+def llm_scheduler_stats():
+    """Outbound call scheduler state: in-flight / queued calls, retries, and queue wait per priority."""
+    return jsonify({"llm": llm_scheduler.stats(), "embed": embed_scheduler.stats()})
+
+
+def collect_app_metrics():
+    """Expose the counters the scheduler, caches, graph, index and job modules already keep."""
+    from llm_cache import llm_response_cache
+
+    families = []
+    schedulers = {"llm": llm_scheduler.stats(), "embed": embed_scheduler.stats()}
+    for key in ("calls", "retries", "rate_limited", "failures"):
+        families.append(stats_family(
+            f"llm_scheduler_{key}_total", f"Scheduler {key.replace('_', ' ')} since startup.",
+            [({"scheduler": name}, s[key]) for name, s in schedulers.items()], type="counter",
+        ))
+    families.append(stats_family("llm_scheduler_active", "Calls holding a scheduler slot.",
+                                 [({"scheduler": name}, s["active"]) for name, s in schedulers.items()]))
+    families.append(stats_family("llm_scheduler_queued", "Calls waiting for a scheduler slot.",
+                                 [({"scheduler": name}, s["queued"]) for name, s in schedulers.items()]))
+    families.append(stats_family(
+        "llm_scheduler_queue_wait_seconds_total", "Total time calls waited for a slot, by priority.",
+        [({"scheduler": name, "priority": p}, w["total_wait"]) for name, s in schedulers.items()
+         for p, w in s["queue_wait"].items()], type="counter",
+    ))
+
+    caches = {"answer": answer_cache.stats(), "llm_response": llm_response_cache.stats()}
+    for key in ("hits", "semantic_hits", "misses", "evictions", "writes"):
+        families.append(stats_family(
+            f"cache_{key}_total", f"Cache {key.replace('_', ' ')} since startup.",
+            [({"cache": name}, c.get(key)) for name, c in caches.items()], type="counter",
+        ))
+    families.append(stats_family("cache_entries", "Entries held per cache.",
+                                 [({"cache": name}, c["entries"]) for name, c in caches.items()]))
+
+    graph = graph_provider.stats()
+    families.append(stats_family("graph_builds_total", "Shared graph builds since startup.", [({}, graph["builds"])],
+                                 type="counter"))
+    families.append(stats_family("graph_resource_paths", "Resource paths in the shared graph.",
+                                 [({}, graph["resource_paths"])]))
+    families.append(stats_family("graph_build_seconds", "Duration of the shared graph's last build.",
+                                 [({}, graph["build_seconds"])]))
+    stages = graph_profile.metrics()
+    families.append(stats_family(
+        "graph_stage_seconds_total", "Graph pipeline stage wall time since startup.",
+        [({"pipeline": p, "stage": name}, m["wall_seconds_sum"]) for p, st in stages.items() for name, m in st.items()],
+        type="counter",
+    ))
+    families.append(stats_family(
+        "graph_stage_runs_total", "Graph pipeline stage runs since startup.",
+        [({"pipeline": p, "stage": name}, m["count"]) for p, st in stages.items() for name, m in st.items()],
+        type="counter",
+    ))
+
+    # Only once something imported rag: a scrape shouldn't load the embedding stack
+    rag = sys.modules.get("rag")
+    if rag is not None:
+        status = rag.get_index_status()
+        families.append(stats_family("rag_index_ready", "1 when the RAG index can serve queries.",
+                                     [({"state": status["state"]}, status["ready"])]))
+
+    families.append(stats_family("jobs", "Background jobs in the shared job store, by status.",
+                                 [({"manager": manager.name, "status": st}, n)
+                                  for manager in (graph4_jobs, workspace_jobs) for st, n in manager.stats().items()]))
+    return families
+
+
+metrics.REGISTRY.register_collector(collect_app_metrics)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint (text exposition format)."""
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route('/api/graph/metrics')
+def graph_metrics():
+    """Graph pipeline stage timings aggregated since startup, plus the shared graph's state."""
+    return jsonify({
+        "stages": graph_profile.metrics(),
+        "graph": graph_provider.stats(),
+        "workspaces": workspaces.registry.stats(),
+    })
+
+
+@app.route('/api/workspaces')
+def list_workspaces():
+    """Registered workspaces; any other route serves one of them with ?workspace=<id>."""
+    return jsonify({"workspaces": [w.to_dict() for w in workspaces.registry.list()]})
+
+
+@app.route('/api/workspaces/<workspace_id>', methods=['GET', 'PUT', 'DELETE'])
+def workspace(workspace_id):
+    """
+    GET: the workspace and its index status.
+    PUT: register (or re-point) it; body {"plan_path": ..., "dot_path": ...} naming files on this host.
+    DELETE: unregister it and delete its persisted index.
+    """
+    try:
+        if request.method == 'PUT':
+            body = request.get_json(silent=True) or {}
+            if not body.get("plan_path") or not body.get("dot_path"):
+                return jsonify({"error": "plan_path and dot_path are required"}), 400
+            ws = workspaces.registry.register(workspace_id, body["plan_path"], body["dot_path"])
+            return jsonify(ws.to_dict()), 201
+        if request.method == 'DELETE':
+            workspaces.registry.remove(workspace_id)
+            return "", 204
+        ws = workspaces.registry.get(workspace_id)
+        return jsonify({**ws.to_dict(), "index": workspaces.registry.index_status(workspace_id)})
+    except WorkspaceNotFound:
+        return jsonify({"error": f"Unknown workspace {workspace_id}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
+
+
+# Seconds a query waits for the RAG index before getting a 503 (0 = fail fast)
+RAG_READY_TIMEOUT = float(os.environ.get("RAG_READY_TIMEOUT", "5"))
+
+
+def require_rag_index():
+    """
+    Make sure the RAG index is warm (kicking off a background build if cold or stale).
+    Returns None when queries can be served, else a 503 response to return as-is.
+    """
+    from rag import start_index_warmup, wait_for_index, get_index_status
+
+    start_index_warmup()
+    if wait_for_index(RAG_READY_TIMEOUT):
+        return None
+
+    response = jsonify({"error": "RAG index is not ready yet, retry shortly.", "index": get_index_status()})
+    response.status_code = 503
+    response.headers["Retry-After"] = "5"
+    return response
+
+
+def langgraph_needs_index(question, mock, use_cache):
+    """A LangGraph query waits for the RAG index unless it is mock, cached, or answered from the graph."""
+    from LangGraph import answered_from_graph
+
+    if mock or (use_cache and answer_cache.contains("langgraph", graph_input_hash(), question)):
+        return False
+    return not answered_from_graph(question)
+
+
+def cache_requested(body):
+    """Query bodies may pass "cache": false to bypass the answer cache (a fresh answer is still stored)."""
+    return body.get("cache", True) is not False
+
+
+def store_answer(namespace, graph_hash, question, payload):
+    """
+    Cache an answer computed by the index built from graph_hash (serving_graph_hash(),
+    read before the query) — only while that is still the current plan; an answer from
+    an index that is being rebuilt is returned but not cached.
+    """
+    if graph_hash is not None and graph_hash == graph_input_hash():
+        answer_cache.put(namespace, graph_hash, question, payload)
+
+
+def cached_answer_response(namespace, question, body):
+    """Return a response for a cached answer to this question against the current graph, else None."""
+    if not cache_requested(body):
+        return None
+    cached = answer_cache.get(namespace, graph_input_hash(), question)
+    if cached is None:
+        return None
+    # A semantic hit was stored for a differently worded question
+    response = jsonify(dict(cached, question=question))
+    response.headers["X-Answer-Cache"] = "hit"
+    return response
+
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    """Stream (event, data) pairs as text/event-stream; a failure mid-stream becomes a final "error" event."""
+    def generate():
+        try:
+            for event, data in events:
+                yield sse_event(event, data)
+        except Exception as e:
+            traceback.print_exc()
+            yield sse_event("error", {"error": str(e), "trace": traceback.format_exc()})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route('/api/data')
 def get_data():
     return jsonify({
@@ -180,9 +563,8 @@ def get_graph():
     return jsonify(nodes)
 
 def get_adjacency_list_from_dot():
-
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(current_dir, 'graphexisting.dot')
+    file_path = graph_input_path(None, DOT_FILE)
     adjacency_list = defaultdict(set)
     with open(file_path, 'r') as f:
         lines = f.readlines()
@@ -211,9 +593,17 @@ def get_adjacency_list_from_dot():
 
 
 
-def load_plan_and_nodes():
+def graph_input_path(path, default_name):
+    """An explicit input path, else the request workspace's plan (PLAN_FILE) or DOT (DOT_FILE) file."""
+    if path is not None:
+        return path
+    plan_path, dot_path = graph_input_paths()
+    return plan_path if default_name == PLAN_FILE else dot_path
+
+
+def load_plan_and_nodes(plan_path=None):
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(current_dir, 'planexisting-larger.json')
+    file_path = graph_input_path(plan_path, PLAN_FILE)
     
     with open(file_path) as json_data:
         plan = json.load(json_data)
@@ -229,10 +619,12 @@ def load_plan_and_nodes():
             nodes[path]["resources"] = {}
         nodes[path]["resources"][resource_change['address']]=resource_change
 
-    output_path = os.path.join(current_dir, 'nodes.json')
-    with open(output_path, 'w') as f:
-        json.dump(nodes, f, indent=4)
-    print(f"Saved nodes to {output_path}")
+    # Debug dump of the default plan only (benchmarks pass generated plans)
+    if plan_path is None:
+        output_path = os.path.join(current_dir, 'nodes.json')
+        with open(output_path, 'w') as f:
+            json.dump(nodes, f, indent=4)
+        print(f"Saved nodes to {output_path}")
     return nodes
 
 
@@ -328,8 +720,7 @@ def compute_resource_diffs(nodes):
     return nodes
 
 def build_existing_edges(nodes):
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(current_dir, 'planexisting-larger.json')
+    file_path = graph_input_path(None, PLAN_FILE)
     
     with open(file_path) as json_data:
         plan = json.load(json_data)
@@ -360,8 +751,6 @@ def build_existing_edges(nodes):
         existingeRecursion(plan["prior_state"]["values"]["root_module"])
 
     #print(existingedges)
-    print("computed existing edges")
-    print("\n\n\n\n")
 
     for key, value in existingedges.items():
         key = re.sub(r'\[\d+\]', '', key)
@@ -476,47 +865,31 @@ def clean_up_role_links(nodes):
 def get_graph2():
     # this uses dot to dict script
     try:
-        #get edges from dot file
-        newedges = get_adjacency_list_from_dot() # edges, no index
-        #get nodes from plan with resource changes
-        nodes = load_plan_and_nodes() #resource changes nodes, use index, need to remove it
-
-        #print(newedges)
-        print("\n\n\n\n\n")
-        #print(nodes)
-        print("\n\n\n\n\n")
-
-
-        nodes = build_new_edges(nodes, newedges)
-        #print(nodes)
-        print("built new edges")
-        print("\n\n\n\n\n")
-        nodes = compute_resource_diffs(nodes)
-        #print(nodes)
-        print("computed diffs")
-        print("\n\n\n\n\n")
-        nodes = build_existing_edges(nodes)
-        #print(nodes)
-        print("computed existing edges")
-        print("\n\n\n\n\n")
-
-        nodes = ensure_edge_lists(nodes)
-        #print(nodes)
-        print("ensured edge lists")
-        print("\n\n\n\n\n")
-
-        nodes =external_resources(nodes)
-        #print(nodes)
-        print("computed external resources")
-        print("\n\n\n\n\n")
-
-        nodes = ensure_edge_lists(nodes)
-        #print(nodes)
-        print("ensured edge lists")
-        print("\n\n\n\n\n")
-        nodes = delete_orphaned_nodes(nodes)
-        nodes = clean_up_role_links(nodes)
-    
+        profile = PipelineProfiler("graph2", trace_memory=profile_memory_requested())
+        with profile:
+            #get edges from dot file
+            with profile("dot_parse") as s:
+                newedges = s.out(get_adjacency_list_from_dot()) # edges, no index
+            #get nodes from plan with resource changes
+            with profile("plan_load") as s:
+                nodes = s.out(load_plan_and_nodes()) #resource changes nodes, use index, need to remove it
+            with profile("new_edges", nodes) as s:
+                nodes = s.out(build_new_edges(nodes, newedges))
+            with profile("diffs", nodes) as s:
+                nodes = s.out(compute_resource_diffs(nodes))
+            with profile("existing_edges", nodes) as s:
+                nodes = build_existing_edges(nodes)
+                nodes = s.out(ensure_edge_lists(nodes))
+            with profile("external", nodes) as s:
+                nodes = external_resources(nodes)
+                nodes = s.out(ensure_edge_lists(nodes))
+            with profile("orphans", nodes) as s:
+                nodes = s.out(delete_orphaned_nodes(nodes))
+            with profile("role_links", nodes) as s:
+                nodes = s.out(clean_up_role_links(nodes))
+
+        if profile_requested():
+            return jsonify({"nodes": nodes, "profile": profile.summary()})
         return jsonify(nodes)
 
     except Exception as e:
@@ -524,9 +897,8 @@ def get_graph2():
         return {"error": str(e), "trace": traceback.format_exc()}
     
 
-def get_adjacency_list_from_dot_pydot():
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(current_dir, 'graphexisting.dot')
+def get_adjacency_list_from_dot_pydot(dot_path=None):
+    file_path = graph_input_path(dot_path, DOT_FILE)
 
     graphs = pydot.graph_from_dot_file(file_path)
     graph = graphs[0]
@@ -610,9 +982,8 @@ def build_new_edges_nx(nodes, newedges):
     return nodes
 
 
-def build_existing_edges_v2(nodes):
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(current_dir, 'planexisting-larger.json')
+def build_existing_edges_v2(nodes, plan_path=None):
+    file_path = graph_input_path(plan_path, PLAN_FILE)
 
     with open(file_path) as json_data:
         plan = json.load(json_data)
@@ -746,61 +1117,96 @@ def clean_up_role_links_v2(nodes):
     return nodes
 
 
-def build_graph3_nodes():
-    """Build the full processed nodes dict (reusable outside the route)."""
-    newedges = get_adjacency_list_from_dot_pydot()
-    nodes = load_plan_and_nodes()
-    nodes = build_new_edges_nx(nodes, newedges)
-    nodes = compute_resource_diffs_v2(nodes)
-    nodes = build_existing_edges_v2(nodes)
-    nodes = ensure_edge_lists(nodes)
-    nodes = external_resources_v2(nodes)
-    nodes = ensure_edge_lists(nodes)
-    nodes = delete_orphaned_nodes_v2(nodes)
-    nodes = clean_up_role_links_v2(nodes)
+def build_graph3_nodes(plan_path=None, dot_path=None, stage=None):
+    """
+    Build the full processed nodes dict (reusable outside the route).
+    Reads PLAN_FILE / DOT_FILE unless plan_path / dot_path are given. stage, if given,
+    is a graph_profile.PipelineProfiler (or anything with its call signature) wrapped
+    around each pipeline stage.
+    """
+    stage = stage or no_stage
+    with stage("dot_parse") as s:
+        newedges = s.out(get_adjacency_list_from_dot_pydot(dot_path))
+    with stage("plan_load") as s:
+        nodes = s.out(load_plan_and_nodes(plan_path))
+    with stage("new_edges", nodes) as s:
+        nodes = s.out(build_new_edges_nx(nodes, newedges))
+    with stage("diffs", nodes) as s:
+        nodes = s.out(compute_resource_diffs_v2(nodes))
+    with stage("existing_edges", nodes) as s:
+        nodes = build_existing_edges_v2(nodes, plan_path)
+        nodes = s.out(ensure_edge_lists(nodes))
+    with stage("external", nodes) as s:
+        nodes = external_resources_v2(nodes)
+        nodes = s.out(ensure_edge_lists(nodes))
+    with stage("orphans", nodes) as s:
+        nodes = s.out(delete_orphaned_nodes_v2(nodes))
+    with stage("role_links", nodes) as s:
+        nodes = s.out(clean_up_role_links_v2(nodes))
     return nodes
 
 
+def profile_requested():
+    """?profile=1 (or ?profile=memory) asks a graph route to return its stage timings with the graph."""
+    # The route functions are also called directly, outside a request
+    return has_request_context() and request.args.get("profile", "").lower() in ("1", "true", "memory")
+
+
+def profile_memory_requested():
+    """?profile=memory also traces allocations per stage (tracemalloc slows the build down noticeably)."""
+    return has_request_context() and request.args.get("profile", "").lower() == "memory"
+
+
 @app.route('/api/graph3')
 def get_graph3():
     try:
-        nodes = build_graph3_nodes()
-        return jsonify(nodes)
+        if profile_requested():
+            # A fresh build, so the timings describe this request rather than the cached graph
+            with PipelineProfiler("graph3", trace_memory=profile_memory_requested()) as profile:
+                nodes = build_graph3_nodes(stage=profile)
+            return jsonify({"nodes": nodes, "profile": profile.summary()})
+        nodes = graph_provider.get_graph().nodes
+        return jsonify(graph_store.as_dict(nodes))
 
     except Exception as e:
         traceback.print_exc()
         return {"error": str(e), "trace": traceback.format_exc()}
 
 
-@app.route('/api/graph4')
-def get_graph4():
+ANALYSIS_QUESTION = (
+    "Are there any bugs or issues in this Terraform plan? "
+    "Analyze each resource. Check for missing event source mappings, IAM gaps, "
+    "networking issues, and configuration problems."
+)
+
+
+def build_graph4_nodes(mock=False, report=None, snapshot=None):
     """
-    Same as graph3 but enriched with LangGraph analysis per resource.
-    Each resource gets an 'enrichment' field: { summary, issues, recommendations }
-    plus top-level 'langgraph' with the raw LangGraph output and parsed per-resource JSON.
-    Pass ?mock=true to skip all LLM calls and return deterministic canned data.
+    Build the graph3 nodes and enrich each resource with the LangGraph analysis.
+    report(event, data), if given, receives "stage" events and "partial" per-resource
+    enrichment as each shard lands. Non-mock callers must make sure the RAG index is ready;
+    they may pass the graph_provider snapshot to enrich.
     """
-    try:
-        mock = request.args.get("mock", "").lower() in ("true", "1")
+    from LangGraph import query_with_langgraph, parse_analysis_to_resources
 
-        from LangGraph import query_with_langgraph, parse_analysis_to_resources
+    report = report or (lambda event, data: None)
 
-        if mock:
-            import copy
-            from LangGraph import MOCK_GRAPH_NODES
-            nodes = copy.deepcopy(MOCK_GRAPH_NODES)
-        else:
-            nodes = build_graph3_nodes()
+    report("stage", {"stage": "graph"})
+    if mock:
+        import copy
+        from LangGraph import MOCK_GRAPH_NODES
+        nodes = copy.deepcopy(MOCK_GRAPH_NODES)
+    else:
+        # Private copy: enrichment below must not leak into the shared graph
+        nodes = (snapshot or graph_provider.get_graph()).mutable_nodes()
 
-        resource_paths = list(nodes.keys())
+    resource_paths = list(nodes.keys())
 
+    # Whole-plan analysis is batch work: its LLM calls queue behind interactive queries
+    with llm_priority("batch"):
         # Run LangGraph with analysis question
-        langgraph_result = query_with_langgraph(
-            "Are there any bugs or issues in this Terraform plan? "
-            "Analyze each resource. Check for missing event source mappings, IAM gaps, "
-            "networking issues, and configuration problems.",
-            mock=mock,
-        )
+        report("stage", {"stage": "analysis"})
+        langgraph_result = query_with_langgraph(ANALYSIS_QUESTION, mock=mock)
 
         analysis_text = (
             langgraph_result.get("synthesized_answer")
@@ -811,28 +1217,63 @@ def get_graph4():
         sub_answers = langgraph_result.get("sub_answers") or []
 
         # Parse analysis into per-resource enrichment (JSON)
+        report("stage", {"stage": "enrichment"})
         enrichment_by_path = parse_analysis_to_resources(
             analysis_text=analysis_text,
             sub_answers=sub_answers,
             resource_paths=resource_paths,
             mock=mock,
+            nodes=nodes,
+            on_shard=lambda shard: report("partial", shard),
         )
 
-        # Enrich each node with llm_analysis
-        for path, node_data in nodes.items():
-            enrichment = enrichment_by_path.get(path, {})
-            node_data["enrichment"] = {
-                "summary": enrichment.get("summary", ""),
-                "issues": enrichment.get("issues", []),
-                "recommendations": enrichment.get("recommendations", []),
-            }
+    # Enrich each node with llm_analysis
+    for path, node_data in nodes.items():
+        enrichment = enrichment_by_path.get(path, {})
+        node_data["enrichment"] = {
+            "summary": enrichment.get("summary", ""),
+            "issues": enrichment.get("issues", []),
+            "recommendations": enrichment.get("recommendations", []),
+        }
+
+    for path,group in nodes.items():
+        enrichment = enrichment_by_path.get(path, {})
+        nodes[path]["AI"] = {}
+        nodes[path]["AI"]["Issues"] = enrichment.get("issues", [])
+        nodes[path]["AI"]["Sumary"] = enrichment.get("summary", "")
+        nodes[path]["AI"]["Recomendations"] = enrichment.get("recommendations", [])
+
+    return nodes
+
+
+@app.route('/api/graph4')
+def get_graph4():
+    """
+    Same as graph3 but enriched with LangGraph analysis per resource.
+    Each resource gets an 'enrichment' field: { summary, issues, recommendations }
+    plus top-level 'langgraph' with the raw LangGraph output and parsed per-resource JSON.
+    Pass ?mock=true to skip all LLM calls and return deterministic canned data.
+    Live results are stored in graph.db per graph hash; ?cache=false recomputes them.
+    """
+    try:
+        mock = request.args.get("mock", "").lower() in ("true", "1")
+
+        if not mock:
+            graph_hash = graph_input_hash()
+            use_store = request.args.get("cache", "").lower() not in ("false", "0")
+            stored = load_enrichment(graph_hash) if use_store else None
+            if stored is not None:
+                response = jsonify(stored)
+                response.headers["X-Enrichment-Store"] = "hit"
+                return response
+            not_ready = require_rag_index()
+            if not_ready:
+                return not_ready
 
-        for path,group in nodes.items():
-            enrichment = enrichment_by_path.get(path, {})
-            nodes[path]["AI"] = {}
-            nodes[path]["AI"]["Issues"] = enrichment.get("issues", [])
-            nodes[path]["AI"]["Sumary"] = enrichment.get("summary", "")
-            nodes[path]["AI"]["Recomendations"] = enrichment.get("recommendations", [])
+        if mock:
+            nodes = build_graph4_nodes(mock=True)
+        else:
+            nodes = build_and_store_graph4_nodes(graph_hash)
 
         return jsonify(nodes)
 
@@ -856,6 +1297,179 @@ def get_graph4():
         return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
 
 
+def build_and_store_graph4_nodes(graph_hash, report=None):
+    """
+    Live build_graph4_nodes(), stored in graph.db under graph_hash only when both the
+    graph it enriched and the RAG index that analysed it were built from those inputs
+    and the files haven't changed since. Mid-rebuild the old index still answers, and
+    its analysis must not be stored as the new plan's.
+    """
+    index_hash = serving_graph_hash()
+    snapshot = graph_provider.get_graph()
+    nodes = build_graph4_nodes(report=report, snapshot=snapshot)
+    if index_hash == graph_hash and graph_input_version() == (snapshot.fingerprint, graph_hash):
+        save_enrichment(graph_hash, nodes)
+    else:
+        print(f"[graph4] Plan changed during the analysis; not storing it under {graph_hash[:12]}")
+    return nodes
+
+
+# Job state shared by the gunicorn workers: any of them can answer a poll, and a key runs once per host
+job_store = JobStore()
+# Concurrent /api/graph4 jobs per process (each runs the whole analysis)
+GRAPH4_JOB_WORKERS = int(os.environ.get("GRAPH4_JOB_WORKERS", "2"))
+graph4_jobs = JobManager("graph4", max_workers=GRAPH4_JOB_WORKERS, store=job_store)
+
+
+def run_graph4_job(job, mock, graph_hash, workspace_id=DEFAULT_WORKSPACE):
+    """Worker side of POST /api/graph4/jobs: wait for the index, enrich, store the result."""
+    with workspaces.use_workspace(workspace_id):
+        return _run_graph4_job(job, mock, graph_hash)
+
+
+def _run_graph4_job(job, mock, graph_hash):
+    if not mock:
+        from rag import get_index_status, start_index_warmup, wait_for_index
+
+        job.emit("stage", {"stage": "index"})
+        start_index_warmup()
+        if not wait_for_index(None):
+            raise RuntimeError(f"RAG index build failed: {get_index_status()['error']}")
+
+    if mock:
+        return build_graph4_nodes(mock=True, report=job.emit)
+    return build_and_store_graph4_nodes(graph_hash, report=job.emit)
+
+
+@app.route('/api/graph4/jobs', methods=['POST'])
+def create_graph4_job():
+    """
+    Start /api/graph4 in the background and return its job id (202) without waiting.
+    Body (or query string) may pass "mock": true and "cache": false. A result already
+    stored for this graph hash comes back as a finished job (200).
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        mock = bool(body.get("mock")) or request.args.get("mock", "").lower() in ("true", "1")
+        use_store = cache_requested(body) and request.args.get("cache", "").lower() not in ("false", "0")
+
+        workspace_id = workspaces.current_workspace()
+        graph_hash = None if mock else graph_input_hash()
+        key = "mock" if mock else graph_hash
+        stored = load_enrichment(graph_hash) if (not mock and use_store) else None
+        if stored is not None:
+            job, status = graph4_jobs.completed(key, stored), 200
+        else:
+            job, status = graph4_jobs.submit(key, lambda job: run_graph4_job(job, mock, graph_hash, workspace_id)), 202
+
+        response = jsonify(job.to_dict(include_result=False))
+        response.status_code = status
+        response.headers["Location"] = f"/api/graph4/jobs/{job.id}"
+        return response
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
+
+
+@app.route('/api/graph4/jobs/<job_id>')
+def get_graph4_job(job_id):
+    """Job status, current stage and per-resource enrichment so far; the nodes once done."""
+    job = graph4_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/graph4/jobs/<job_id>/events')
+def stream_graph4_job(job_id):
+    """Replay and follow a job as server-sent events: status, stage, partial, then result or error."""
+    job = graph4_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return sse_response(job.events())
+
+
+# Concurrent upload processing jobs (graph and index builds) per process
+WORKSPACE_JOB_WORKERS = int(os.environ.get("WORKSPACE_JOB_WORKERS", "1"))
+workspace_jobs = JobManager("workspace", max_workers=WORKSPACE_JOB_WORKERS, store=job_store)
+
+
+def run_workspace_job(job, workspace_id, build_index):
+    """Worker side of an upload: build the workspace's graph, then (unless skipped) its RAG index."""
+    with workspaces.use_workspace(workspace_id), llm_priority("batch"):
+        job.emit("stage", {"stage": "graph"})
+        snapshot = workspaces.registry.graph(workspace_id)
+        job.emit("partial", {"resources": len(snapshot.nodes)})
+        if build_index:
+            job.emit("stage", {"stage": "index"})
+            workspaces.registry.ensure_index(workspace_id)
+        return {
+            "workspace": workspace_id,
+            "graph_hash": graph_input_hash(),
+            "resources": len(snapshot.nodes),
+            "index": workspaces.registry.index_status(workspace_id),
+        }
+
+
+@app.route('/api/workspaces/<workspace_id>/upload', methods=['POST'])
+def upload_workspace(workspace_id):
+    """
+    Upload a plan into a workspace (creating it) and build its graph and RAG index in the background.
+    multipart/form-data with files "plan" (`tofu show -json`) and "dot" (`tofu graph`), each optionally
+    gzipped; form field "index=false" skips the index build. Returns 202 with a job to poll, like
+    POST /api/graph4/jobs; a second upload of the same files while it runs returns the same job.
+    """
+    max_request = app.config["MAX_CONTENT_LENGTH"]
+    too_large = {"error": f"upload is larger than {max_request // (1024 * 1024)} MB"}
+    if request.content_length is not None and request.content_length > max_request:
+        # From the header alone, before Werkzeug reads (and spools) the body
+        return jsonify(too_large), 413
+    try:
+        plan, dot = request.files.get("plan"), request.files.get("dot")
+    except RequestEntityTooLarge:
+        # A chunked body without a length, cut off at MAX_CONTENT_LENGTH
+        return jsonify(too_large), 413
+    if plan is None or dot is None:
+        return jsonify({"error": "multipart files 'plan' and 'dot' are required"}), 400
+    try:
+        # Werkzeug has already spooled file parts over 500 KB to temp files; this copies them over in chunks
+        workspaces.registry.upload(workspace_id, plan.stream, dot.stream)
+        build_index = request.form.get("index", "true").lower() not in ("false", "0")
+        with workspaces.use_workspace(workspace_id):
+            graph_hash = graph_input_hash()
+        key = f"{workspace_id}:{graph_hash}:{'index' if build_index else 'graph'}"
+        job = workspace_jobs.submit(key, lambda job: run_workspace_job(job, workspace_id, build_index))
+
+        response = jsonify({**job.to_dict(include_result=False), "workspace": workspace_id})
+        response.status_code = 202
+        response.headers["Location"] = f"/api/workspaces/jobs/{job.id}"
+        return response
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
+
+
+@app.route('/api/workspaces/jobs/<job_id>')
+def get_workspace_job(job_id):
+    """Upload job status and stage; the workspace's resource count, graph hash and index status once done."""
+    job = workspace_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/workspaces/jobs/<job_id>/events')
+def stream_workspace_job(job_id):
+    """Replay and follow an upload job as server-sent events."""
+    job = workspace_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return sse_response(job.events())
+
 
 @app.route('/api/query', methods=['POST'])
 def query_rag():
@@ -868,22 +1482,74 @@ def query_rag():
     if not question:
         return jsonify({"error": "A 'question' field is required in the JSON body."}), 400
 
+    cached = cached_answer_response("query", question, body)
+    if cached:
+        return cached
+
+    not_ready = require_rag_index()
+    if not_ready:
+        return not_ready
+
     try:
+        graph_hash = serving_graph_hash()
         engine = get_query_engine()
         response = engine.query(question)
-        return jsonify({"question": question, "answer": str(response)})
+        payload = {"question": question, "answer": str(response)}
+        store_answer("query", graph_hash, question, payload)
+        return jsonify(payload)
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
 
 
+@app.route('/api/query/stream', methods=['POST'])
+def query_rag_stream():
+    """
+    Streaming /api/query (server-sent events): "retrieval" once the context is retrieved,
+    "token" events as the answer is generated, then "result" with the /api/query payload.
+    """
+    from rag import stream_query
+
+    body = request.get_json(silent=True) or {}
+    question = body.get("question", "").strip()
+
+    if not question:
+        return jsonify({"error": "A 'question' field is required in the JSON body."}), 400
+
+    if cache_requested(body):
+        cached = answer_cache.get("query", graph_input_hash(), question)
+        if cached is not None:
+            return sse_response([("result", dict(cached, question=question))])
+
+    not_ready = require_rag_index()
+    if not_ready:
+        return not_ready
+
+    graph_hash = serving_graph_hash()
+
+    def events():
+        tokens = []
+        for kind, value in stream_query(question):
+            if kind == "token":
+                tokens.append(value)
+                yield "token", {"text": value}
+            else:
+                yield kind, value
+        payload = {"question": question, "answer": "".join(tokens)}
+        store_answer("query", graph_hash, question, payload)
+        yield "result", payload
+
+    return sse_response(events())
+
+
 @app.route('/api/query/debug', methods=['POST'])
 def query_rag_debug():
     """
     RAG debug endpoint — same as /api/query but returns retrieval trace:
     vector_paths, hop_additions, collected_paths, source_nodes with metadata.
+    Never cached: the trace describes this request's retrieval.
     """
-    from rag import get_query_engine, get_graph_retriever
+    from rag import get_query_engine, capture_retrieval_trace
 
     body = request.get_json(silent=True) or {}
     question = body.get("question", "").strip()
@@ -891,12 +1557,16 @@ def query_rag_debug():
     if not question:
         return jsonify({"error": "A 'question' field is required in the JSON body."}), 400
 
+    not_ready = require_rag_index()
+    if not_ready:
+        return not_ready
+
     try:
         engine = get_query_engine()
-        response = engine.query(question)
+        with capture_retrieval_trace() as trace:
+            response = engine.query(question)
 
-        graph_retriever = get_graph_retriever()
-        retrieval_trace = graph_retriever.last_trace if graph_retriever else None
+        retrieval_trace = trace.last
 
         source_nodes = []
         if response.source_nodes:
@@ -935,6 +1605,10 @@ def eval_rag():
     if not question:
         return jsonify({"error": "A 'question' field is required in the JSON body."}), 400
 
+    not_ready = require_rag_index()
+    if not_ready:
+        return not_ready
+
     try:
         engine = get_query_engine()
         response = engine.query(question)
@@ -975,9 +1649,10 @@ def eval_rag():
 def query_langgraph():
     """
     LangGraph-powered RAG endpoint — routing, agentic critique/refine loop, full trace.
-    Body: {"question": "...", "mock": true/false}
+    Body: {"question": "...", "mock": true/false, "cache": true/false}
     Returns: final_answer, route, trace, rag_answer, refined_answer (if refined).
     Pass mock=true to skip real LLM/RAG calls and return deterministic canned responses.
+    Pass cache=false to bypass the answer cache.
     """
     from LangGraph import query_with_langgraph
 
@@ -988,13 +1663,44 @@ def query_langgraph():
     if not question:
         return jsonify({"error": "A 'question' field is required in the JSON body."}), 400
 
+    use_cache = cache_requested(body)
+    if langgraph_needs_index(question, mock, use_cache):
+        not_ready = require_rag_index()
+        if not_ready:
+            return not_ready
+
     try:
-        result = query_with_langgraph(question, mock=mock)
+        result = query_with_langgraph(question, mock=mock, use_cache=use_cache)
         return jsonify(result)
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
 
+@app.route('/api/query/langgraph/stream', methods=['POST'])
+def query_langgraph_stream():
+    """
+    Streaming /api/query/langgraph (server-sent events): a "step" event with the trace
+    lines as each node completes ([router], [decompose], [multi_rag], ...), "token"
+    events for the final answer as it is generated, then "result" with the same
+    payload as /api/query/langgraph. Same body as /api/query/langgraph.
+    """
+    from LangGraph import stream_langgraph
+
+    body = request.get_json(silent=True) or {}
+    question = body.get("question", "").strip()
+    mock = bool(body.get("mock", False))
+
+    if not question:
+        return jsonify({"error": "A 'question' field is required in the JSON body."}), 400
+
+    use_cache = cache_requested(body)
+    if langgraph_needs_index(question, mock, use_cache):
+        not_ready = require_rag_index()
+        if not_ready:
+            return not_ready
+
+    return sse_response(stream_langgraph(question, mock=mock, use_cache=use_cache))
+
 @app.route('/api/mock')
 def get_mock_response():
     """Read and return mock.json."""
@@ -1007,4 +1713,9 @@ def get_mock_response():
 
 if __name__ == '__main__':
     init_db()
+    # Warm the RAG index in the background so the first query doesn't pay for it.
+    # Only in the reloader child (WERKZEUG_RUN_MAIN), not the watcher process.
+    if os.environ.get("RAG_WARMUP", "1").lower() in ("1", "true", "yes") and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        from rag import start_index_warmup
+        start_index_warmup()
     app.run(debug=True, port=8000)
@@ -0,0 +1,163 @@
+"""
+ASGI entry point for the async LangGraph workflow.
+
+POST /api/query/langgraph runs aquery_with_langgraph() directly on the event loop,
+so one worker can hold many in-flight LLM-bound analyses (their model calls bounded
+by llm_scheduler, like the threaded routes') without an OS thread per request or
+sub-question. Every other
+route is served by the Flask app through asgiref's WSGI adapter.
+
+Usage:
+  uvicorn asgi:app --port 8000 --loop asyncio
+
+(--loop asyncio: nest_asyncio, applied by rag.py / LangGraph.py, can't patch uvloop.)
+"""
+
+import asyncio
+import json
+import os
+import time
+import traceback
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import RAG_READY_TIMEOUT, app as flask_app, cache_requested, init_db, langgraph_needs_index
+from metrics import HTTP_IN_FLIGHT, HTTP_REQUEST_SECONDS, HTTP_REQUESTS
+import workspaces
+from workspaces import DEFAULT_WORKSPACE
+
+flask_asgi = WsgiToAsgi(flask_app)
+
+
+async def _read_json(receive) -> dict:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def _send_json(send, status: int, payload: dict, headers: tuple = ()) -> None:
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            # Same policy as CORS(app) on the Flask side
+            (b"access-control-allow-origin", b"*"),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _index_not_ready() -> dict | None:
+    """Async version of app.require_rag_index(): None when ready, else the 503 payload."""
+    from rag import get_index_status, start_index_warmup, wait_for_index
+
+    await asyncio.to_thread(start_index_warmup)
+    if await asyncio.to_thread(wait_for_index, RAG_READY_TIMEOUT):
+        return None
+    return {"error": "RAG index is not ready yet, retry shortly.", "index": get_index_status()}
+
+
+async def query_langgraph(scope, receive, send) -> None:
+    """Same contract as the Flask /api/query/langgraph route, executed with ainvoke."""
+    body = await _read_json(receive)
+    question = body.get("question", "").strip()
+    mock = bool(body.get("mock", False))
+
+    if not question:
+        await _send_json(send, 400, {"error": "A 'question' field is required in the JSON body."})
+        return
+
+    # Same selection as app.select_workspace; asyncio.to_thread and new tasks inherit the context
+    query = parse_qs(scope.get("query_string", b"").decode())
+    workspace_id = query.get("workspace", [None])[0] or body.get("workspace") or DEFAULT_WORKSPACE
+    if workspace_id != DEFAULT_WORKSPACE and not await asyncio.to_thread(workspaces.registry.exists, str(workspace_id)):
+        await _send_json(send, 404, {"error": f"Unknown workspace {workspace_id}"})
+        return
+    token = workspaces.set_current_workspace(workspace_id)
+    try:
+        await _answer_langgraph(send, question, mock, cache_requested(body))
+    finally:
+        workspaces.reset_current_workspace(token)
+
+
+async def _answer_langgraph(send, question: str, mock: bool, use_cache: bool) -> None:
+    from LangGraph import aquery_with_langgraph
+
+    # May build the graph on first use, so off the event loop
+    if await asyncio.to_thread(langgraph_needs_index, question, mock, use_cache):
+        not_ready = await _index_not_ready()
+        if not_ready:
+            await _send_json(send, 503, not_ready, headers=((b"retry-after", b"5"),))
+            return
+
+    try:
+        result = await aquery_with_langgraph(question, mock=mock, use_cache=use_cache)
+    except Exception as e:
+        traceback.print_exc()
+        await _send_json(send, 500, {"error": str(e), "trace": traceback.format_exc()})
+        return
+    await _send_json(send, 200, result)
+
+
+async def _with_request_metrics(handler, scope, receive, send) -> None:
+    """The Flask app's request metrics, for routes served here."""
+    route, method = scope["path"], scope["method"]
+    status = 500
+
+    async def send_with_status(message) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        await send(message)
+
+    started = time.perf_counter()
+    with HTTP_IN_FLIGHT.track_inprogress(route=route):
+        try:
+            await handler(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=method, route=route)
+            HTTP_REQUESTS.inc(method=method, route=route, status=status)
+
+
+ASYNC_ROUTES = {
+    ("POST", "/api/query/langgraph"): query_langgraph,
+}
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            init_db()
+            if os.environ.get("RAG_WARMUP", "1").lower() in ("1", "true", "yes"):
+                from rag import start_index_warmup
+                start_index_warmup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] == "http":
+        handler = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+        if handler is not None:
+            await _with_request_metrics(handler, scope, receive, send)
+            return
+    await flask_asgi(scope, receive, send)
@@ -0,0 +1,132 @@
+"""
+Wall-clock benchmark of the LangGraph analysis route's critical path.
+
+Runs the analysis question through the workflow and reports, per superstep, which
+node was on the critical path. Inside multi_rag_retrieve, the connection-checklist
+retrievals overlap the LLM decomposition, and each LLM sub-question starts retrieving
+as soon as the decomposition returns.
+
+Modes:
+  --mock             canned responses, no latency: the graph's own overhead
+  (default)          simulated LLM / RAG latency with the real graph + checklist scan
+  --real             the configured Anthropic model and RAG index (needs ANTHROPIC_API_KEY)
+
+Usage:
+  python bench_analysis.py --llm-latency 2 --rag-latency 3
+  python bench_analysis.py --mock
+  python bench_analysis.py --real
+"""
+
+import argparse
+import json
+import os
+import time
+
+os.environ.setdefault("LLM_CACHE", "0")  # measure calls, not cache hits
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import tool
+
+import LangGraph
+from app import ANALYSIS_QUESTION
+
+
+class LatencyChatModel(BaseChatModel):
+    """Stands in for the LLM: sleeps, then answers decomposition prompts with a JSON array."""
+
+    latency: float = 2.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "latency-fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        prompt = messages[-1].content
+        if "decompose it into" in prompt:
+            content = json.dumps(LangGraph.MOCK_SUB_QUESTIONS + ["Are there networking or connectivity issues?"])
+        else:
+            content = "Synthesized findings."
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+def use_simulated_latency(llm_latency: float, rag_latency: float) -> None:
+    @tool
+    def slow_rag_query(question: str) -> str:
+        """Simulated graph RAG query."""
+        time.sleep(rag_latency)
+        return f"Simulated answer to: {question}"
+
+    LangGraph.llm = LatencyChatModel(latency=llm_latency)
+    LangGraph.terraform_rag_query = slow_rag_query
+
+
+def run_once(question: str, mock: bool) -> dict:
+    """Run the workflow, timing every task from superstep start to its result."""
+    graph = LangGraph.get_langgraph()
+    started = time.perf_counter()
+    spans: dict[str, list[float]] = {}
+    superstep_of: dict[str, int] = {}
+    superstep, last_event = 0, None
+
+    for mode, chunk in graph.stream(LangGraph._initial_state(question, mock), stream_mode=["tasks"]):
+        now = time.perf_counter() - started
+        if "input" in chunk:
+            # A task start after a result means a new superstep began
+            if last_event == "result":
+                superstep += 1
+            spans[chunk["name"]] = [now, now]
+            superstep_of[chunk["name"]] = superstep
+            last_event = "start"
+        else:
+            spans[chunk["name"]][1] = now
+            last_event = "result"
+
+    wall = time.perf_counter() - started
+    steps: dict[int, list[str]] = {}
+    for name, step in superstep_of.items():
+        steps.setdefault(step, []).append(name)
+
+    return {"wall": wall, "spans": spans, "steps": steps}
+
+
+def report(label: str, result: dict) -> None:
+    spans = result["spans"]
+    serial = sum(end - start for start, end in spans.values())
+    print(f"\n{label}")
+    print("-" * len(label))
+    for step, names in sorted(result["steps"].items()):
+        durations = {n: spans[n][1] - spans[n][0] for n in names}
+        critical = max(durations, key=durations.get)
+        lanes = ", ".join(f"{n} {d:.2f}s" for n, d in sorted(durations.items(), key=lambda kv: -kv[1]))
+        print(f"  step {step}: critical={critical:<22} {lanes}")
+    print(f"  wall clock:            {result['wall']:.2f}s")
+    print(f"  sum of node durations: {serial:.2f}s (overlap saved {max(serial - result['wall'], 0):.2f}s)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mock", action="store_true", help="canned responses, no latency")
+    parser.add_argument("--real", action="store_true", help="use the configured LLM and RAG index")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="simulated seconds per LLM call")
+    parser.add_argument("--rag-latency", type=float, default=3.0, help="simulated seconds per RAG query (retrieval + its own LLM call)")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--question", default=ANALYSIS_QUESTION)
+    args = parser.parse_args()
+
+    if args.mock:
+        label = "mock (no latency)"
+    elif args.real:
+        label = "real LLM + RAG"
+    else:
+        use_simulated_latency(args.llm_latency, args.rag_latency)
+        label = f"simulated (LLM {args.llm_latency}s, RAG {args.rag_latency}s)"
+
+    for i in range(args.runs):
+        report(f"{label} run {i + 1}", run_once(args.question, mock=args.mock))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Scaling benchmark for the graph3 pipeline (build_graph3_nodes).
+
+Generates a synthetic `tofu show -json` plan and a matching `tofu graph` DOT file
+at each requested size, then times every pipeline stage (DOT parse, plan load, new
+edges, diffs, existing edges, external, orphans, role links) and reports wall time,
+throughput and peak traced memory per stage.
+
+Sizes are resource instances in resource_changes. Generated plans nest modules
+(--module-depth, --modules-per-level), expand some blocks with count
+(--count-fraction, --count), give each block --fanout dependencies (some routed
+through locals, as tofu graph does), and keep --existing-fraction of resources in
+prior_state with depends_on.
+
+Usage:
+  python bench_graph.py                        # 100 and 1000 resources
+  python bench_graph.py --sizes 100000 --repeat 1 --no-memory
+  python bench_graph.py --check                 # exit 1 on regression vs bench_graph_baseline.json
+  python bench_graph.py --save-baseline
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+from app import build_graph3_nodes
+from graph_profile import PipelineProfiler
+
+STAGES = ["dot_parse", "plan_load", "new_edges", "diffs", "existing_edges", "external", "orphans", "role_links"]
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_graph_baseline.json")
+
+RESOURCE_TYPES = [
+    "aws_s3_bucket",
+    "aws_sqs_queue",
+    "aws_lambda_function",
+    "aws_iam_role",
+    "aws_iam_role_policy",
+    "aws_cloudwatch_log_group",
+    "aws_security_group",
+    "aws_subnet",
+    "aws_dynamodb_table",
+    "aws_sns_topic",
+]
+
+PROVIDER = 'provider[\\"registry.opentofu.org/hashicorp/aws\\"]'
+
+
+# ---------------------------------------------------------------------------
+# Synthetic plan + DOT
+# ---------------------------------------------------------------------------
+
+
+def _module_prefixes(depth: int, per_level: int) -> list[str]:
+    """'' (root) plus every nested module address down to depth, e.g. module.m0.module.m1."""
+    prefixes = [""]
+    level = [""]
+    for d in range(depth):
+        level = [
+            f"{parent}.module.m{d}_{i}" if parent else f"module.m{d}_{i}"
+            for parent in level for i in range(per_level)
+        ]
+        prefixes.extend(level)
+    return prefixes
+
+
+def _attributes(rng: random.Random, resource_type: str, name: str) -> dict:
+    return {
+        "id": f"{name}-{rng.getrandbits(32):08x}",
+        "arn": f"arn:aws:{resource_type[4:]}:us-east-1:123456789012:{name}",
+        "name": name,
+        "region": "us-east-1",
+        "tags": {"env": rng.choice(["dev", "staging", "prod"]), "team": f"team-{rng.randrange(10)}"},
+        "tags_all": {"managed_by": "terraform"},
+        "timeout": rng.randrange(3, 900),
+        "enabled": rng.random() < 0.5,
+        "settings": [{"key": f"k{j}", "value": rng.randrange(1000)} for j in range(3)],
+    }
+
+
+def generate_plan(
+    resources: int,
+    module_depth: int = 2,
+    modules_per_level: int = 3,
+    fanout: int = 3,
+    count_fraction: float = 0.2,
+    count: int = 3,
+    existing_fraction: float = 0.5,
+    seed: int = 0,
+) -> tuple[dict, str]:
+    """Return (plan JSON, DOT text) with `resources` resource instances."""
+    rng = random.Random(seed)
+    prefixes = _module_prefixes(module_depth, modules_per_level)
+
+    blocks = []  # (path, module prefix, type, name, instance count, existing)
+    instances = 0
+    while instances < resources:
+        i = len(blocks)
+        prefix = prefixes[i % len(prefixes)]
+        resource_type = RESOURCE_TYPES[i % len(RESOURCE_TYPES)]
+        name = f"r{i}"
+        path = f"{prefix}.{resource_type}.{name}" if prefix else f"{resource_type}.{name}"
+        n = min(count if rng.random() < count_fraction else 1, resources - instances)
+        blocks.append((path, prefix, resource_type, name, n, rng.random() < existing_fraction))
+        instances += n
+
+    existing_paths = {block[0] for block in blocks if block[5]}
+    resource_changes = []
+    state_modules: dict[str, dict] = {}
+    dot_nodes = [f'"[root] {PROVIDER}" [label = "{PROVIDER}", shape = "diamond"]']
+    dot_edges = []
+
+    def state_module(prefix: str) -> dict:
+        if prefix not in state_modules:
+            module = {"resources": [], "child_modules": []}
+            if prefix:
+                module["address"] = prefix
+                parent = prefix.rsplit(".module.", 1)[0] if ".module." in prefix else ""
+                state_module(parent)["child_modules"].append(module)
+            state_modules[prefix] = module
+        return state_modules[prefix]
+
+    state_module("")
+
+    for i, (path, prefix, resource_type, name, n, existing) in enumerate(blocks):
+        # Dependencies on earlier blocks, mostly in the same module
+        deps = []
+        if i:
+            for _ in range(fanout):
+                j = rng.randrange(max(0, i - 50), i) if rng.random() < 0.7 else rng.randrange(i)
+                if blocks[j][0] not in deps:
+                    deps.append(blocks[j][0])
+
+        node = f'"[root] {path} (expand)"'
+        dot_nodes.append(f'{node} [label = "{path}", shape = "box"]')
+        dot_edges.append(f'{node} -> "[root] {PROVIDER}"')
+        for k, dep in enumerate(deps):
+            if k % 2:
+                # Through a local, like tofu graph's intermediate value nodes
+                local = f'"[root] {prefix + "." if prefix else ""}local.{name}_{k}"'
+                dot_edges.append(f"{node} -> {local}")
+                dot_edges.append(f'{local} -> "[root] {dep} (expand)"')
+            else:
+                dot_edges.append(f'{node} -> "[root] {dep} (expand)"')
+
+        for index in range(n):
+            address = f"{path}[{index}]" if n > 1 else path
+            before = _attributes(rng, resource_type, name) if existing else None
+            after = dict(before) if before else _attributes(rng, resource_type, name)
+            if existing and rng.random() < 0.5:
+                after["timeout"] = after["timeout"] + 1
+                after["tags"] = dict(after["tags"], env="prod")
+                actions = ["update"]
+            else:
+                actions = ["no-op"] if existing else ["create"]
+            resource_changes.append({
+                "address": address,
+                "module_address": prefix or None,
+                "mode": "managed",
+                "type": resource_type,
+                "name": name,
+                "index": index if n > 1 else None,
+                "provider_name": "registry.opentofu.org/hashicorp/aws",
+                "change": {
+                    "actions": actions,
+                    "before": before,
+                    "after": after,
+                    "after_unknown": {} if existing else {"id": True, "arn": True},
+                    "before_sensitive": {},
+                    "after_sensitive": {},
+                },
+            })
+            if existing:
+                state_module(prefix)["resources"].append({
+                    "address": address,
+                    "mode": "managed",
+                    "type": resource_type,
+                    "name": name,
+                    "provider_name": "registry.opentofu.org/hashicorp/aws",
+                    "values": before,
+                    "depends_on": [d for d in deps if d in existing_paths],
+                })
+
+    plan = {
+        "format_version": "1.2",
+        "resource_changes": resource_changes,
+        "prior_state": {"values": {"root_module": state_modules[""]}},
+    }
+    dot = "digraph {\n\tcompound = \"true\"\n\tnewrank = \"true\"\n\tsubgraph \"root\" {\n"
+    dot += "".join(f"\t\t{line}\n" for line in dot_nodes + dot_edges)
+    dot += "\t}\n}\n"
+    return plan, dot
+
+
+# ---------------------------------------------------------------------------
+# Timing
+# ---------------------------------------------------------------------------
+
+
+def run_pipeline(plan_path: str, dot_path: str, trace_memory: bool = False) -> dict[str, dict]:
+    """One build_graph3_nodes() run; per stage: seconds, and peak traced bytes above the stage's start."""
+    with PipelineProfiler("bench", trace_memory=trace_memory, record_metrics=False) as profile:
+        build_graph3_nodes(plan_path=plan_path, dot_path=dot_path, stage=profile)
+    results: dict[str, dict] = {}
+    for record in profile.stages:
+        results[record.stage] = {"seconds": record.wall_seconds}
+        if trace_memory:
+            results[record.stage]["peak_bytes"] = record.peak_bytes
+    last = profile.stages[-1]
+    results["_nodes"] = {"count": last.nodes_out, "edges": last.edges_out}
+    return results
+
+
+def bench_size(size: int, args) -> dict:
+    plan, dot = generate_plan(
+        size,
+        module_depth=args.module_depth,
+        modules_per_level=args.modules_per_level,
+        fanout=args.fanout,
+        count_fraction=args.count_fraction,
+        count=args.count,
+        existing_fraction=args.existing_fraction,
+        seed=args.seed,
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        plan_path = os.path.join(tmp, "plan.json")
+        dot_path = os.path.join(tmp, "graph.dot")
+        with open(plan_path, "w") as f:
+            json.dump(plan, f)
+        with open(dot_path, "w") as f:
+            f.write(dot)
+        del plan, dot
+
+        # Best of --repeat untraced runs for time (tracemalloc slows allocation-heavy code)
+        runs = [run_pipeline(plan_path, dot_path) for _ in range(args.repeat)]
+        seconds = {s: min(r[s]["seconds"] for r in runs) for s in STAGES}
+        result = {"resources": size, "seconds": seconds, "total": sum(seconds.values()), "graph": runs[0]["_nodes"]}
+
+        if not args.no_memory:
+            traced = run_pipeline(plan_path, dot_path, trace_memory=True)
+            result["peak_bytes"] = {s: traced[s]["peak_bytes"] for s in STAGES}
+    return result
+
+
+def report(result: dict) -> None:
+    size = result["resources"]
+    print(f"\n{size} resources -> {result['graph']['count']} graph nodes, {result['graph']['edges']} edge entries")
+    print(f"  {'stage':<16}{'seconds':>10}{'resources/s':>14}{'peak MiB':>10}")
+    for s in STAGES:
+        seconds = result["seconds"][s]
+        rate = f"{size / seconds:,.0f}" if seconds > 0 else "-"
+        peak = f"{result['peak_bytes'][s] / 2**20:.1f}" if "peak_bytes" in result else "-"
+        print(f"  {s:<16}{seconds:>10.4f}{rate:>14}{peak:>10}")
+    print(f"  {'total':<16}{result['total']:>10.4f}{size / result['total']:>14,.0f}")
+
+
+def regressions(results: list[dict], baseline: dict, tolerance: float, min_delta: float) -> list[str]:
+    """Stages slower than baseline * (1 + tolerance) by more than min_delta seconds."""
+    problems = []
+    for result in results:
+        expected = baseline.get(str(result["resources"]))
+        if not expected:
+            continue
+        for s in STAGES + ["total"]:
+            now = result["total"] if s == "total" else result["seconds"][s]
+            before = expected.get(s)
+            if before is not None and now > before * (1 + tolerance) and now - before > min_delta:
+                problems.append(f"{result['resources']} resources, {s}: {now:.4f}s vs baseline {before:.4f}s")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000", help="comma-separated resource counts")
+    parser.add_argument("--module-depth", type=int, default=2)
+    parser.add_argument("--modules-per-level", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=3, help="dependencies per resource block")
+    parser.add_argument("--count-fraction", type=float, default=0.2, help="share of blocks expanded with count")
+    parser.add_argument("--count", type=int, default=3, help="instances per count-expanded block")
+    parser.add_argument("--existing-fraction", type=float, default=0.5, help="share of resources in prior_state")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per size (best is kept)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--check", action="store_true", help="exit 1 if any stage regressed against the baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="store these timings as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown before --check fails (0.5 = 50%%)")
+    parser.add_argument("--min-delta", type=float, default=0.01, help="ignore slowdowns smaller than this many seconds")
+    args = parser.parse_args()
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        result = bench_size(size, args)
+        report(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        for result in results:
+            timings = {**result["seconds"], "total": result["total"]}
+            baseline[str(result["resources"])] = {s: round(t, 6) for s, t in timings.items()}
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nSaved baseline to {args.baseline}")
+
+    if args.check:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        problems = regressions(results, baseline, args.tolerance, args.min_delta)
+        if problems:
+            print("\nRegressions:")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
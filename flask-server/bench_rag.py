@@ -0,0 +1,243 @@
+"""
+Offline benchmark of graph-RAG retrieval speed and quality.
+
+Replays a question corpus (bench_rag_questions.json) against the bundled plans with
+the real retrieval path — vector index, graph expansion, context packing — and a
+deterministic local LLM that answers every prompt with the mock-mode RAG answer,
+so it needs no API key or network. Per question it records retrieval latency,
+end-to-end query latency (retrieval + prompt assembly, with a zero-latency LLM),
+context size in estimated tokens, vector hits and additions per hop, and recall of
+the expected resource addresses, both from the vector search alone and after
+expansion and packing.
+
+Embeddings:
+  --embedding hash   (default) a deterministic hashed bag-of-words embedding: no
+                     model download, identical numbers on every machine
+  --embedding model  the production embedding model (BAAI/bge-large-en-v1.5); must
+                     already be in the local Hugging Face cache to run offline
+
+Usage:
+  python bench_rag.py
+  python bench_rag.py --hops 2 --token-budget 2000
+  python bench_rag.py --json results.json --min-recall 0.8
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import statistics
+import sys
+import time
+import zlib
+from typing import Any, Optional
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "offline")  # get_llm() reads it; never used
+os.environ.setdefault("RAG_WARMUP", "0")
+os.environ.setdefault("LLM_CACHE", "0")
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.llms import CompletionResponse, CustomLLM, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.schema import QueryBundle
+
+import rag
+from app import build_graph3_nodes
+from LangGraph import MOCK_RAG_ANSWER
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS_PATH = os.path.join(HERE, "bench_rag_questions.json")
+
+
+class HashEmbedding(BaseEmbedding):
+    """Signed feature hashing of lower-cased word tokens, L2-normalised. Deterministic and offline."""
+
+    dimensions: int = 1024
+
+    def _embed(self, text: str) -> list[float]:
+        vector = [0.0] * self.dimensions
+        for token in re.findall(r"[a-z0-9]+", text.lower()):
+            h = zlib.crc32(token.encode())
+            vector[h % self.dimensions] += 1.0 if h & 0x80000000 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._embed(text)
+
+
+class CannedLLM(CustomLLM):
+    """Answers every prompt with the mock-mode RAG answer; records the last prompt's size."""
+
+    answer: str = MOCK_RAG_ANSWER
+    last_prompt_chars: int = 0
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=200_000, num_output=1024, model_name="canned")
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        self.last_prompt_chars = len(prompt)
+        return CompletionResponse(text=self.answer)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        self.last_prompt_chars = len(prompt)
+        yield CompletionResponse(text=self.answer, delta=self.answer)
+
+
+def _strip_index(address: str) -> str:
+    return re.sub(r"\[\d+\]", "", address)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100)."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def build_engine(dataset: dict, embedding: str, llm: CannedLLM):
+    """Graph, index and query engine for one dataset's plan / DOT files."""
+    nodes = build_graph3_nodes(
+        plan_path=os.path.join(HERE, dataset["plan"]), dot_path=os.path.join(HERE, dataset["dot"])
+    )
+    if embedding == "hash":
+        rag._embed_model = rag.ScheduledEmbedding(HashEmbedding())
+    rag._llm = llm
+    _, vector_retriever, nodes, address_to_node, path_to_neighbors = rag.build_index(nodes)
+    engine, retriever, _ = rag.build_query_engine(vector_retriever, nodes, address_to_node, path_to_neighbors)
+    return engine, retriever, len(address_to_node)
+
+
+def run_question(engine, retriever, llm: CannedLLM, item: dict, repeat: int) -> dict:
+    question, expected = item["question"], item["expected"]
+    timings = []
+    for _ in range(repeat):
+        with rag.capture_retrieval_trace() as trace:
+            started = time.perf_counter()
+            retrieved = retriever.retrieve(QueryBundle(question))
+            timings.append(time.perf_counter() - started)
+    last = trace.last
+
+    started = time.perf_counter()
+    engine.query(question)
+    query_seconds = time.perf_counter() - started
+
+    addresses = [n.node.node_id for n in retrieved]
+    found = [a for a in expected if a in addresses]
+    expected_paths = {_strip_index(a) for a in expected}
+    return {
+        "question": question,
+        "retrieval_ms": round(min(timings) * 1000, 3),
+        "retrieval_ms_median": round(statistics.median(timings) * 1000, 3),
+        "query_ms": round(query_seconds * 1000, 3),
+        "context_tokens": last["packing"]["context_tokens"],
+        "prompt_chars": llm.last_prompt_chars,
+        "vector_paths": last["vector_path_count"],
+        "hop_additions": [len(added) for added in last["hop_additions"]],
+        "final_nodes": last["final_node_count"],
+        "dropped": len(last["packing"]["dropped_addresses"]),
+        "vector_recall": round(len(expected_paths & set(last["vector_paths"])) / len(expected_paths), 3),
+        "recall": round(len(found) / len(expected), 3),
+        "missing": [a for a in expected if a not in addresses],
+        "retrieved": addresses,
+    }
+
+
+def summarize(rows: list[dict]) -> dict:
+    retrieval = [r["retrieval_ms"] for r in rows]
+    return {
+        "questions": len(rows),
+        "recall": round(statistics.mean(r["recall"] for r in rows), 3),
+        "vector_recall": round(statistics.mean(r["vector_recall"] for r in rows), 3),
+        "retrieval_ms_p50": _percentile(retrieval, 50),
+        "retrieval_ms_p95": _percentile(retrieval, 95),
+        "query_ms_p50": _percentile([r["query_ms"] for r in rows], 50),
+        "context_tokens_mean": round(statistics.mean(r["context_tokens"] for r in rows), 1),
+        "final_nodes_mean": round(statistics.mean(r["final_nodes"] for r in rows), 2),
+    }
+
+
+def run(corpus: dict, embedding: str = "hash", repeat: int = 3, datasets: Optional[list[str]] = None) -> dict:
+    llm = CannedLLM()
+    results = {}
+    for dataset in corpus["datasets"]:
+        if datasets and dataset["name"] not in datasets:
+            continue
+        engine, retriever, indexed = build_engine(dataset, embedding, llm)
+        rows = [run_question(engine, retriever, llm, item, repeat) for item in dataset["questions"]]
+        results[dataset["name"]] = {"indexed_resources": indexed, "summary": summarize(rows), "questions": rows}
+    all_rows = [row for r in results.values() for row in r["questions"]]
+    return {
+        "config": {
+            "embedding": embedding,
+            "graph_hops": rag.RAG_GRAPH_HOPS,
+            "hop_decay": rag.RAG_HOP_DECAY,
+            "token_budget": rag.RAG_CONTEXT_TOKEN_BUDGET,
+            "repeat": repeat,
+        },
+        "datasets": results,
+        "summary": summarize(all_rows) if all_rows else {},
+    }
+
+
+def report(result: dict) -> None:
+    for name, dataset in result["datasets"].items():
+        print(f"\n{name} ({dataset['indexed_resources']} indexed resources)")
+        print(f"  {'question':<62}{'ret ms':>8}{'qry ms':>8}{'tokens':>8}{'vec':>5}{'hops':>8}{'nodes':>6}{'vrec':>6}{'recall':>7}")
+        for r in dataset["questions"]:
+            hops = "+".join(str(h) for h in r["hop_additions"]) or "-"
+            print(f"  {r['question'][:60]:<62}{r['retrieval_ms']:>8.1f}{r['query_ms']:>8.1f}{r['context_tokens']:>8}"
+                  f"{r['vector_paths']:>5}{hops:>8}{r['final_nodes']:>6}{r['vector_recall']:>6.2f}{r['recall']:>7.2f}")
+            for address in r["missing"]:
+                print(f"      missing {address}")
+    s = result["summary"]
+    print(f"\noverall: recall {s['recall']:.3f} (vector only {s['vector_recall']:.3f}), "
+          f"retrieval p50 {s['retrieval_ms_p50']:.1f} ms / p95 {s['retrieval_ms_p95']:.1f} ms, "
+          f"{s['context_tokens_mean']:.0f} context tokens on average")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--dataset", action="append", help="only run this dataset (repeatable)")
+    parser.add_argument("--embedding", choices=("hash", "model"), default="hash")
+    parser.add_argument("--repeat", type=int, default=3, help="retrievals per question (latency is the best run)")
+    parser.add_argument("--hops", type=int, help="override RAG_GRAPH_HOPS")
+    parser.add_argument("--hop-decay", type=float, help="override RAG_HOP_DECAY")
+    parser.add_argument("--token-budget", type=int, help="override RAG_CONTEXT_TOKEN_BUDGET")
+    parser.add_argument("--json", help="also write the full results here")
+    parser.add_argument("--min-recall", type=float, help="exit 1 if overall recall is below this")
+    args = parser.parse_args()
+
+    if args.hops is not None:
+        rag.RAG_GRAPH_HOPS = args.hops
+    if args.hop_decay is not None:
+        rag.RAG_HOP_DECAY = args.hop_decay
+    if args.token_budget is not None:
+        rag.RAG_CONTEXT_TOKEN_BUDGET = args.token_budget
+
+    with open(args.corpus) as f:
+        corpus = json.load(f)
+    result = run(corpus, embedding=args.embedding, repeat=args.repeat, datasets=args.dataset)
+    report(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.min_recall is not None and result["summary"]["recall"] < args.min_recall:
+        print(f"\nrecall {result['summary']['recall']:.3f} is below --min-recall {args.min_recall}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+"""
+Rule-based question matching and direct answers from the graph.
+
+KeywordMatcher is an Aho-Corasick automaton: any number of phrases are matched in
+one pass over the question, so the router and the lookup below can grow their
+vocabularies without re-scanning the text per phrase.
+
+GraphLookup answers questions that the graph3 nodes answer exactly — an attribute
+of a named resource ("What is the S3 bucket name?") or the resources connected to
+one ("What is connected to aws_sqs_queue.test_queue?") — without RAG or an LLM. It
+returns None whenever the question is ambiguous, so the caller falls back to RAG.
+The graph's edges don't record which end depends on which, so directional
+questions ("What depends on ...?") go to RAG too.
+"""
+
+import json
+import re
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, Optional
+
+
+@dataclass(frozen=True)
+class Match:
+    start: int
+    end: int
+    pattern: str
+    label: Any
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class KeywordMatcher:
+    """Aho-Corasick matcher over (pattern, label) pairs; matching is case-insensitive."""
+
+    def __init__(self, patterns: Iterable[tuple[str, Any]], word_boundary: bool = False):
+        self.word_boundary = word_boundary
+        self._patterns: list[tuple[str, Any]] = []
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[int]] = [[]]
+
+        for pattern, label in patterns:
+            pattern = pattern.lower()
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(len(self._patterns))
+            self._patterns.append((pattern, label))
+
+        # Breadth-first failure links; each state inherits the outputs of its failure state
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def finditer(self, text: str) -> Iterator[Match]:
+        """Every (possibly overlapping) occurrence, ordered by end position."""
+        text = text.lower()
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for index in self._out[state]:
+                pattern, label = self._patterns[index]
+                start = i + 1 - len(pattern)
+                if self.word_boundary and (
+                    (start > 0 and _is_word_char(text[start - 1]))
+                    or (i + 1 < len(text) and _is_word_char(text[i + 1]))
+                ):
+                    continue
+                yield Match(start, i + 1, pattern, label)
+
+    def labels(self, text: str) -> set:
+        return {m.label for m in self.finditer(text)}
+
+    def longest(self, text: str) -> list[Match]:
+        """Leftmost-longest, non-overlapping matches (e.g. "s3 bucket object" over "s3 bucket")."""
+        result: list[Match] = []
+        for m in sorted(self.finditer(text), key=lambda m: (m.start, -(m.end - m.start))):
+            if not result or m.start >= result[-1].end:
+                result.append(m)
+        return result
+
+
+# ---------------------------------------------------------------------------
+# Structured lookup over the graph3 nodes
+# ---------------------------------------------------------------------------
+
+# Phrases that ask for a resource's neighbours. Multi-hop wording ("impact",
+# "chain") is left to the RAG path.
+DEPENDENCY_PHRASES = [
+    "connected", "connects", "connect to", "connections", "linked", "links to",
+]
+
+# Phrases that ask for one direction of an edge. The neighbour lists are undirected,
+# so these questions go to RAG rather than listing both directions.
+DIRECTIONAL_DEPENDENCY_PHRASES = [
+    "depends on", "depend on", "dependencies", "dependents", "dependency",
+    "used by", "references", "referenced by",
+]
+
+# Words a lookup question may hold besides the resource, attribute and dependency
+# phrases. Any other word ("should", "encryption", "and ... secure") means the
+# question asks more than the lookup answers, so it goes to RAG.
+LOOKUP_FILLER_WORDS = frozenset("""
+    what whats s which is are the a an of for on in to by my this that its value values
+    does do show me list tell give get all resources resource
+""".split())
+_WORD = re.compile(r"[a-z0-9_]+")
+
+# "name" means the resource's naming attribute, whichever one its type has
+NAME_ATTRIBUTES = ("name", "bucket", "function_name", "role_name", "queue_name", "table_name", "identifier")
+
+# An attribute question about more resources than this is left to RAG
+LOOKUP_MAX_RESOURCES = 5
+
+
+@dataclass
+class LookupAnswer:
+    kind: str  # "attribute" | "dependency"
+    answer: str
+    paths: list[str] = field(default_factory=list)
+
+
+def _type_and_name(path: str) -> tuple[Optional[str], Optional[str]]:
+    """('aws_s3_bucket', 'test') for 'module.x.aws_s3_bucket.test'; data sources keep their type."""
+    parts = path.split(".")
+    if len(parts) < 2:
+        return None, None
+    return parts[-2], parts[-1]
+
+
+def _type_phrase(resource_type: str) -> str:
+    """aws_s3_bucket -> 's3 bucket'."""
+    words = resource_type.split("_")
+    if words and words[0] in ("aws", "google", "azurerm"):
+        words = words[1:]
+    return " ".join(words)
+
+
+def _covers_question(question: str, spans: list[Match]) -> bool:
+    """True when every word of the question is filler or inside one of the matched phrases."""
+    for word in _WORD.finditer(question.lower()):
+        if word.group() in LOOKUP_FILLER_WORDS:
+            continue
+        if not any(s.start <= word.start() and word.end() <= s.end for s in spans):
+            return False
+    return True
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, str):
+        return f'"{value}"'
+    text = json.dumps(value)
+    return text if len(text) <= 200 else text[:200] + "..."
+
+
+class GraphLookup:
+    """Resource / attribute / dependency matchers compiled once per graph version."""
+
+    def __init__(self, nodes: dict[str, Any]):
+        self.nodes = nodes
+        mentions: dict[str, set[str]] = {}
+
+        def mention(phrase: str, path: str) -> None:
+            mentions.setdefault(phrase.lower(), set()).add(path)
+
+        for path in nodes:
+            resource_type, name = _type_and_name(path)
+            mention(path, path)
+            if not resource_type:
+                continue
+            mention(f"{resource_type}.{name}", path)
+            mention(resource_type, path)
+            phrase = _type_phrase(resource_type)
+            if " " in phrase:  # single words ("external", "partition") are too common in questions
+                mention(phrase, path)
+            parts = path.split(".")
+            if parts[0] == "module" and len(parts) > 2:
+                mention(parts[1], path)  # module name, e.g. lambda-writer
+
+        self._resources = KeywordMatcher(mentions.items(), word_boundary=True)
+        self._dependency = KeywordMatcher(
+            [(p, "dependency") for p in DEPENDENCY_PHRASES]
+            + [(p, "directional") for p in DIRECTIONAL_DEPENDENCY_PHRASES],
+            word_boundary=True,
+        )
+        self._attribute_matchers: dict[frozenset[str], KeywordMatcher] = {}
+
+    def _candidates(self, question: str) -> tuple[set[str], list[Match]]:
+        """Paths every resource mention agrees on (e.g. 'lambda-writer' + 'iam role')."""
+        matches = self._resources.longest(question)
+        candidates: Optional[set[str]] = None
+        for m in matches:
+            candidates = set(m.label) if candidates is None else candidates & m.label
+        return candidates or set(), matches
+
+    def _attributes(self, path: str) -> dict[str, Any]:
+        """
+        Attribute values of the path's first resource instance (after the change, else
+        before), plus the attributes only known after apply.
+        """
+        for resource in self.nodes[path].get("resources", {}).values():
+            change = resource.get("change", {})
+            unknown = {k: None for k, v in (change.get("after_unknown") or {}).items() if v is True}
+            return {**unknown, **(change.get("after") or change.get("before") or {})}
+        return {}
+
+    def _attribute_matcher(self, keys: Iterable[str]) -> KeywordMatcher:
+        """Matcher over these attribute keys; resources of one type usually share it."""
+        keys = frozenset(keys)
+        matcher = self._attribute_matchers.get(keys)
+        if matcher is None:
+            phrases = [(key.replace("_", " "), key) for key in sorted(keys)]
+            phrases += [(key, key) for key in sorted(keys) if "_" in key]
+            matcher = KeywordMatcher(phrases + [("name", "name")], word_boundary=True)
+            self._attribute_matchers[keys] = matcher
+        return matcher
+
+    def _instance_values(self, path: str, key: str) -> list[tuple[str, str]]:
+        values = []
+        for address, resource in self.nodes[path].get("resources", {}).items():
+            change = resource.get("change", {})
+            after = change.get("after")
+            unknown = (change.get("after_unknown") or {}).get(key)
+            sensitive = (change.get("after_sensitive") or {}).get(key)
+            source = after if after is not None else (change.get("before") or {})
+            if sensitive is True:
+                values.append((address, "(sensitive)"))
+            elif unknown is True:
+                values.append((address, "(known after apply)"))
+            elif key in source:
+                values.append((address, _format_value(source[key])))
+        return values
+
+    def _answer_attribute(self, question: str, paths: list[str], mention_spans: list[Match]) -> Optional[LookupAnswer]:
+        lines, attribute_spans = [], []
+        for path in paths:
+            attributes = self._attributes(path)
+            matcher = self._attribute_matcher(attributes.keys())
+            # Words already spent naming the resource ("s3 bucket") don't count as attributes
+            matches = [
+                m for m in matcher.longest(question)
+                if not any(m.start < s.end and s.start < m.end for s in mention_spans)
+            ]
+            keys = [m.label for m in matches]
+            if keys == ["name"] or ("name" in keys and "name" not in attributes):
+                keys = [next((k for k in NAME_ATTRIBUTES if k in attributes), "name")]
+            keys = list(dict.fromkeys(k for k in keys if k in attributes))
+            if len(keys) != 1:
+                return None
+            attribute_spans += [m for m in matches if m.label in (keys[0], "name")]
+            for address, value in self._instance_values(path, keys[0]):
+                lines.append(f"- `{address}` {keys[0]} = {value}")
+        if not lines or not _covers_question(question, mention_spans + attribute_spans):
+            return None
+        return LookupAnswer("attribute", "\n".join(lines), paths)
+
+    def _answer_dependency(self, path: str) -> LookupAnswer:
+        node = self.nodes[path]
+        neighbours = list(dict.fromkeys(list(node.get("edges_new", [])) + list(node.get("edges_existing", []))))
+        if not neighbours:
+            return LookupAnswer("dependency", f"`{path}` has no connections in the graph.", [path])
+        lines = [f"`{path}` is connected to {len(neighbours)} resources in the graph:"]
+        for neighbour in neighbours:
+            state = "new" if neighbour in node.get("edges_new", []) else "existing"
+            lines.append(f"- `{neighbour}` ({state} edge)")
+        return LookupAnswer("dependency", "\n".join(lines), [path])
+
+    def answer(self, question: str) -> Optional[LookupAnswer]:
+        """Answer from the graph, or None when the question isn't an unambiguous lookup."""
+        candidates, mention_spans = self._candidates(question)
+        if not candidates:
+            return None
+        paths = sorted(candidates)
+
+        dependency_spans = self._dependency.longest(question)
+        if dependency_spans:
+            if any(m.label == "directional" for m in dependency_spans):
+                return None
+            if len(paths) != 1 or not _covers_question(question, mention_spans + dependency_spans):
+                return None
+            return self._answer_dependency(paths[0])
+        if len(paths) > LOOKUP_MAX_RESOURCES:
+            return None
+        return self._answer_attribute(question, paths, mention_spans)
+
+
+# graph fingerprint -> lookup; one entry per workspace in use (workspaces.py), oldest dropped first
+_lookups: "OrderedDict[Any, GraphLookup]" = OrderedDict()
+_lookup_lock = threading.Lock()
+LOOKUP_CACHE_SIZE = 8
+
+
+def get_lookup(snapshot) -> GraphLookup:
+    """The GraphLookup for a graph_provider snapshot, compiled once per graph version."""
+    with _lookup_lock:
+        lookup = _lookups.get(snapshot.fingerprint)
+        if lookup is None:
+            lookup = _lookups[snapshot.fingerprint] = GraphLookup(snapshot.nodes)
+            while len(_lookups) > LOOKUP_CACHE_SIZE:
+                _lookups.popitem(last=False)
+        _lookups.move_to_end(snapshot.fingerprint)
+        return lookup
@@ -0,0 +1,199 @@
+"""
+Per-stage instrumentation for the graph pipelines (build_graph3_nodes, /api/graph2).
+
+A PipelineProfiler is passed to the pipeline as its `stage` hook. Each stage is
+wrapped as
+
+    with stage("diffs", nodes) as s:
+        nodes = s.out(compute_resource_diffs_v2(nodes))
+
+and records wall time, CPU time (this thread only, so concurrent requests don't
+blur each other), node / edge counts in and out, and, when memory tracing is on,
+bytes allocated and peak traced memory. Every finished stage is logged as one
+JSON line and folded into process-wide aggregates served by /api/graph/metrics.
+
+tracemalloc is process-wide (one start/stop, one peak), so memory-traced runs take
+turns: a second one waits for the first to finish. Allocations made meanwhile by
+other, untraced requests still count towards the running one's figures.
+"""
+
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Held by the memory-traced run in progress
+_memory_lock = threading.Lock()
+
+
+def graph_size(data: Any) -> tuple[Optional[int], Optional[int]]:
+    """(nodes, edges) of a nodes dict (edges_new + edges_existing) or an adjacency list; (None, None) otherwise."""
+    if not isinstance(data, dict):
+        return None, None
+    edges = 0
+    for value in data.values():
+        if isinstance(value, (list, set)):
+            edges += len(value)
+        elif isinstance(value, dict):
+            edges += len(value.get("edges_new", ())) + len(value.get("edges_existing", ()))
+    return len(data), edges
+
+
+@dataclass
+class StageRecord:
+    pipeline: str
+    stage: str
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    nodes_in: Optional[int] = None
+    edges_in: Optional[int] = None
+    nodes_out: Optional[int] = None
+    edges_out: Optional[int] = None
+    alloc_bytes: Optional[int] = None  # traced memory still held after the stage
+    peak_bytes: Optional[int] = None  # peak traced memory above the stage's starting point
+
+    def __post_init__(self):
+        self._output: Any = None
+
+    def out(self, result: Any) -> Any:
+        """Note the stage's output (for the out counts) and pass it through."""
+        self._output = result
+        return result
+
+
+class _StageContext:
+    def __init__(self, profiler: "PipelineProfiler", record: StageRecord):
+        self._profiler = profiler
+        self._record = record
+
+    def __enter__(self) -> StageRecord:
+        if self._profiler.tracing:
+            self._mem_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self._record
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        record = self._record
+        record.wall_seconds = time.perf_counter() - self._wall
+        record.cpu_seconds = time.thread_time() - self._cpu
+        if self._profiler.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            record.alloc_bytes = current - self._mem_start
+            record.peak_bytes = peak - self._mem_start
+        record.nodes_out, record.edges_out = graph_size(record._output)
+        if exc_type is None:
+            self._profiler._finish(record)
+
+
+class PipelineProfiler:
+    """Stage hook for a pipeline run; use as a context manager to trace memory for the whole run."""
+
+    def __init__(self, pipeline: str, trace_memory: bool = False, record_metrics: bool = True):
+        self.pipeline = pipeline
+        self.trace_memory = trace_memory
+        self.record_metrics = record_metrics
+        self.stages: list[StageRecord] = []
+        self._started_tracing = False
+        self._holds_memory_lock = False
+
+    @property
+    def tracing(self) -> bool:
+        # Only inside `with profiler:`, so no other run resets the peak under it
+        return self._holds_memory_lock and tracemalloc.is_tracing()
+
+    def __enter__(self) -> "PipelineProfiler":
+        if self.trace_memory:
+            _memory_lock.acquire()
+            self._holds_memory_lock = True
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        if self._holds_memory_lock:
+            self._holds_memory_lock = False
+            _memory_lock.release()
+
+    def __call__(self, name: str, data_in: Any = None) -> _StageContext:
+        record = StageRecord(self.pipeline, name)
+        record.nodes_in, record.edges_in = graph_size(data_in)
+        return _StageContext(self, record)
+
+    def _finish(self, record: StageRecord) -> None:
+        self.stages.append(record)
+        logger.info("[graph] %s", json.dumps(asdict(record)))
+        if self.record_metrics:
+            _record_stage(record)
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "pipeline": self.pipeline,
+            "wall_seconds": round(sum(s.wall_seconds for s in self.stages), 6),
+            "cpu_seconds": round(sum(s.cpu_seconds for s in self.stages), 6),
+            "memory_traced": self.trace_memory,
+            "stages": [asdict(s) for s in self.stages],
+        }
+
+
+class _NoStage:
+    """Stage hook that does nothing (the default when a pipeline isn't profiled)."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+    def out(self, result: Any) -> Any:
+        return result
+
+
+_NO_STAGE = _NoStage()
+
+
+def no_stage(name: str, data_in: Any = None) -> _NoStage:
+    return _NO_STAGE
+
+
+# ---------------------------------------------------------------------------
+# Process-wide aggregates
+# ---------------------------------------------------------------------------
+
+_metrics_lock = threading.Lock()
+_stage_metrics: dict[tuple[str, str], dict[str, Any]] = {}
+
+
+def _record_stage(record: StageRecord) -> None:
+    with _metrics_lock:
+        m = _stage_metrics.setdefault((record.pipeline, record.stage), {
+            "count": 0, "wall_seconds_sum": 0.0, "wall_seconds_max": 0.0, "cpu_seconds_sum": 0.0, "last": None,
+        })
+        m["count"] += 1
+        m["wall_seconds_sum"] += record.wall_seconds
+        m["wall_seconds_max"] = max(m["wall_seconds_max"], record.wall_seconds)
+        m["cpu_seconds_sum"] += record.cpu_seconds
+        m["last"] = asdict(record)
+
+
+def metrics() -> dict[str, Any]:
+    """Per pipeline and stage: run count, wall / CPU seconds (sum, max, avg) and the last run's record."""
+    with _metrics_lock:
+        result: dict[str, dict[str, Any]] = {}
+        for (pipeline, stage), m in _stage_metrics.items():
+            result.setdefault(pipeline, {})[stage] = {
+                **{k: v for k, v in m.items() if k != "last"},
+                "wall_seconds_avg": m["wall_seconds_sum"] / m["count"],
+                "last": dict(m["last"]),
+            }
+    return result
@@ -0,0 +1,186 @@
+"""
+Shared, versioned graph for the RAG layer, the checklist scanner and the graph endpoints.
+
+build_graph3_nodes() re-parses the plan and DOT files and re-runs every edge pass,
+which costs seconds on a large plan. Instead, get_graph() builds it once per
+graph_input_fingerprint() and hands every caller the same GraphSnapshot until the
+plan or DOT changes. Derived data that several consumers need (the resource types
+present, the (source_type, target_type) pairs of connected resources) is computed
+once alongside it.
+
+The snapshot's nodes are shared between threads and requests: treat them as
+read-only and take snapshot.mutable_nodes() before adding fields to them.
+
+With GRAPH_STORE=1 the nodes are a graph_store.GraphView instead of a dict: one
+process per graph version builds and publishes it, every other worker on the host
+maps the published copy rather than building its own.
+
+Requests for another workspace (workspaces.py) get that workspace's snapshot from
+the workspace registry, built by the same code.
+"""
+
+import copy
+import json
+import logging
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import graph_store
+from graph_profile import PipelineProfiler
+from workspaces import DEFAULT_WORKSPACE, current_workspace
+
+logger = logging.getLogger(__name__)
+
+
+def extract_resource_type(path: str) -> str | None:
+    """Extract Terraform resource type from path (e.g. aws_lambda_function, aws_sqs_queue)."""
+    parts = path.split(".")
+    for part in parts:
+        if part.startswith("aws_") and "." not in part:
+            return part
+    return None
+
+
+@dataclass(frozen=True)
+class GraphSnapshot:
+    """One build of the graph3 nodes for a given input fingerprint. Do not mutate."""
+
+    fingerprint: tuple
+    nodes: Mapping[str, Any]  # a dict, or a GraphView with GRAPH_STORE=1
+    types_present: frozenset[str]
+    # Connected (source_type, target_type) pairs, in first-seen edge order
+    type_pairs: tuple[tuple[str, str], ...]
+    build_seconds: float
+
+    def mutable_nodes(self) -> dict[str, Any]:
+        """A private deep copy of the nodes, safe to enrich per request."""
+        if isinstance(self.nodes, graph_store.GraphView):
+            return self.nodes.to_dict()  # decoded fresh, nothing shared
+        return copy.deepcopy(self.nodes)
+
+
+def _type_index(nodes: dict[str, Any]) -> tuple[frozenset[str], tuple[tuple[str, str], ...]]:
+    types_present: set[str] = set()
+    for path in nodes:
+        t = extract_resource_type(path)
+        if t:
+            types_present.add(t)
+
+    pairs: dict[tuple[str, str], None] = {}
+    for path, node_data in nodes.items():
+        source_type = extract_resource_type(path)
+        if not source_type:
+            continue
+        edges = list(node_data.get("edges_new", [])) + list(node_data.get("edges_existing", []))
+        for target_path in edges:
+            if target_path not in nodes:
+                continue
+            target_type = extract_resource_type(target_path)
+            if target_type:
+                pairs.setdefault((source_type, target_type), None)
+
+    return frozenset(types_present), tuple(pairs)
+
+
+_snapshot: Optional[GraphSnapshot] = None
+_lock = threading.Lock()  # single-flight: concurrent callers wait for one build
+_builds = 0
+
+
+def _build(fingerprint: tuple) -> GraphSnapshot:
+    global _builds
+    from app import build_graph3_nodes
+
+    started = time.perf_counter()
+    nodes = build_graph3_nodes(stage=PipelineProfiler("graph3"))
+    types_present, type_pairs = _type_index(nodes)
+    snapshot = GraphSnapshot(
+        fingerprint=fingerprint,
+        nodes=nodes,
+        types_present=types_present,
+        type_pairs=type_pairs,
+        build_seconds=time.perf_counter() - started,
+    )
+    _builds += 1
+    logger.info(
+        "[graph] Built graph — %d resource paths, %d type pairs in %.2fs",
+        len(nodes), len(type_pairs), snapshot.build_seconds,
+    )
+    return snapshot
+
+
+def _attach(fingerprint: tuple) -> GraphSnapshot:
+    """The store's graph for this fingerprint, built and published first if no process has yet."""
+    store = graph_store.get_store(current_workspace())
+    key = json.dumps(fingerprint)
+    view = store.current()
+    if view is None or view.meta.get("fingerprint") != key:
+        with store.lock():
+            # Another worker may have published it while we waited
+            view = store.current()
+            if view is None or view.meta.get("fingerprint") != key:
+                built = _build(fingerprint)
+                view = store.publish(built.nodes, {
+                    "fingerprint": key,
+                    "types_present": sorted(built.types_present),
+                    "type_pairs": built.type_pairs,
+                    "build_seconds": built.build_seconds,
+                })
+    return GraphSnapshot(
+        fingerprint=fingerprint,
+        nodes=view,
+        types_present=frozenset(view.meta["types_present"]),
+        type_pairs=tuple(tuple(pair) for pair in view.meta["type_pairs"]),
+        build_seconds=view.meta["build_seconds"],
+    )
+
+
+def load_snapshot(fingerprint: tuple) -> GraphSnapshot:
+    """Build (or attach to) the current workspace's graph for this input fingerprint."""
+    return _attach(fingerprint) if graph_store.GRAPH_STORE_ENABLED else _build(fingerprint)
+
+
+def get_graph() -> GraphSnapshot:
+    """Return the graph for the current plan/DOT inputs, building it only when they changed."""
+    global _snapshot
+    from app import graph_input_fingerprint
+
+    workspace = current_workspace()
+    if workspace != DEFAULT_WORKSPACE:
+        from workspaces import registry
+        return registry.graph(workspace)
+
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.fingerprint == graph_input_fingerprint():
+        return snapshot
+
+    with _lock:
+        # Fingerprint before building: an edit during the build makes the next call rebuild
+        fingerprint = graph_input_fingerprint()
+        if _snapshot is not None and _snapshot.fingerprint == fingerprint:
+            return _snapshot
+
+        _snapshot = load_snapshot(fingerprint)
+        return _snapshot
+
+
+def invalidate() -> None:
+    """Drop the cached graph so the next get_graph() rebuilds it (or re-attaches to the store)."""
+    global _snapshot
+    with _lock:
+        _snapshot = None
+
+
+def stats() -> dict[str, Any]:
+    snapshot = _snapshot
+    return {
+        "builds": _builds,
+        "cached": snapshot is not None,
+        "resource_paths": len(snapshot.nodes) if snapshot else 0,
+        "type_pairs": len(snapshot.type_pairs) if snapshot else 0,
+        "build_seconds": round(snapshot.build_seconds, 3) if snapshot else None,
+        "store_version": getattr(snapshot.nodes, "version", None) if snapshot else None,
+    }
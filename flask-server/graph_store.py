@@ -0,0 +1,295 @@
+"""
+Read-only graph store shared by every worker process on a host.
+
+graph_provider normally keeps the built graph3 nodes as a nested dict in each
+process, so memory grows with the number of gunicorn workers. With GRAPH_STORE=1
+the first process to build a graph version publishes it here as one compact
+binary file, and every process memory-maps that file instead of holding its own
+copy. The default directory is on /dev/shm, so all the mappings share the same
+physical pages.
+
+File layout (native byte order, little-endian on every host we run on; the file is
+a per-host cache, not an interchange format):
+
+  header      magic, format version, node count, name count, then an
+              (offset, length) pair per section
+  names       UTF-8 resource paths: node paths first, then edge targets that are
+              not nodes themselves, with uint64 offsets
+  edges_new / edges_existing
+              CSR adjacency: uint32 row offsets (node count + 1) and uint32 target
+              name ids, in the original edge order
+  payloads    each node without its edge lists, as JSON, with uint64 offsets
+  flags       one byte per node recording which edge keys the node had
+  meta        JSON from the publisher (fingerprint, derived indexes, build time)
+
+GraphView reads adjacency as zero-copy memoryview slices of the mapping and decodes
+a node's payload only when that node is looked up. Publishing writes a new
+graph-<version>.bin and then atomically replaces the CURRENT pointer, so readers
+never see a half-written graph. Processes still holding an older version keep
+reading it: its mapping stays valid after the file is pruned.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from array import array
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+from workspaces import DEFAULT_WORKSPACE
+
+logger = logging.getLogger(__name__)
+
+GRAPH_STORE_ENABLED = os.environ.get("GRAPH_STORE", "0").lower() in ("1", "true", "yes")
+
+
+def _default_store_dir() -> str:
+    # One directory per checkout, so two servers on a host don't swap each other's graphs
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    name = f"terraform-graph-viewer-{hashlib.sha1(app_dir.encode()).hexdigest()[:8]}"
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, name)
+
+
+GRAPH_STORE_DIR = os.environ.get("GRAPH_STORE_DIR") or _default_store_dir()
+# Published versions kept on disk; older files are removed (mapped readers are unaffected)
+GRAPH_STORE_KEEP = int(os.environ.get("GRAPH_STORE_KEEP", "2"))
+
+MAGIC = b"TGS1"
+FORMAT_VERSION = 1
+EDGE_KINDS = ("edges_new", "edges_existing")
+SECTIONS = (
+    "name_offsets", "names",
+    "edges_new_offsets", "edges_new_targets",
+    "edges_existing_offsets", "edges_existing_targets",
+    "payload_offsets", "payloads",
+    "flags", "meta",
+)
+_HEADER = struct.Struct(f"<4sIII{2 * len(SECTIONS)}Q")
+
+
+def _pack_blobs(items: list[bytes]) -> tuple[bytes, bytes]:
+    offsets = array("Q", [0])
+    for item in items:
+        offsets.append(offsets[-1] + len(item))
+    return offsets.tobytes(), b"".join(items)
+
+
+def _pad(n: int) -> int:
+    return -n % 8
+
+
+def write_graph(path: str, nodes: dict[str, Any], meta: dict[str, Any]) -> None:
+    """Serialise a graph3 nodes dict to `path` (written to a temp file, then renamed into place)."""
+    names = list(nodes)
+    ids = {name: i for i, name in enumerate(names)}
+    for node in nodes.values():
+        for kind in EDGE_KINDS:
+            for target in node.get(kind, ()):
+                if target not in ids:
+                    ids[target] = len(names)
+                    names.append(target)
+
+    sections: dict[str, bytes] = {}
+    sections["name_offsets"], sections["names"] = _pack_blobs([name.encode("utf-8") for name in names])
+    for kind in EDGE_KINDS:
+        offsets, targets = array("I", [0]), array("I")
+        for node in nodes.values():
+            targets.extend(ids[target] for target in node.get(kind, ()))
+            offsets.append(len(targets))
+        sections[f"{kind}_offsets"], sections[f"{kind}_targets"] = offsets.tobytes(), targets.tobytes()
+    payloads = [
+        json.dumps({k: v for k, v in node.items() if k not in EDGE_KINDS}, separators=(",", ":")).encode("utf-8")
+        for node in nodes.values()
+    ]
+    sections["payload_offsets"], sections["payloads"] = _pack_blobs(payloads)
+    sections["flags"] = bytes(
+        sum(1 << bit for bit, kind in enumerate(EDGE_KINDS) if kind in node) for node in nodes.values()
+    )
+    sections["meta"] = json.dumps(meta).encode("utf-8")
+
+    table, position = [], _HEADER.size + _pad(_HEADER.size)
+    for name in SECTIONS:
+        table += [position, len(sections[name])]
+        position += len(sections[name]) + _pad(len(sections[name]))
+
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".graph-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(nodes), len(names), *table))
+            f.write(b"\0" * _pad(_HEADER.size))
+            for name in SECTIONS:
+                f.write(sections[name])
+                f.write(b"\0" * _pad(len(sections[name])))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class GraphView(Mapping):
+    """
+    Read-only, memory-mapped graph3 nodes. Behaves like the nodes dict: view[path]
+    returns a freshly decoded node (so callers may modify it), iteration yields node
+    paths in build order.
+    """
+
+    def __init__(self, path: str, version: int = 0):
+        self.path = path
+        self.version = version
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+        magic, fmt, self._node_count, name_count, *table = _HEADER.unpack_from(buf)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a graph store file (format {FORMAT_VERSION})")
+        raw = {name: buf[table[2 * i]:table[2 * i] + table[2 * i + 1]] for i, name in enumerate(SECTIONS)}
+
+        self._payload_offsets = raw["payload_offsets"].cast("Q")
+        self._payloads = raw["payloads"]
+        self._flags = raw["flags"]
+        self._edges = {kind: (raw[f"{kind}_offsets"].cast("I"), raw[f"{kind}_targets"].cast("I"))
+                       for kind in EDGE_KINDS}
+        self.meta: dict[str, Any] = json.loads(bytes(raw["meta"]))
+
+        name_offsets, names = raw["name_offsets"].cast("Q"), raw["names"]
+        self._names = tuple(str(names[name_offsets[i]:name_offsets[i + 1]], "utf-8") for i in range(name_count))
+        self._ids = {name: i for i, name in enumerate(self._names)}
+
+    def __len__(self) -> int:
+        return self._node_count
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names[:self._node_count])
+
+    def __contains__(self, path: object) -> bool:
+        i = self._ids.get(path)  # type: ignore[arg-type]
+        return i is not None and i < self._node_count
+
+    def _node_id(self, path: str) -> int:
+        i = self._ids.get(path)
+        if i is None or i >= self._node_count:
+            raise KeyError(path)
+        return i
+
+    def neighbor_ids(self, path: str, kind: str = "edges_new") -> memoryview:
+        """Target name ids of one node's edges: a zero-copy slice of the mapping."""
+        i = self._node_id(path)
+        offsets, targets = self._edges[kind]
+        return targets[offsets[i]:offsets[i + 1]]
+
+    def neighbors(self, path: str, kind: str = "edges_new") -> list[str]:
+        return [self._names[t] for t in self.neighbor_ids(path, kind)]
+
+    def __getitem__(self, path: str) -> dict[str, Any]:
+        i = self._node_id(path)
+        node = json.loads(bytes(self._payloads[self._payload_offsets[i]:self._payload_offsets[i + 1]]))
+        for bit, kind in enumerate(EDGE_KINDS):
+            if self._flags[i] & (1 << bit):
+                node[kind] = self.neighbors(path, kind)
+        return node
+
+    def to_dict(self) -> dict[str, Any]:
+        """Every node decoded into a plain dict (e.g. for JSON responses or per-request enrichment)."""
+        return {path: self[path] for path in self}
+
+
+def as_dict(nodes: Mapping) -> dict[str, Any]:
+    """The nodes as a plain dict: the dict itself, or a GraphView decoded."""
+    return nodes if isinstance(nodes, dict) else nodes.to_dict()
+
+
+class GraphStore:
+    """A directory of published graph versions plus a CURRENT pointer, shared by all processes on the host."""
+
+    def __init__(self, directory: str = GRAPH_STORE_DIR, keep: int = GRAPH_STORE_KEEP):
+        self.directory = directory
+        self.keep = max(1, keep)
+        self._current: Optional[GraphView] = None
+        self._local_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _pointer(self) -> str:
+        return os.path.join(self.directory, "CURRENT")
+
+    def _version_path(self, version: int) -> str:
+        return os.path.join(self.directory, f"graph-{version:08d}.bin")
+
+    def current_version(self) -> Optional[int]:
+        try:
+            with open(self._pointer()) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def current(self) -> Optional[GraphView]:
+        """The latest published graph, mapped once per version in this process."""
+        version = self.current_version()
+        if version is None:
+            return None
+        with self._local_lock:
+            if self._current is None or self._current.version != version:
+                try:
+                    self._current = GraphView(self._version_path(version), version)
+                except (FileNotFoundError, ValueError):
+                    logger.exception("[graph] Could not open graph store version %d", version)
+                    return None
+            return self._current
+
+    @contextmanager
+    def lock(self):
+        """Cross-process lock: one process builds and publishes while the others wait, then attach."""
+        with open(os.path.join(self.directory, "lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def publish(self, nodes: dict[str, Any], meta: dict[str, Any]) -> GraphView:
+        """Write a new version and make it current. Call with lock() held."""
+        version = (self.current_version() or 0) + 1
+        write_graph(self._version_path(version), nodes, meta)
+
+        fd, tmp_pointer = tempfile.mkstemp(dir=self.directory, prefix=".CURRENT-")
+        with os.fdopen(fd, "w") as f:
+            f.write(str(version))
+        os.replace(tmp_pointer, self._pointer())
+        self._prune(version)
+        logger.info("[graph] Published graph store version %d (%d resource paths)", version, len(nodes))
+        return self.current()
+
+    def _prune(self, latest: int) -> None:
+        for name in os.listdir(self.directory):
+            if name.startswith("graph-") and name.endswith(".bin"):
+                try:
+                    version = int(name[len("graph-"):-len(".bin")])
+                except ValueError:
+                    continue
+                if version <= latest - self.keep:
+                    os.unlink(os.path.join(self.directory, name))
+
+
+_stores: dict[str, GraphStore] = {}
+_store_lock = threading.Lock()
+
+
+def get_store(workspace: str = DEFAULT_WORKSPACE) -> GraphStore:
+    """The store for a workspace (workspaces.py); the default workspace uses GRAPH_STORE_DIR itself."""
+    with _store_lock:
+        store = _stores.get(workspace)
+        if store is None:
+            if workspace == DEFAULT_WORKSPACE:
+                directory = GRAPH_STORE_DIR
+            else:
+                directory = os.path.join(GRAPH_STORE_DIR, "workspaces", workspace)
+            store = _stores[workspace] = GraphStore(directory)
+        return store
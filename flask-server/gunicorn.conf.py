@@ -0,0 +1,44 @@
+"""
+gunicorn settings for the production server (gunicorn wsgi:app). Every setting can
+be overridden with the environment variable next to it, or on the command line.
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+
+# Processes for CPU-bound work (graph building, embedding); threads per process for
+# requests that mostly wait on the LLM. Workers share the preloaded graph copy-on-write.
+workers = int(os.environ.get("WEB_CONCURRENCY", str(min(multiprocessing.cpu_count(), 4))))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+# Import wsgi.py (and so build the graph / index) once in the master, before forking
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1").lower() in ("1", "true", "yes")
+
+# A gthread worker heartbeats from its main loop, so long LLM-bound requests don't
+# trip this; it only replaces workers that stop responding altogether.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+
+# Recycle workers after this many requests (0 = never), with jitter so they don't restart together
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+
+# Workers map one shared copy of the graph (graph_store.py) instead of each holding its own
+os.environ.setdefault("GRAPH_STORE", "1")
+
+# Hugging Face tokenizers disable their thread pool (with a warning) in a process
+# forked after the pool was used; decide up front instead.
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+
+def post_fork(server, worker):
+    from wsgi import reset_after_fork
+
+    reset_after_fork()
@@ -0,0 +1,417 @@
+"""
+Background jobs for long-running requests (/api/graph4 enrichment).
+
+A JobManager runs submitted functions on a small local thread pool. Each Job keeps
+an append-only log of (event, data) pairs — status changes, stages, partial
+results — so a client can poll the job's current state or replay and follow the
+log as server-sent events, even if it subscribes after the job started.
+
+Jobs are keyed: submitting a key that already has a queued or running job returns
+that job instead of starting a second one.
+
+With a JobStore (app.py uses one), job state and event logs are also written to a
+SQLite file shared by every worker process on the host. A job started in one
+gunicorn worker can then be polled and followed from any other, and a key is
+claimed host-wide, so N workers don't run the same analysis N times. Jobs whose
+process died are reported as failed.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, Optional
+
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs kept in memory for polling (oldest evicted first)
+JOB_HISTORY = int(os.environ.get("JOB_HISTORY", "100"))
+# Seconds between keep-alive events on an idle job stream
+JOB_HEARTBEAT_SECONDS = float(os.environ.get("JOB_HEARTBEAT_SECONDS", "15"))
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.db"))
+# Seconds between reads of the shared store while following a job run by another process
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "0.5"))
+
+ACTIVE_STATES = ("queued", "running")
+
+
+def _owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    """False only for a process on this host that no longer exists."""
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore(SQLiteStore):
+    """Job rows and event logs in a SQLite file shared by the worker processes on a host."""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        " id TEXT PRIMARY KEY, manager TEXT NOT NULL, key TEXT NOT NULL, status TEXT NOT NULL,"
+        " error TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL, owner TEXT)",
+        "CREATE INDEX IF NOT EXISTS jobs_manager_key ON jobs (manager, key, status)",
+        "CREATE TABLE IF NOT EXISTS job_events ("
+        " job_id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL, data TEXT NOT NULL,"
+        " PRIMARY KEY (job_id, seq))",
+    )
+    # Transactions are explicit (BEGIN IMMEDIATE), so claims are serialised across processes
+    ISOLATION_LEVEL = None
+
+    def __init__(self, db_path: str = JOB_DB_PATH, history: int = JOB_HISTORY):
+        super().__init__(db_path)
+        self._history = history
+
+    def claim(self, manager: str, job: "Job") -> Optional[str]:
+        """
+        Record a new job unless a live process already runs one for its key; returns
+        that job's id instead. Active jobs of dead processes are marked failed first.
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT id, owner FROM jobs WHERE manager = ? AND key = ? AND status IN ('queued', 'running')",
+                    (manager, job.key),
+                ).fetchall()
+                for job_id, owner in rows:
+                    if _owner_alive(owner):
+                        conn.execute("COMMIT")
+                        return job_id
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                        ("worker process exited", time.time(), job_id),
+                    )
+                self._insert(conn, manager, job)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return None
+
+    def add(self, manager: str, job: "Job") -> None:
+        """Record a job without claiming its key (an already finished one)."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._insert(conn, manager, job)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _insert(self, conn: sqlite3.Connection, manager: str, job: "Job") -> None:
+        conn.execute(
+            "INSERT INTO jobs (id, manager, key, status, created_at, started_at, owner) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job.id, manager, job.key, job.status, job.created_at, job.started_at, _owner()),
+        )
+        self._prune(conn, manager)
+
+    def _prune(self, conn: sqlite3.Connection, manager: str) -> None:
+        old = [row[0] for row in conn.execute(
+            "SELECT id FROM jobs WHERE manager = ? AND status NOT IN ('queued', 'running')"
+            " ORDER BY created_at DESC LIMIT -1 OFFSET ?", (manager, self._history),
+        )]
+        for job_id in old:
+            conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def update(self, job: "Job") -> None:
+        with self._lock:
+            self._connection().execute(
+                "UPDATE jobs SET status = ?, error = ?, started_at = ?, finished_at = ? WHERE id = ?",
+                (job.status, job.error, job.started_at, job.finished_at, job.id),
+            )
+
+    def append(self, job_id: str, seq: int, event: str, data: Any) -> None:
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO job_events (job_id, seq, event, data) VALUES (?, ?, ?, ?)",
+                (job_id, seq, event, json.dumps(data)),
+            )
+
+    def load(self, job_id: str) -> Optional[dict[str, Any]]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT id, key, status, error, created_at, started_at, finished_at, owner FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        fields = dict(zip(("id", "key", "status", "error", "created_at", "started_at", "finished_at", "owner"), row))
+        if fields["status"] in ACTIVE_STATES and not _owner_alive(fields["owner"]):
+            fields.update(status="failed", error="worker process exited", finished_at=fields["finished_at"] or time.time())
+        return fields
+
+    def events(self, job_id: str, after: int = -1) -> list[tuple[str, Any]]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, after)
+            ).fetchall()
+        return [(event, json.loads(data)) for event, data in rows]
+
+    def stats(self, manager: str) -> dict[str, int]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE manager = ? GROUP BY status", (manager,)
+            ).fetchall()
+        return dict(rows)
+
+
+class Job:
+    def __init__(self, key: str, store: Optional[JobStore] = None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"  # "queued" | "running" | "done" | "failed"
+        self.stage: Optional[str] = None
+        self.partial: dict[str, Any] = {}  # merged "partial" event payloads
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._events: list[tuple[str, Any]] = []
+        self._cond = threading.Condition()
+        self._store = store
+
+    @property
+    def finished(self) -> bool:
+        return self.status not in ACTIVE_STATES
+
+    def emit(self, event: str, data: Any) -> None:
+        """Append to the job's event log. "stage" and "partial" events also update the polled state."""
+        with self._cond:
+            if event == "stage":
+                self.stage = data.get("stage")
+            elif event == "partial":
+                self.partial.update(data)
+            self._append(event, data)
+            self._cond.notify_all()
+
+    def _append(self, event: str, data: Any) -> None:
+        # Caller holds _cond
+        self._events.append((event, data))
+        if self._store is not None:
+            self._store.append(self.id, len(self._events) - 1, event, data)
+
+    def _set_status(self, status: str, **fields) -> None:
+        with self._cond:
+            self.status = status
+            for name, value in fields.items():
+                setattr(self, name, value)
+            if self._store is not None:
+                self._store.update(self)
+            self._cond.notify_all()
+
+    def start(self) -> None:
+        self._set_status("running", started_at=time.time())
+        self.emit("status", {"status": "running"})
+
+    def succeed(self, result: Any) -> None:
+        with self._cond:
+            self.result = result
+            self._append("result", result)
+            self._set_status("done", finished_at=time.time())
+
+    def fail(self, error: str) -> None:
+        with self._cond:
+            self._append("error", {"error": error})
+            self._set_status("failed", error=error, finished_at=time.time())
+
+    def events(self, heartbeat: Optional[float] = None) -> Iterator[tuple[str, Any]]:
+        """Replay the event log from the start, then follow it until the job finishes."""
+        heartbeat = JOB_HEARTBEAT_SECONDS if heartbeat is None else heartbeat
+        sent = 0
+        while True:
+            with self._cond:
+                if sent == len(self._events) and not self.finished:
+                    self._cond.wait(heartbeat)
+                pending = self._events[sent:]
+                done = self.finished
+            if not pending and not done:
+                yield "ping", {"status": self.status}
+            for event in pending:
+                yield event
+            sent += len(pending)
+            if done and sent == len(self._events):
+                return
+
+    def to_dict(self, include_result: bool = True) -> dict[str, Any]:
+        with self._cond:
+            data = {
+                "job_id": self.id,
+                "key": self.key,
+                "status": self.status,
+                "stage": self.stage,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "error": self.error,
+                "partial": dict(self.partial),
+            }
+            if include_result:
+                data["result"] = self.result
+        return data
+
+
+class StoredJob:
+    """A job run by another process, read from the JobStore: the same to_dict() / events() as Job."""
+
+    def __init__(self, store: JobStore, job_id: str):
+        self.id = job_id
+        self._store = store
+
+    @property
+    def finished(self) -> bool:
+        fields = self._store.load(self.id)
+        return fields is None or fields["status"] not in ACTIVE_STATES
+
+    def to_dict(self, include_result: bool = True) -> dict[str, Any]:
+        fields = self._store.load(self.id) or {}
+        stage, partial, result = None, {}, None
+        for event, data in self._store.events(self.id):
+            if event == "stage":
+                stage = data.get("stage")
+            elif event == "partial":
+                partial.update(data)
+            elif event == "result":
+                result = data
+        data = {
+            "job_id": self.id,
+            "key": fields.get("key"),
+            "status": fields.get("status"),
+            "stage": stage,
+            "created_at": fields.get("created_at"),
+            "started_at": fields.get("started_at"),
+            "finished_at": fields.get("finished_at"),
+            "error": fields.get("error"),
+            "partial": partial,
+        }
+        if include_result:
+            data["result"] = result
+        return data
+
+    def events(self, heartbeat: Optional[float] = None) -> Iterator[tuple[str, Any]]:
+        """Replay the stored event log, then poll it until the job finishes (or its process dies)."""
+        heartbeat = JOB_HEARTBEAT_SECONDS if heartbeat is None else heartbeat
+        sent, idle_since, failed = -1, time.monotonic(), False
+        while True:
+            # State first: events written before the job finished are all in the read that follows
+            fields = self._store.load(self.id)
+            pending = self._store.events(self.id, after=sent)
+            for event in pending:
+                failed = failed or event[0] == "error"
+                yield event
+            sent += len(pending)
+            if fields is None or fields["status"] not in ACTIVE_STATES:
+                if fields is not None and fields["status"] == "failed" and not failed:
+                    # Its process died without logging the failure
+                    yield "error", {"error": fields["error"]}
+                return
+            if pending:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= heartbeat:
+                yield "ping", {"status": fields["status"]}
+                idle_since = time.monotonic()
+            time.sleep(JOB_POLL_SECONDS)
+
+
+class JobManager:
+    """
+    Runs keyed jobs on a bounded thread pool and remembers recent ones for polling;
+    with a JobStore, also across the worker processes sharing it.
+    """
+
+    def __init__(self, name: str, max_workers: int = 2, history: int = JOB_HISTORY, store: Optional[JobStore] = None):
+        self.name = name
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-job")
+        self._history = history
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._active: dict[str, Job] = {}  # key -> queued/running job
+
+    def _remember(self, job: Job) -> None:
+        # Caller holds _lock
+        self._jobs[job.id] = job
+        finished = [j.id for j in self._jobs.values() if j.finished and j.id != job.id]
+        for job_id in finished[: max(0, len(self._jobs) - self._history)]:
+            del self._jobs[job_id]
+
+    def submit(self, key: str, fn: Callable[[Job], Any]) -> Job:
+        """Run fn(job) in the background; returns the already active job for this key if there is one."""
+        with self._lock:
+            active = self._active.get(key)
+            if active is not None:
+                return active
+            job = Job(key, self.store)
+            if self.store is not None:
+                running_elsewhere = self.store.claim(self.name, job)
+                if running_elsewhere is not None:
+                    return StoredJob(self.store, running_elsewhere)
+            self._active[key] = job
+            self._remember(job)
+
+        def run() -> None:
+            job.start()
+            try:
+                result = fn(job)
+            except Exception as e:
+                logger.exception("[jobs] %s job %s failed", self.name, job.id)
+                job.fail(str(e))
+            else:
+                job.succeed(result)
+            finally:
+                with self._lock:
+                    if self._active.get(key) is job:
+                        del self._active[key]
+
+        self._executor.submit(run)
+        return job
+
+    def completed(self, key: str, result: Any) -> Job:
+        """Record an already finished job (e.g. a stored result), so clients follow the same flow."""
+        job = Job(key, self.store)
+        job.started_at = job.created_at
+        if self.store is not None:
+            self.store.add(self.name, job)
+        job.succeed(result)
+        with self._lock:
+            self._remember(job)
+        return job
+
+    def get(self, job_id: str):
+        """The job (a StoredJob when another process runs it), or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None and self.store.load(job_id) is not None:
+            return StoredJob(self.store, job_id)
+        return job
+
+    def stats(self) -> dict[str, Any]:
+        if self.store is not None:
+            counts = self.store.stats(self.name)
+            return {status: counts.get(status, 0) for status in ("queued", "running", "done", "failed")}
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in ("queued", "running", "done", "failed")}
@@ -0,0 +1,146 @@
+"""
+Content-addressed LLM response cache.
+
+Every LLM call in the pipeline runs at (or near) temperature 0 with a prompt fully
+determined by its inputs, so the response is memoized on sha256(model + params +
+prompt) in a local SQLite file. Re-running /api/graph4 or the same queries against
+an unchanged plan then makes no remote calls. Entries expire after a TTL and the
+least recently used ones are evicted past a size limit.
+
+Two adapters plug the store into the clients we use:
+- LangChainLLMCache: a langchain BaseCache, passed as ChatAnthropic(cache=...)
+- the llama-index Anthropic client is wrapped in rag.CachedAnthropic
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Optional
+
+from langchain_core.caches import BaseCache
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, Generation
+
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE", "1").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.environ.get(
+    "LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.db")
+)
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+
+
+def make_cache_key(model: str, params: dict[str, Any], prompt: Any) -> str:
+    """sha256 over a canonical JSON encoding of (model, params, prompt)."""
+    payload = json.dumps({"model": model, "params": params, "prompt": prompt}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache(SQLiteStore):
+    """SQLite-backed key -> response text store with TTL and LRU eviction."""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS llm_responses ("
+        " key TEXT PRIMARY KEY, response TEXT NOT NULL,"
+        " created_at REAL NOT NULL, last_used REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS llm_responses_last_used ON llm_responses (last_used)",
+    )
+
+    def __init__(self, db_path: str, max_entries: int = 5000, ttl_seconds: float = 7 * 24 * 3600):
+        super().__init__(db_path)
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT response FROM llm_responses WHERE key = ? AND created_at > ?", (key, now - self._ttl)
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            conn.execute("UPDATE llm_responses SET last_used = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self._stats["hits"] += 1
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            conn.execute("DELETE FROM llm_responses WHERE created_at <= ?", (now - self._ttl,))
+            evicted = conn.execute(
+                "DELETE FROM llm_responses WHERE key IN ("
+                " SELECT key FROM llm_responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self._max_entries,),
+            ).rowcount
+            conn.commit()
+            self._stats["writes"] += 1
+            self._stats["evictions"] += max(evicted, 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM llm_responses")
+            conn.commit()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            entries = self._connection().execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+            return dict(self._stats, entries=entries)
+
+
+class LangChainLLMCache(BaseCache):
+    """langchain BaseCache over LLMResponseCache (llm_string carries model + invocation params)."""
+
+    def __init__(self, store: LLMResponseCache):
+        self._store = store
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return make_cache_key("langchain", {"llm_string": llm_string}, prompt)
+
+    def lookup(self, prompt: str, llm_string: str):
+        cached = self._store.get(self._key(prompt, llm_string))
+        if cached is None:
+            return None
+        try:
+            generations = json.loads(cached)
+        except json.JSONDecodeError:
+            logger.warning("[llm-cache] Dropping unreadable cache entry")
+            return None
+        return [
+            ChatGeneration(message=AIMessage(content=g["content"]))
+            if g.get("chat") else Generation(text=g["content"])
+            for g in generations
+        ]
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        # Only the content is kept — not provider ids, headers or token usage (a hit costs no tokens)
+        generations = []
+        for g in return_val:
+            if isinstance(g, ChatGeneration):
+                generations.append({"chat": True, "content": g.message.content})
+            else:
+                generations.append({"chat": False, "content": g.text})
+        self._store.put(self._key(prompt, llm_string), json.dumps(generations))
+
+    def clear(self, **kwargs: Any) -> None:
+        self._store.clear()
+
+
+llm_response_cache = LLMResponseCache(
+    LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES, ttl_seconds=LLM_CACHE_TTL
+)
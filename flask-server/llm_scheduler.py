@@ -0,0 +1,412 @@
+"""
+Process-wide scheduler for outbound LLM (and local embedding) calls.
+
+Every remote call takes a slot from a shared scheduler before it runs:
+- a concurrency cap (semaphore) and a token bucket (requests per minute) bound
+  how hard we hit the provider, no matter how many requests / sub-questions fan out
+- waiters are served by priority, so interactive queries (/api/query) jump ahead
+  of batch work (/api/graph4); FIFO within a priority
+- 429 / 5xx / overloaded responses are retried with jittered exponential backoff
+  (honouring Retry-After), and a 429 pauses the whole bucket so other callers
+  back off too
+- queue wait time is recorded per priority for /api/llm/scheduler
+
+The priority comes from a context variable, set per request with llm_priority();
+it follows work into worker threads started with contextvars.copy_context() and
+into asyncio tasks.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+import tracing
+from metrics import observe_llm_call
+
+logger = logging.getLogger(__name__)
+
+LLM_SCHEDULER_CONCURRENCY = int(os.environ.get("LLM_SCHEDULER_CONCURRENCY", "4"))
+LLM_RATE_PER_MINUTE = float(os.environ.get("LLM_RATE_PER_MINUTE", "50"))
+LLM_RATE_BURST = int(os.environ.get("LLM_RATE_BURST", str(LLM_SCHEDULER_CONCURRENCY)))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_BASE_DELAY = float(os.environ.get("LLM_RETRY_BASE_DELAY", "1.0"))
+LLM_RETRY_MAX_DELAY = float(os.environ.get("LLM_RETRY_MAX_DELAY", "30"))
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "2"))
+
+# Lower value = served first
+PRIORITIES = {"interactive": 0, "batch": 10}
+
+# 529 is Anthropic's "overloaded"
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+_current_priority: ContextVar[str] = ContextVar("llm_priority", default="interactive")
+
+
+@contextmanager
+def llm_priority(name: str):
+    """Run the enclosed block's LLM / embedding calls at this priority ("interactive" or "batch")."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority {name!r}; expected one of {sorted(PRIORITIES)}")
+    token = _current_priority.set(name)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority() -> str:
+    return _current_priority.get()
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Rate limits, overload / server errors, timeouts and dropped connections."""
+    if _status_code(exc) in RETRYABLE_STATUS:
+        return True
+    name = type(exc).__name__
+    return name in ("APIConnectionError", "APITimeoutError", "RateLimitError", "OverloadedError")
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class _Waiter:
+    __slots__ = ("priority", "granted", "wake", "enqueued_at")
+
+    def __init__(self, priority: str, wake: Callable[[], None], enqueued_at: float):
+        self.priority = priority
+        self.granted = False
+        self.wake = wake
+        self.enqueued_at = enqueued_at
+
+
+class LLMScheduler:
+    """Priority-ordered concurrency cap + token bucket, usable from threads and coroutines."""
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        rate_per_minute: float = 0,
+        burst: int = 1,
+        max_retries: int = 0,
+        retry_base_delay: float = 1.0,
+        retry_max_delay: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.name = name
+        self._max_concurrency = max(1, max_concurrency)
+        self._rate = rate_per_minute / 60.0  # tokens per second; 0 = no rate limit
+        self._burst = max(1, burst)
+        self._max_retries = max_retries
+        self._retry_base_delay = retry_base_delay
+        self._retry_max_delay = retry_max_delay
+        self._clock = clock
+        self._sleep = sleep
+
+        self._lock = threading.Lock()
+        self._heap: list[tuple[int, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._tokens = float(self._burst)
+        self._refilled_at = clock()
+        self._not_before = 0.0  # set by a 429: nobody starts before this time
+        self._stats = {"calls": 0, "retries": 0, "rate_limited": 0, "failures": 0}
+        self._waits = {p: {"count": 0, "total_wait": 0.0, "max_wait": 0.0} for p in PRIORITIES}
+
+    # -- slot bookkeeping (caller holds self._lock) -------------------------
+
+    def _refill(self, now: float) -> None:
+        if self._rate > 0:
+            self._tokens = min(self._burst, self._tokens + (now - self._refilled_at) * self._rate)
+        self._refilled_at = now
+
+    def _dispatch(self) -> Optional[float]:
+        """Grant slots to the highest-priority waiters; return seconds until a token is due, if rate-bound."""
+        now = self._clock()
+        self._refill(now)
+        while self._heap and self._active < self._max_concurrency:
+            if now < self._not_before:
+                return self._not_before - now
+            if self._rate > 0 and self._tokens < 1:
+                return (1 - self._tokens) / self._rate
+            _, _, waiter = heapq.heappop(self._heap)
+            if self._rate > 0:
+                self._tokens -= 1
+            self._active += 1
+            waiter.granted = True
+            wait = now - waiter.enqueued_at
+            bucket = self._waits[waiter.priority]
+            bucket["count"] += 1
+            bucket["total_wait"] += wait
+            bucket["max_wait"] = max(bucket["max_wait"], wait)
+            if wait > 1.0:
+                logger.info("[llm-scheduler] %s %s call waited %.1fs for a slot", self.name, waiter.priority, wait)
+            waiter.wake()
+        return None
+
+    def _enqueue(self, wake: Callable[[], None]) -> tuple[_Waiter, Optional[float]]:
+        priority = current_priority()
+        with self._lock:
+            waiter = _Waiter(priority, wake, self._clock())
+            heapq.heappush(self._heap, (PRIORITIES[priority], next(self._seq), waiter))
+            return waiter, self._dispatch()
+
+    def _recheck(self) -> Optional[float]:
+        with self._lock:
+            return self._dispatch()
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        with self._lock:
+            if waiter.granted:
+                self._active -= 1
+            else:
+                self._heap = [entry for entry in self._heap if entry[2] is not waiter]
+                heapq.heapify(self._heap)
+            self._dispatch()
+
+    def _release(self) -> None:
+        with self._lock:
+            self._active -= 1
+            delay = self._dispatch()
+            # Rate-bound with nobody on a timer: have the head waiter come back when a token is due
+            if delay is not None and self._heap:
+                self._heap[0][2].wake()
+
+    def penalize(self, delay: float) -> None:
+        """Hold off every caller for `delay` seconds (the provider said we're over the limit)."""
+        with self._lock:
+            self._not_before = max(self._not_before, self._clock() + delay)
+            self._stats["rate_limited"] += 1
+
+    # -- acquiring slots ------------------------------------------------------
+
+    @contextmanager
+    def slot(self):
+        """Block the current thread until a slot is granted; hold it for the enclosed block."""
+        event = threading.Event()
+        waiter, delay = self._enqueue(event.set)
+        try:
+            while not waiter.granted:
+                event.wait(delay)
+                event.clear()
+                if not waiter.granted:
+                    delay = self._recheck()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Async slot(): waits on the event loop instead of blocking a thread."""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter, delay = self._enqueue(lambda: loop.call_soon_threadsafe(event.set))
+        try:
+            while not waiter.granted:
+                try:
+                    await asyncio.wait_for(event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+                if not waiter.granted:
+                    delay = self._recheck()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    # -- calls with retry -------------------------------------------------------
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        delay = _retry_after(exc)
+        if delay is None:
+            delay = random.uniform(0, min(self._retry_max_delay, self._retry_base_delay * 2 ** attempt))
+        if _status_code(exc) == 429 or type(exc).__name__ == "RateLimitError":
+            self.penalize(delay)
+        return delay
+
+    def _should_retry(self, attempt: int, exc: BaseException) -> bool:
+        if attempt < self._max_retries and is_retryable(exc):
+            with self._lock:
+                self._stats["retries"] += 1
+            return True
+        with self._lock:
+            self._stats["failures"] += 1
+        return False
+
+    @contextmanager
+    def _observed(self, queued_at: float, attempt: int) -> Iterator[dict[str, Any]]:
+        """
+        Metrics and a tracing span for one attempt, entered once it holds a slot.
+        The caller stores a non-streamed response under "result" for its token counts.
+        """
+        priority = current_priority()
+        started = time.perf_counter()
+        attempt_info: dict[str, Any] = {"result": None}
+        with tracing.span(f"{self.name}.call", **{
+            "llm.scheduler": self.name,
+            "llm.priority": priority,
+            "llm.attempt": attempt + 1,
+            "llm.queue_wait_ms": round((started - queued_at) * 1000, 3),
+        }) as span:
+            try:
+                yield attempt_info
+            except Exception:
+                observe_llm_call(self.name, priority, started, "error")
+                raise
+            input_tokens, output_tokens = observe_llm_call(self.name, priority, started, "ok", attempt_info["result"])
+            span.set_attributes({"gen_ai.usage.input_tokens": input_tokens, "gen_ai.usage.output_tokens": output_tokens})
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn in a slot, retrying transient provider errors (the slot is released while backing off)."""
+        for attempt in itertools.count():
+            try:
+                queued_at = time.perf_counter()
+                with self.slot():
+                    with self._lock:
+                        self._stats["calls"] += 1
+                    with self._observed(queued_at, attempt) as attempt_info:
+                        attempt_info["result"] = fn(*args, **kwargs)
+                    return attempt_info["result"]
+            except Exception as exc:
+                if not self._should_retry(attempt, exc):
+                    raise
+                delay = self._backoff(attempt, exc)
+                logger.warning("[llm-scheduler] %s call failed (%s); retry %d in %.1fs",
+                               self.name, exc, attempt + 1, delay)
+                self._sleep(delay)
+
+    async def acall(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Async call(): fn is a coroutine function."""
+        for attempt in itertools.count():
+            try:
+                queued_at = time.perf_counter()
+                async with self.aslot():
+                    with self._lock:
+                        self._stats["calls"] += 1
+                    with self._observed(queued_at, attempt) as attempt_info:
+                        attempt_info["result"] = await fn(*args, **kwargs)
+                    return attempt_info["result"]
+            except Exception as exc:
+                if not self._should_retry(attempt, exc):
+                    raise
+                delay = self._backoff(attempt, exc)
+                logger.warning("[llm-scheduler] %s call failed (%s); retry %d in %.1fs",
+                               self.name, exc, attempt + 1, delay)
+                await asyncio.sleep(delay)
+
+    def stream(self, fn: Callable[..., Iterator[Any]], *args, **kwargs) -> Iterator[Any]:
+        """
+        call() for streaming responses: the slot is held until the stream is consumed or closed.
+        Only failures before the first chunk are retried (the caller has already seen the rest).
+        Streamed chunks carry no usage totals, so only latency is recorded.
+        """
+        for attempt in itertools.count():
+            started = False
+            try:
+                queued_at = time.perf_counter()
+                with self.slot():
+                    with self._lock:
+                        self._stats["calls"] += 1
+                    with self._observed(queued_at, attempt):
+                        for chunk in fn(*args, **kwargs):
+                            started = True
+                            yield chunk
+                return
+            except Exception as exc:
+                if started or not self._should_retry(attempt, exc):
+                    if started:
+                        with self._lock:
+                            self._stats["failures"] += 1
+                    raise
+                delay = self._backoff(attempt, exc)
+                logger.warning("[llm-scheduler] %s stream failed (%s); retry %d in %.1fs",
+                               self.name, exc, attempt + 1, delay)
+                self._sleep(delay)
+
+    async def astream(self, fn: Callable[..., AsyncIterator[Any]], *args, **kwargs) -> AsyncIterator[Any]:
+        """Async stream(): fn returns an async iterator."""
+        for attempt in itertools.count():
+            started = False
+            try:
+                queued_at = time.perf_counter()
+                async with self.aslot():
+                    with self._lock:
+                        self._stats["calls"] += 1
+                    with self._observed(queued_at, attempt):
+                        async for chunk in fn(*args, **kwargs):
+                            started = True
+                            yield chunk
+                return
+            except Exception as exc:
+                if started or not self._should_retry(attempt, exc):
+                    if started:
+                        with self._lock:
+                            self._stats["failures"] += 1
+                    raise
+                delay = self._backoff(attempt, exc)
+                logger.warning("[llm-scheduler] %s stream failed (%s); retry %d in %.1fs",
+                               self.name, exc, attempt + 1, delay)
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            self._refill(self._clock())
+            return dict(
+                self._stats,
+                active=self._active,
+                queued=len(self._heap),
+                tokens=round(self._tokens, 2) if self._rate > 0 else None,
+                queue_wait={
+                    priority: dict(
+                        bucket,
+                        avg_wait=bucket["total_wait"] / bucket["count"] if bucket["count"] else 0.0,
+                    )
+                    for priority, bucket in self._waits.items()
+                },
+            )
+
+
+# Remote Anthropic calls (LangGraph ChatAnthropic and the llama-index Anthropic client)
+llm_scheduler = LLMScheduler(
+    "llm",
+    max_concurrency=LLM_SCHEDULER_CONCURRENCY,
+    rate_per_minute=LLM_RATE_PER_MINUTE,
+    burst=LLM_RATE_BURST,
+    max_retries=LLM_MAX_RETRIES,
+    retry_base_delay=LLM_RETRY_BASE_DELAY,
+    retry_max_delay=LLM_RETRY_MAX_DELAY,
+)
+
+# Local embedding model: CPU/GPU bound, so only a concurrency cap
+embed_scheduler = LLMScheduler("embed", max_concurrency=EMBED_CONCURRENCY)
@@ -0,0 +1,218 @@
+"""
+Load test for the mock-mode endpoints on the Flask (:8000) and Express (:8001) backends.
+
+Drives GET /api/graph4?mock=true and POST /api/query/langgraph with {"mock": true}
+(cycling through one question per LangGraph route, as in compare-outputs.sh) with a
+fixed number of concurrent clients, and reports per backend, scenario and
+concurrency level: requests, throughput, error rate and p50 / p95 / p99 / max
+latency. Nothing reaches an LLM, so the numbers measure the servers themselves.
+
+Each client sends its next request as soon as the previous one returns (a closed
+loop) over its own keep-alive connection, so throughput at a given concurrency is
+what the server can sustain; raise --concurrency until latency climbs to find the
+knee. Start the servers first (python app.py / node express-server/index.js).
+
+Usage:
+  python loadtest.py
+  python loadtest.py --target flask=http://localhost:8000 --concurrency 1,8,32 --duration 20
+  python loadtest.py --scenario langgraph --requests 500 --json results.json
+  python loadtest.py --max-p95-ms 250 --max-error-rate 0.01   # exit 1 when exceeded
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import math
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import urlsplit
+
+DEFAULT_TARGETS = {"flask": "http://localhost:8000", "express": "http://localhost:8001"}
+
+# One question per route type, matching compare-outputs.sh
+QUESTIONS = [
+    "What is the S3 bucket name?",
+    "What resources depend on the S3 bucket?",
+    "Are there any bugs in my Terraform plan?",
+]
+
+SCENARIOS = {
+    "graph4": lambda i: ("GET", "/api/graph4?mock=true", None),
+    "langgraph": lambda i: ("POST", "/api/query/langgraph",
+                            json.dumps({"question": QUESTIONS[i % len(QUESTIONS)], "mock": True})),
+}
+
+
+def _percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100)."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+class _Client:
+    """One keep-alive connection; reopened after the server closes it or a request fails."""
+
+    def __init__(self, base_url: str, timeout: float):
+        parts = urlsplit(base_url)
+        self._prefix = parts.path.rstrip("/")
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._connect = lambda: connection_class(parts.hostname, parts.port, timeout=timeout)
+        self._conn = self._connect()
+
+    def request(self, method: str, path: str, body: Optional[str]) -> int:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        try:
+            self._conn.request(method, self._prefix + path, body=body, headers=headers)
+            response = self._conn.getresponse()
+            response.read()
+            return response.status
+        except Exception:
+            self._conn.close()
+            self._conn = self._connect()
+            raise
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def run_level(base_url: str, scenario: str, concurrency: int, duration: float = 10.0,
+              requests: Optional[int] = None, timeout: float = 30.0) -> dict:
+    """
+    Run one scenario at one concurrency level for `duration` seconds, or until
+    `requests` requests have been sent when given. Returns latency percentiles (ms),
+    throughput and errors by kind (HTTP status or exception name).
+    """
+    make_request = SCENARIOS[scenario]
+    counter = itertools.count()
+    deadline = time.perf_counter() + duration
+    lock = threading.Lock()
+    latencies: list[float] = []
+    errors: dict[str, int] = {}
+
+    def worker() -> None:
+        client = _Client(base_url, timeout)
+        try:
+            while True:
+                i = next(counter)
+                if (requests is not None and i >= requests) or (requests is None and time.perf_counter() >= deadline):
+                    return
+                method, path, body = make_request(i)
+                started = time.perf_counter()
+                try:
+                    status = client.request(method, path, body)
+                    error = None if status < 400 else str(status)
+                except Exception as exc:
+                    error = type(exc).__name__
+                elapsed = time.perf_counter() - started
+                with lock:
+                    if error is None:
+                        latencies.append(elapsed)
+                    else:
+                        errors[error] = errors.get(error, 0) + 1
+        finally:
+            client.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    wall = time.perf_counter() - started
+
+    failed = sum(errors.values())
+    total = len(latencies) + failed
+    ms = [s * 1000 for s in latencies]
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": failed,
+        "error_rate": round(failed / total, 4) if total else 0.0,
+        "error_kinds": errors,
+        "seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "p50_ms": round(_percentile(ms, 50), 2) if ms else None,
+        "p95_ms": round(_percentile(ms, 95), 2) if ms else None,
+        "p99_ms": round(_percentile(ms, 99), 2) if ms else None,
+        "max_ms": round(max(ms), 2) if ms else None,
+    }
+
+
+def check(results: dict[str, list[dict]], max_p95_ms: Optional[float], max_error_rate: Optional[float]) -> list[str]:
+    """Threshold violations, one line each."""
+    problems = []
+    for target, levels in results.items():
+        for r in levels:
+            where = f"{target} {r['scenario']} c={r['concurrency']}"
+            if max_error_rate is not None and r["error_rate"] > max_error_rate:
+                problems.append(f"{where}: error rate {r['error_rate']:.2%} > {max_error_rate:.2%}")
+            if max_p95_ms is not None and r["p95_ms"] is not None and r["p95_ms"] > max_p95_ms:
+                problems.append(f"{where}: p95 {r['p95_ms']:.1f} ms > {max_p95_ms:.1f} ms")
+    return problems
+
+
+def report(results: dict[str, list[dict]]) -> None:
+    print(f"  {'target':<10}{'scenario':<11}{'conc':>5}{'requests':>10}{'req/s':>9}{'errors':>8}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for target, levels in results.items():
+        for r in levels:
+            latency = "".join(f"{r[k]:>9.1f}" if r[k] is not None else f"{'-':>9}"
+                              for k in ("p50_ms", "p95_ms", "p99_ms", "max_ms"))
+            print(f"  {target:<10}{r['scenario']:<11}{r['concurrency']:>5}{r['requests']:>10}"
+                  f"{r['throughput_rps']:>9.1f}{r['error_rate']:>8.1%}{latency}")
+            for kind, n in r["error_kinds"].items():
+                print(f"      {n} x {kind}")
+
+
+def _parse_target(value: str) -> tuple[str, str]:
+    name, sep, url = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected name=url, got {value!r}")
+    return name, url.rstrip("/")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", action="append", type=_parse_target,
+                        help="name=base_url (repeatable; default flask=:8000 and express=:8001)")
+    parser.add_argument("--scenario", choices=(*SCENARIOS, "all"), default="all")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated client counts")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--requests", type=int, help="requests per level instead of --duration")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per target and scenario")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--json", help="also write the full results here")
+    parser.add_argument("--max-p95-ms", type=float, help="exit 1 if any level's p95 exceeds this")
+    parser.add_argument("--max-error-rate", type=float, help="exit 1 if any level's error rate exceeds this (0-1)")
+    args = parser.parse_args()
+
+    targets = dict(args.target) if args.target else DEFAULT_TARGETS
+    scenarios = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    results: dict[str, list[dict]] = {}
+    for target, url in targets.items():
+        results[target] = []
+        for scenario in scenarios:
+            if args.warmup:
+                run_level(url, scenario, 1, requests=args.warmup, timeout=args.timeout)
+            for concurrency in levels:
+                print(f"[loadtest] {target} {scenario} concurrency={concurrency}", file=sys.stderr)
+                results[target].append(run_level(url, scenario, concurrency, duration=args.duration,
+                                                 requests=args.requests, timeout=args.timeout))
+    report(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"targets": targets, "results": results}, f, indent=2)
+    problems = check(results, args.max_p95_ms, args.max_error_rate)
+    for problem in problems:
+        print(f"FAIL {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+In-process metrics in the Prometheus text format (served by GET /metrics).
+
+Counters, gauges and histograms are plain dicts of label values -> numbers behind
+one lock per metric: recording is a dict lookup, a bisect and a few additions, so
+instrumentation stays on under load and nothing is exported until a scrape.
+Numbers other modules already keep (scheduler, caches, graph, index, jobs) are not
+duplicated here — register_collector() reads them at scrape time.
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
+
+# Seconds; spans cache hits (ms) through graph builds and full analyses (tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Family(NamedTuple):
+    """One metric family as rendered: samples are (name suffix, labels, value)."""
+
+    name: str
+    type: str
+    help: str
+    samples: list[tuple[str, dict[str, str], float]]
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), registry: Optional["Registry"] = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._labelset = frozenset(self.labelnames)
+        self._children: dict[tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        if labels.keys() != self._labelset:
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {sorted(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _labels(self, key: tuple[str, ...]) -> dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def collect(self) -> Family:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._children.get(self._key(labels), 0.0)
+
+    def collect(self) -> Family:
+        with self._lock:
+            items = list(self._children.items())
+        return Family(self.name, self.type, self.help, [("", self._labels(k), v) for k, v in items])
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS,
+                 registry: Optional["Registry"] = None):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)  # first bucket with le >= value; len(buckets) = +Inf
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            child[0][index] += 1
+            child[1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the block's duration in seconds (also when it raises)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            child = self._children.get(self._key(labels))
+            return sum(child[0]) if child else 0
+
+    def collect(self) -> Family:
+        with self._lock:
+            items = [(k, list(counts), total) for k, (counts, total) in self._children.items()]
+        samples = []
+        for key, counts, total in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for le, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                samples.append(("_bucket", {**labels, "le": _format_value(le)}, cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return Family(self.name, self.type, self.help, samples)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._collectors: list[Callable[[], Iterable[Family]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            self._metrics.append(metric)
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        """collector() is called on every scrape and returns Families built from existing stats."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> list[Family]:
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        families = [m.collect() for m in metrics]
+        for collector in collectors:
+            families.extend(collector())
+        return families
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4."""
+        lines = []
+        for family in self.collect():
+            lines.append(f"# HELP {family.name} {_escape_help(family.help)}")
+            lines.append(f"# TYPE {family.name} {family.type}")
+            for suffix, labels, value in family.samples:
+                lines.append(f"{family.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: Optional[float]) -> str:
+    if value is None:
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def stats_family(name: str, help: str, samples: Iterable[tuple[dict[str, str], Optional[float]]],
+                 type: str = "gauge") -> Family:
+    """A Family for a collector, from (labels, value) pairs (None values are skipped)."""
+    return Family(name, type, help, [("", labels, value) for labels, value in samples if value is not None])
+
+
+REGISTRY = Registry()
+
+
+# ---------------------------------------------------------------------------
+# Metrics shared across modules
+# ---------------------------------------------------------------------------
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests served, by route and status.", ["method", "route", "status"])
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time from request start to response (for streams: until the response starts).",
+    ["method", "route"],
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being handled, by route.", ["route"])
+
+LLM_CALL_SECONDS = Histogram(
+    "llm_call_duration_seconds",
+    "Outbound model call latency inside a scheduler slot (each retry attempt counts separately).",
+    ["scheduler", "priority", "outcome"],
+)
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the provider, by direction.", ["scheduler", "direction"])
+
+RAG_STAGE_SECONDS = Histogram(
+    "rag_retrieval_stage_seconds",
+    "Graph retriever stages: vector_search (incl. query embedding), graph_expand, pack.",
+    ["stage"],
+)
+RAG_RETRIEVED_NODES = Histogram(
+    "rag_retrieved_nodes", "Context nodes returned per retrieval.", [],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200),
+)
+RAG_INDEX_BUILD_SECONDS = Histogram(
+    "rag_index_build_seconds", "RAG index (re)build time.", ["outcome"],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+
+LANGGRAPH_NODE_SECONDS = Histogram("langgraph_node_duration_seconds", "LangGraph node run time.", ["node", "outcome"])
+
+
+def llm_usage(result: Any) -> tuple[Optional[int], Optional[int]]:
+    """(input, output) tokens from a LangChain ChatResult or a llama-index ChatResponse; None when unreported."""
+    generations = getattr(result, "generations", None)
+    if generations:
+        usage = getattr(getattr(generations[0], "message", None), "usage_metadata", None)
+        if usage:
+            return usage.get("input_tokens"), usage.get("output_tokens")
+    raw = getattr(result, "raw", None)
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if usage is None:
+        return None, None
+    if isinstance(usage, dict):
+        return usage.get("input_tokens"), usage.get("output_tokens")
+    return getattr(usage, "input_tokens", None), getattr(usage, "output_tokens", None)
+
+
+def observe_llm_call(scheduler: str, priority: str, started: float, outcome: str,
+                     result: Any = None) -> tuple[Optional[int], Optional[int]]:
+    """Record one call's latency (and its tokens, when result reports usage); returns (input, output) tokens."""
+    LLM_CALL_SECONDS.observe(time.perf_counter() - started, scheduler=scheduler, priority=priority, outcome=outcome)
+    if result is None:
+        return None, None
+    input_tokens, output_tokens = llm_usage(result)
+    if input_tokens:
+        LLM_TOKENS.inc(input_tokens, scheduler=scheduler, direction="input")
+    if output_tokens:
+        LLM_TOKENS.inc(output_tokens, scheduler=scheduler, direction="output")
+    return input_tokens, output_tokens
@@ -1,5 +1,11 @@
+import asyncio
 import logging
 import re
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from contextvars import ContextVar
 
 import nest_asyncio
 nest_asyncio.apply()
@@ -8,7 +14,9 @@ import json
 from typing import Any, Optional
 
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.core import VectorStoreIndex
+from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
 from llama_index.core.base.base_retriever import BaseRetriever
 from llama_index.core.callbacks import CallbackManager
 from llama_index.core.callbacks.base_handler import BaseCallbackHandler
@@ -17,20 +25,142 @@ from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.response_synthesizers import get_response_synthesizer
 from llama_index.core.prompts import PromptTemplate
 from llama_index.core.schema import TextNode, NodeWithScore, QueryBundle
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from llama_index.llms.ollama import Ollama
 from llama_index.llms.anthropic import Anthropic
+from llama_index.llms.anthropic.base import AnthropicChatResponse
 from llama_index.core.evaluation import FaithfulnessEvaluator, RelevancyEvaluator
-from app import build_graph3_nodes
+from app import graph_input_fingerprint, graph_input_version
+from graph_provider import get_graph
+from llm_cache import LLM_CACHE_ENABLED, llm_response_cache, make_cache_key
+from llm_scheduler import embed_scheduler, llm_priority, llm_scheduler
+from metrics import RAG_INDEX_BUILD_SECONDS, RAG_RETRIEVED_NODES, RAG_STAGE_SECONDS
+import tracing
+import workspaces
 import os
 
 logger = logging.getLogger(__name__)
 
-# Initialize local embedding model
-embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-large-en-v1.5")
+class ScheduledAnthropic(Anthropic):
+    """Anthropic LLM whose remote chat calls take a slot from the process-wide llm_scheduler (with retries)."""
+
+    def chat(self, messages, **kwargs):
+        return llm_scheduler.call(super().chat, messages, **kwargs)
+
+    async def achat(self, messages, **kwargs):
+        return await llm_scheduler.acall(super().achat, messages, **kwargs)
+
+    def stream_chat(self, messages, **kwargs):
+        # The slot is held until the stream is consumed
+        return llm_scheduler.stream(super().stream_chat, messages, **kwargs)
+
+
+class ScheduledEmbedding(BaseEmbedding):
+    """Wraps the local embedding model so concurrent embedding calls are bounded by embed_scheduler."""
+
+    _inner: Any = PrivateAttr()
+
+    def __init__(self, inner, **kwargs):
+        super().__init__(
+            model_name=getattr(inner, "model_name", "unknown"),
+            embed_batch_size=getattr(inner, "embed_batch_size", 10),
+            **kwargs,
+        )
+        self._inner = inner
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return embed_scheduler.call(self._inner._get_query_embedding, query)
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        # The model runs locally: keep it off the event loop
+        async with embed_scheduler.aslot():
+            return await asyncio.to_thread(self._inner._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return embed_scheduler.call(self._inner._get_text_embedding, text)
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        return embed_scheduler.call(self._inner._get_text_embeddings, texts)
+
+
+class CachedAnthropic(ScheduledAnthropic):
+    """Anthropic LLM whose chat calls (and completions, which route through chat) are memoized in llm_cache."""
+
+    def _cache_key(self, messages) -> str:
+        params = {"temperature": self.temperature, "max_tokens": self.max_tokens, "system": self.system_prompt}
+        prompt = [(m.role.value, m.content) for m in messages]
+        return make_cache_key(self.model, params, prompt)
+
+    def _cached_response(self, key: str) -> Optional[AnthropicChatResponse]:
+        text = llm_response_cache.get(key)
+        if text is None:
+            return None
+        return AnthropicChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=text))
+
+    def chat(self, messages, **kwargs):
+        key = self._cache_key(messages)
+        cached = self._cached_response(key)
+        if cached is not None:
+            return cached
+        response = super().chat(messages, **kwargs)
+        llm_response_cache.put(key, response.message.content or "")
+        return response
+
+    async def achat(self, messages, **kwargs):
+        key = self._cache_key(messages)
+        cached = self._cached_response(key)
+        if cached is not None:
+            return cached
+        response = await super().achat(messages, **kwargs)
+        llm_response_cache.put(key, response.message.content or "")
+        return response
+
+    def stream_chat(self, messages, **kwargs):
+        key = self._cache_key(messages)
+        cached = self._cached_response(key)
+        if cached is not None:
+            cached.delta = cached.message.content
+            yield cached
+            return
+        content = ""
+        for response in super().stream_chat(messages, **kwargs):
+            content = response.message.content or ""
+            yield response
+        # Only a fully consumed stream is cached
+        llm_response_cache.put(key, content)
+
+
+# Embedding model and LLM are created lazily (see get_embed_model / get_llm) so
+# importing this module is cheap and concurrent first calls construct them once.
+_embed_model: Optional[ScheduledEmbedding] = None
+_llm: Optional[Anthropic] = None
+_singleton_lock = threading.Lock()
+
+
+def get_embed_model() -> ScheduledEmbedding:
+    """Return the local embedding model, loading it on first call."""
+    global _embed_model
+    if _embed_model is None:
+        with _singleton_lock:
+            if _embed_model is None:
+                _embed_model = ScheduledEmbedding(HuggingFaceEmbedding(model_name="BAAI/bge-large-en-v1.5"))
+    return _embed_model
+
+
+def get_llm() -> ScheduledAnthropic:
+    """Return the LLM used for answer synthesis and evaluation, creating it on first call."""
+    global _llm
+    if _llm is None:
+        with _singleton_lock:
+            if _llm is None:
+                # _llm = Ollama(model="mistral", request_timeout=120.0)
+                llm_class = CachedAnthropic if LLM_CACHE_ENABLED else ScheduledAnthropic
+                # Retries happen in llm_scheduler (which releases the slot while backing off)
+                _llm = llm_class(
+                    model="claude-sonnet-4-20250514", api_key=os.environ["ANTHROPIC_API_KEY"], max_retries=0
+                )
+    return _llm
 
-# Initialize LLM
-# llm = Ollama(model="mistral", request_timeout=120.0)
-llm = Anthropic(model="claude-sonnet-4-20250514", api_key=os.environ["ANTHROPIC_API_KEY"])
 
 SYSTEM_PROMPT = (
     "You are a Terraform infrastructure expert. "
@@ -40,6 +170,64 @@ SYSTEM_PROMPT = (
 )
 
 
+class RetrievalTrace:
+    """
+    Retrieval events recorded for one request (or one sub-query).
+    The retriever and callback handler write into whichever trace is current in
+    the calling context, so concurrent requests never see each other's traces.
+    """
+
+    def __init__(self):
+        self.retrievals: list[dict[str, Any]] = []  # TerraformGraphRetriever traces
+        self.retrieve_payloads: list[dict[str, Any]] = []  # RETRIEVE callback payloads
+        self._lock = threading.Lock()
+
+    @property
+    def last(self) -> Optional[dict[str, Any]]:
+        """Most recent retriever trace (what /api/query/debug reports)."""
+        with self._lock:
+            return self.retrievals[-1] if self.retrievals else None
+
+    def add_retrieval(self, trace: dict[str, Any]) -> None:
+        with self._lock:
+            self.retrievals.append(trace)
+
+    def add_retrieve_payload(self, payload: dict[str, Any]) -> None:
+        with self._lock:
+            self.retrieve_payloads.append(payload)
+
+    def merge(self, other: "RetrievalTrace") -> None:
+        with self._lock:
+            self.retrievals.extend(other.retrievals)
+            self.retrieve_payloads.extend(other.retrieve_payloads)
+
+
+_current_trace: ContextVar[Optional[RetrievalTrace]] = ContextVar("rag_retrieval_trace", default=None)
+
+
+@contextmanager
+def capture_retrieval_trace():
+    """
+    Collect retrieval traces for everything run inside the block.
+    Nested captures (e.g. parallel LangGraph sub-queries) get their own trace,
+    which is also merged into the enclosing one on exit.
+    """
+    parent = _current_trace.get()
+    trace = RetrievalTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        if parent is not None:
+            parent.merge(trace)
+
+
+def current_retrieval_trace() -> Optional[RetrievalTrace]:
+    """The trace being collected in this context, or None outside capture_retrieval_trace()."""
+    return _current_trace.get()
+
+
 class RetrievalCallbackHandler(BaseCallbackHandler):
     """Captures RETRIEVE events for introspection (nodes retrieved, query, etc.)."""
 
@@ -48,7 +236,14 @@ class RetrievalCallbackHandler(BaseCallbackHandler):
             event_starts_to_ignore=[],
             event_ends_to_ignore=[],
         )
-        self.last_retrieve_payload: Optional[dict[str, Any]] = None
+
+    @property
+    def last_retrieve_payload(self) -> Optional[dict[str, Any]]:
+        """Last RETRIEVE payload recorded in the current context."""
+        trace = _current_trace.get()
+        if trace is None or not trace.retrieve_payloads:
+            return None
+        return trace.retrieve_payloads[-1]
 
     def on_event_start(
         self,
@@ -68,7 +263,9 @@ class RetrievalCallbackHandler(BaseCallbackHandler):
         **kwargs: Any,
     ) -> None:
         if event_type == CBEventType.RETRIEVE and payload:
-            self.last_retrieve_payload = dict(payload)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.add_retrieve_payload(dict(payload))
             nodes = payload.get(EventPayload.NODES, [])
             logger.info(
                 "[graph-rag callback] RETRIEVE event: query=%s, nodes=%d",
@@ -115,6 +312,202 @@ def _resource_to_text(path: str, address: str, resource: dict, node_data: dict)
     )
 
 
+# Rough chars-per-token for Claude/BPE tokenizers on JSON-heavy text; good enough for budgeting
+CHARS_PER_TOKEN = 4
+
+# Longest rendering of a single attribute value / edge list in packed context
+MAX_VALUE_CHARS = 300
+MAX_CONTEXT_EDGES = 20
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _compact_value(value: Any) -> str:
+    text = json.dumps(value, separators=(",", ":"), default=str)
+    if len(text) > MAX_VALUE_CHARS:
+        text = text[:MAX_VALUE_CHARS] + f"...(+{len(text) - MAX_VALUE_CHARS} chars)"
+    return text
+
+
+def _compact_edges(edges: list[str]) -> str:
+    shown = ", ".join(edges[:MAX_CONTEXT_EDGES])
+    if len(edges) > MAX_CONTEXT_EDGES:
+        shown += f" (+{len(edges) - MAX_CONTEXT_EDGES} more)"
+    return shown
+
+
+def _resource_to_context_text(path: str, address: str, resource: dict, node_data: dict) -> str:
+    """
+    Compact LLM-context rendering of a resource: changed fields only (the full
+    before/after JSON stays in the embedded text used for vector search).
+    """
+    change = resource.get("change", {})
+    diff = change.get("diff") or {}
+    lines = [
+        f"Terraform Resource: {address}",
+        f"Type: {resource.get('type', 'unknown')}",
+        f"Actions: {', '.join(change.get('actions', []))}",
+    ]
+    edges_new = node_data.get("edges_new", [])
+    edges_existing = node_data.get("edges_existing", [])
+    if edges_new:
+        lines.append(f"New edges: {_compact_edges(edges_new)}")
+    if edges_existing:
+        lines.append(f"Existing edges: {_compact_edges(edges_existing)}")
+    if diff:
+        lines.append("Changed fields:")
+        for key in sorted(diff):
+            values = diff[key]
+            lines.append(f"  {key}: {_compact_value(values.get('before'))} -> {_compact_value(values.get('after'))}")
+    else:
+        values = change.get("after") or change.get("before") or resource.get("values") or {}
+        if values:
+            lines.append(f"Values: {_compact_value(values)}")
+    return "\n".join(lines)
+
+
+# Relative importance of a resource by planned action when packing context
+ACTION_WEIGHTS = {
+    "delete": 1.0,
+    "create": 1.0,
+    "update": 1.0,
+    "read": 0.7,
+    "no-op": 0.6,
+    "existing": 0.5,
+    "external": 0.4,
+}
+
+
+class ContextPacker:
+    """
+    Ranks retrieval candidates and packs their compact text into a token budget.
+
+    Rank = retrieval score (vector similarity, or hop-decayed score for graph
+    neighbours) x action weight, with vector hits always ahead of graph hits.
+    Candidates are taken greedily in rank order; ones that don't fit the remaining
+    budget are skipped (smaller ones further down may still fit). token_budget <= 0
+    disables the budget but still compresses.
+    """
+
+    def __init__(self, nodes: dict, token_budget: int = 8000):
+        self._nodes = nodes
+        self._token_budget = token_budget
+
+    @staticmethod
+    def _action_weight(resource: dict) -> float:
+        actions = resource.get("change", {}).get("actions") or ["no-op"]
+        return max(ACTION_WEIGHTS.get(action, 0.6) for action in actions)
+
+    def pack(self, candidates: list[tuple[str, str, int, float]]) -> tuple[list[NodeWithScore], dict[str, Any]]:
+        """
+        candidates: (address, path, hop, score) with hop 0 for vector hits.
+        Returns (nodes in rank order, packing stats for the retrieval trace).
+        """
+        ranked = []
+        for address, path, hop, score in candidates:
+            node_data = self._nodes.get(path, {})
+            resource = node_data.get("resources", {}).get(address)
+            if resource is None:
+                continue
+            rank = score * self._action_weight(resource)
+            ranked.append((hop > 0, -rank, address, path, hop, score, resource, node_data))
+        ranked.sort(key=lambda item: item[:3])
+
+        budget = self._token_budget if self._token_budget > 0 else None
+        used = 0
+        packed: list[NodeWithScore] = []
+        dropped: list[str] = []
+        for _, _, address, path, hop, score, resource, node_data in ranked:
+            text = _resource_to_context_text(path, address, resource, node_data)
+            tokens = _estimate_tokens(text)
+            if budget is not None and used + tokens > budget:
+                if packed:
+                    dropped.append(address)
+                    continue
+                # Always keep the top candidate, truncated to the budget
+                text = text[: (budget - 1) * CHARS_PER_TOKEN]
+                tokens = _estimate_tokens(text)
+            used += tokens
+            node = TextNode(
+                text=text,
+                id_=address,
+                metadata={
+                    "retrieval_source": "vector" if hop == 0 else f"graph_hop_{hop}",
+                    "graph_path": path,
+                    "context_tokens": tokens,
+                },
+            )
+            packed.append(NodeWithScore(node=node, score=score))
+
+        stats = {
+            "token_budget": self._token_budget,
+            "context_tokens": used,
+            "candidate_count": len(ranked),
+            "packed_count": len(packed),
+            "dropped_addresses": dropped,
+        }
+        return packed, stats
+
+
+class NeighbourhoodIndex:
+    """
+    k-hop neighbourhoods over interned path ids.
+
+    Paths are interned to ints and the adjacency is stored once in CSR form (an
+    offsets array and a flat array of neighbour ids): O(paths + edges) memory, a few
+    bytes per edge. Expanding a seed set by h hops is a multi-source BFS that
+    only touches the paths within h hops of the seeds, so a query costs the size
+    of its neighbourhood, not of the graph.
+    """
+
+    def __init__(self, nodes: dict, path_to_neighbors: dict[str, set[str]], max_hops: int = 1):
+        self.max_hops = max_hops
+        self.paths: list[str] = sorted(nodes)
+        self.path_ids: dict[str, int] = {path: i for i, path in enumerate(self.paths)}
+
+        # Neighbours of path i: _targets[_offsets[i]:_offsets[i + 1]]
+        self._offsets = array("l", [0])
+        self._targets = array("l")
+        for path in self.paths:
+            self._targets.extend(sorted(
+                {self.path_ids[n] for n in path_to_neighbors.get(path, ()) if n in self.path_ids}
+            ))
+            self._offsets.append(len(self._targets))
+
+    def ids_to_paths(self, ids: list[int]) -> list[str]:
+        return [self.paths[i] for i in ids]
+
+    def expand(self, seed_scores: dict[str, float], hops: int) -> tuple[list[list[int]], dict[str, tuple[int, float]]]:
+        """
+        Expand seed paths by up to `hops` hops (capped at max_hops).
+
+        Returns (rings, reached): rings[d - 1] is the sorted ids of paths first reached
+        at hop d, and reached maps every non-seed path to (hop distance from the nearest
+        seed, highest score among the seeds at that distance).
+        """
+        hops = min(hops, self.max_hops)
+        # Best seed score carried by each path of the current BFS level
+        frontier = {self.path_ids[p]: score for p, score in seed_scores.items() if p in self.path_ids}
+        covered = set(frontier)
+
+        rings: list[list[int]] = []
+        reached: dict[str, tuple[int, float]] = {}
+        for d in range(1, hops + 1):
+            ring: dict[int, float] = {}
+            for i, score in frontier.items():
+                for j in self._targets[self._offsets[i]:self._offsets[i + 1]]:
+                    if j not in covered and score > ring.get(j, float("-inf")):
+                        ring[j] = score
+            covered.update(ring)
+            rings.append(sorted(ring))
+            for j in rings[-1]:
+                reached[self.paths[j]] = (d, ring[j])
+            frontier = ring
+        return rings, reached
+
+
 class TerraformGraphRetriever(BaseRetriever):
     """
     Hybrid retriever: vector search to find entry points, then graph traversal
@@ -128,6 +521,8 @@ class TerraformGraphRetriever(BaseRetriever):
         address_to_node: dict[str, TextNode],
         path_to_neighbors: dict[str, set[str]],
         graph_hops: int = 1,
+        hop_decay: float = 0.9,
+        token_budget: int = 8000,
         verbose: bool = False,
         **kwargs,
     ):
@@ -137,43 +532,57 @@ class TerraformGraphRetriever(BaseRetriever):
         self._address_to_node = address_to_node
         self._path_to_neighbors = path_to_neighbors
         self._graph_hops = graph_hops
+        self._hop_decay = hop_decay
         self._verbose = verbose
-        self.last_trace: Optional[dict[str, Any]] = None
+        # Built once here (index time) so each query only walks its own neighbourhood
+        self._neighbourhood = NeighbourhoodIndex(nodes, path_to_neighbors, max_hops=graph_hops)
+        self._packer = ContextPacker(nodes, token_budget=token_budget)
 
-    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
-        # 1. Vector search for initial relevant nodes
-        initial = self._vector_retriever.retrieve(query_bundle)
+    @property
+    def last_trace(self) -> Optional[dict[str, Any]]:
+        """Last retrieval trace recorded in the current context."""
+        trace = _current_trace.get()
+        return trace.last if trace is not None else None
 
-        # 2. Collect addresses from initial results
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        with tracing.span("rag.retrieve") as span:
+            # 1. Vector search for initial relevant nodes
+            with RAG_STAGE_SECONDS.time(stage="vector_search"), tracing.span("rag.vector_search"):
+                initial = self._vector_retriever.retrieve(query_bundle)
+            return self._expand_and_pack(query_bundle, initial, span)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        # Same as _retrieve, but the query embedding / vector lookup doesn't block the event loop
+        with tracing.span("rag.retrieve") as span:
+            with RAG_STAGE_SECONDS.time(stage="vector_search"), tracing.span("rag.vector_search"):
+                initial = await self._vector_retriever.aretrieve(query_bundle)
+            return self._expand_and_pack(query_bundle, initial, span)
+
+    def _expand_and_pack(
+        self, query_bundle: QueryBundle, initial: list[NodeWithScore], span=tracing.NOOP_SPAN
+    ) -> list[NodeWithScore]:
+        # 2. Collect addresses from initial results (seed score = best vector score in the path)
         vector_paths: set[str] = set()
-        initial_scores: dict[str, float] = {}
+        seed_scores: dict[str, float] = {}
 
         for nws in initial:
             addr = nws.node.node_id
             path = _path_from_address(addr)
             vector_paths.add(path)
-            initial_scores[addr] = nws.score or 1.0
-
-        collected_paths = set(vector_paths)
-
-        # 3. Graph expansion: add neighbor paths (1 or 2 hops)
-        hop_additions: list[set[str]] = []
-        for hop in range(self._graph_hops):
-            expanded = set(collected_paths)
-            for path in collected_paths:
-                for neigh_path in self._path_to_neighbors.get(path, []):
-                    if neigh_path in self._nodes:
-                        expanded.add(neigh_path)
-            added = expanded - collected_paths
-            hop_additions.append(added)
-            collected_paths = expanded
+            seed_scores[path] = max(seed_scores.get(path, 0.0), nws.score or 1.0)
+
+        # 3. Graph expansion via the precomputed neighbourhood index
+        expand_started = time.perf_counter()
+        rings, reached = self._neighbourhood.expand(seed_scores, self._graph_hops)
+        hop_additions = [set(self._neighbourhood.ids_to_paths(ring)) for ring in rings]
+        collected_paths = vector_paths | set(reached)
 
         # Logging
         if self._verbose:
             logger.info(
-                "[graph-rag] Vector: %s paths, after hop 1: +%s, final: %s paths",
+                "[graph-rag] Vector: %s paths, per hop: %s, final: %s paths",
                 len(vector_paths),
-                len(hop_additions[0]) if hop_additions else 0,
+                [len(added) for added in hop_additions],
                 len(collected_paths),
             )
         logger.debug(
@@ -182,44 +591,31 @@ class TerraformGraphRetriever(BaseRetriever):
             sorted(collected_paths - vector_paths),
         )
 
-        # 4. Build NodeWithScore list: initial (vector) results first, then expanded
+        # 4. Candidates: vector hits (hop 0) then graph-expanded neighbours; score decays per hop
         seen_addresses: set[str] = set()
-        result: list[NodeWithScore] = []
+        candidates: list[tuple[str, str, int, float]] = []
 
-        # Add initial vector results first (preserve order and scores) + metadata
         for nws in initial:
             addr = nws.node.node_id
-            path = _path_from_address(addr)
             if addr not in seen_addresses and addr in self._address_to_node:
                 seen_addresses.add(addr)
-                node = nws.node
-                if not node.metadata:
-                    node.metadata = {}
-                node.metadata["retrieval_source"] = "vector"
-                node.metadata["graph_path"] = path
-                result.append(nws)
-
-        # Add graph-expanded neighbors + metadata
-        for path in collected_paths:
-            node_data = self._nodes.get(path, {})
-            for address in node_data.get("resources", {}):
-                if address in seen_addresses:
-                    continue
-                seen_addresses.add(address)
+                candidates.append((addr, _path_from_address(addr), 0, nws.score or 1.0))
 
-                text_node = self._address_to_node.get(address)
-                if text_node is None:
-                    continue
+        for path, (hop, seed_score) in reached.items():
+            for address in self._nodes.get(path, {}).get("resources", {}):
+                if address not in seen_addresses and address in self._address_to_node:
+                    seen_addresses.add(address)
+                    candidates.append((address, path, hop, seed_score * self._hop_decay ** hop))
 
-                if not text_node.metadata:
-                    text_node.metadata = {}
-                text_node.metadata["retrieval_source"] = "graph_hop_1"
-                text_node.metadata["graph_path"] = path
+        RAG_STAGE_SECONDS.observe(time.perf_counter() - expand_started, stage="graph_expand")
 
-                result.append(NodeWithScore(node=text_node, score=0.9))
+        # 5. Rank, compress and cut to the token budget
+        with RAG_STAGE_SECONDS.time(stage="pack"):
+            result, packing = self._packer.pack(candidates)
+        RAG_RETRIEVED_NODES.observe(len(result))
 
-        # Store trace for debug endpoint
-        self.last_trace = {
+        # Store trace for debug endpoint (in the caller's context, not on this shared retriever)
+        retrieval_trace = {
             "query": query_bundle.query_str,
             "vector_paths": sorted(vector_paths),
             "vector_path_count": len(vector_paths),
@@ -227,28 +623,47 @@ class TerraformGraphRetriever(BaseRetriever):
             "collected_paths": sorted(collected_paths),
             "collected_path_count": len(collected_paths),
             "final_node_count": len(result),
+            "packing": packing,
         }
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_retrieval(retrieval_trace)
+        span.set_attributes({
+            "rag.vector_paths": len(vector_paths),
+            "rag.hop_additions": [len(added) for added in hop_additions],
+            "rag.collected_paths": len(collected_paths),
+            "rag.final_nodes": len(result),
+            "rag.context_tokens": packing.get("context_tokens"),
+        })
 
         return result
 
 
-def build_index():
-    """Build vector index and graph structures from graph3 pipeline output."""
+def _neighbors(node_data: dict) -> set[str]:
+    return set(node_data.get("edges_new", [])) | set(node_data.get("edges_existing", []))
 
-    print("[rag] Building graph3 nodes...")
-    nodes = build_graph3_nodes()
-    print(f"[rag] Graph built — {len(nodes)} resource paths")
+
+def build_index(nodes: Optional[dict] = None):
+    """
+    Build vector index and graph structures from graph3 pipeline output
+    (the shared graph unless nodes are given, e.g. by bench_rag.py).
+    """
+
+    if nodes is None:
+        print("[rag] Building graph3 nodes...")
+        _set_index_status(stage="building graph", progress=0.05)
+        # Shared with the checklist scanner and graph endpoints; read-only here
+        nodes = get_graph().nodes
+        print(f"[rag] Graph built — {len(nodes)} resource paths")
 
     # Build TextNodes and mappings
+    _set_index_status(stage="rendering resources", progress=0.15)
     text_nodes: list[TextNode] = []
     address_to_node: dict[str, TextNode] = {}
     path_to_neighbors: dict[str, set[str]] = {}
 
     for path, node_data in nodes.items():
-        neighbors = set(node_data.get("edges_new", [])) | set(
-            node_data.get("edges_existing", [])
-        )
-        path_to_neighbors[path] = neighbors
+        path_to_neighbors[path] = _neighbors(node_data)
 
         for address, resource in node_data.get("resources", {}).items():
             node_text = _resource_to_text(path, address, resource, node_data)
@@ -256,14 +671,45 @@ def build_index():
             text_nodes.append(text_node)
             address_to_node[address] = text_node
 
+    # Embed in batches so /readyz can report progress through the slow part
     print(f"[rag] Indexing {len(text_nodes)} resources...")
-    vector_index = VectorStoreIndex(text_nodes, embed_model=embed_model)
+    vector_index = VectorStoreIndex([], embed_model=get_embed_model())
+    for start in range(0, len(text_nodes), EMBED_BATCH_SIZE):
+        vector_index.insert_nodes(text_nodes[start:start + EMBED_BATCH_SIZE])
+        done = min(start + EMBED_BATCH_SIZE, len(text_nodes))
+        _set_index_status(
+            stage=f"embedding {done}/{len(text_nodes)} resources",
+            progress=0.2 + 0.75 * done / len(text_nodes),
+        )
     vector_retriever = vector_index.as_retriever(similarity_top_k=5)
 
     print(f"[rag] Index build complete — {len(text_nodes)} resources, graph ready")
     return vector_index, vector_retriever, nodes, address_to_node, path_to_neighbors
 
 
+def load_index(persist_dir: str, nodes: dict):
+    """build_index()'s result from an index persisted with storage_context.persist(), without re-embedding."""
+    _set_index_status(stage="loading persisted index", progress=0.5)
+    storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
+    vector_index = load_index_from_storage(storage_context, embed_model=get_embed_model())
+    address_to_node = dict(vector_index.docstore.docs)
+    path_to_neighbors = {path: _neighbors(node_data) for path, node_data in nodes.items()}
+    print(f"[rag] Loaded persisted index — {len(address_to_node)} resources")
+    return vector_index, vector_index.as_retriever(similarity_top_k=5), nodes, address_to_node, path_to_neighbors
+
+
+TEXT_QA_TEMPLATE = PromptTemplate(
+    f"{SYSTEM_PROMPT}\n\n"
+    "Context information is below.\n"
+    "---------------------\n"
+    "{context_str}\n"
+    "---------------------\n"
+    "Given the context information and not prior knowledge, answer the query.\n"
+    "Query: {query_str}\n"
+    "Answer: "
+)
+
+
 def build_query_engine(
     vector_retriever,
     nodes: dict,
@@ -280,23 +726,15 @@ def build_query_engine(
         nodes=nodes,
         address_to_node=address_to_node,
         path_to_neighbors=path_to_neighbors,
-        graph_hops=1,
+        graph_hops=RAG_GRAPH_HOPS,
+        hop_decay=RAG_HOP_DECAY,
+        token_budget=RAG_CONTEXT_TOKEN_BUDGET,
         verbose=verbose,
     )
 
-    text_qa_template = PromptTemplate(
-        f"{SYSTEM_PROMPT}\n\n"
-        "Context information is below.\n"
-        "---------------------\n"
-        "{context_str}\n"
-        "---------------------\n"
-        "Given the context information and not prior knowledge, answer the query.\n"
-        "Query: {query_str}\n"
-        "Answer: "
-    )
     response_synthesizer = get_response_synthesizer(
-        llm=llm,
-        text_qa_template=text_qa_template,
+        llm=get_llm(),
+        text_qa_template=TEXT_QA_TEMPLATE,
     )
 
     query_engine = RetrieverQueryEngine(
@@ -314,47 +752,240 @@ _query_engine = None
 _graph_retriever: Optional[TerraformGraphRetriever] = None
 _retrieval_handler: Optional[RetrievalCallbackHandler] = None
 _graph_data = None
+_graph_fingerprint = None
+_graph_hash = None  # graph_input_hash() of the inputs the serving index was built from
 
 # Set to True to enable verbose retrieval logging
 RAG_VERBOSE = os.environ.get("RAG_VERBOSE", "").lower() in ("1", "true", "yes")
 
+# Graph expansion depth around vector hits, and per-hop score decay for expanded nodes
+RAG_GRAPH_HOPS = int(os.environ.get("RAG_GRAPH_HOPS", "1"))
+RAG_HOP_DECAY = float(os.environ.get("RAG_HOP_DECAY", "0.9"))
+
+# Estimated-token budget for the resource context sent to the LLM per query (0 = unlimited)
+RAG_CONTEXT_TOKEN_BUDGET = int(os.environ.get("RAG_CONTEXT_TOKEN_BUDGET", "8000"))
+
+# Resources embedded per insert while building the index (granularity of build progress)
+EMBED_BATCH_SIZE = int(os.environ.get("RAG_EMBED_BATCH_SIZE", "32"))
+
+# Index build state, reported by /healthz and /readyz
+_index_status: dict[str, Any] = {
+    "state": "cold",  # "cold" | "building" | "ready" | "rebuilding" | "failed"
+    "stage": None,
+    "progress": 0.0,
+    "started_at": None,
+    "finished_at": None,
+    "error": None,
+}
+_index_status_lock = threading.Lock()
+_build_lock = threading.Lock()  # single-flight: at most one index build at a time
+_index_settled = threading.Event()  # set once a build has finished (ready or failed)
+_warmup_thread: Optional[threading.Thread] = None
+
+
+def _workspace() -> Optional[str]:
+    """The request's workspace when it isn't the default one; its index lives in workspaces.registry."""
+    workspace = workspaces.current_workspace()
+    return None if workspace == workspaces.DEFAULT_WORKSPACE else workspace
+
+
+def _set_index_status(**fields) -> None:
+    workspace = _workspace()
+    if workspace is not None:
+        workspaces.registry.set_index_status(workspace, **fields)
+        return
+    with _index_status_lock:
+        _index_status.update(fields)
+
+
+def get_index_status() -> dict[str, Any]:
+    """Snapshot of the index build state, including whether queries can be served."""
+    workspace = _workspace()
+    if workspace is not None:
+        return workspaces.registry.index_status(workspace)
+    with _index_status_lock:
+        status = dict(_index_status)
+    status["ready"] = _query_engine is not None
+    if status["started_at"] is not None:
+        end = status["finished_at"] or time.time()
+        status["elapsed_seconds"] = round(end - status["started_at"], 3)
+    return status
+
+
+def _install_query_engine() -> None:
+    """Build the index and query engine, then swap them in (old engine keeps serving meanwhile)."""
+    global _vector_index, _query_engine, _graph_retriever, _retrieval_handler, _graph_data, _graph_fingerprint, _graph_hash
+
+    fingerprint, graph_hash = graph_input_version()
+    (
+        vector_index,
+        vector_retriever,
+        nodes,
+        address_to_node,
+        path_to_neighbors,
+    ) = build_index()
+    _set_index_status(stage="building query engine", progress=0.97)
+    query_engine, graph_retriever, retrieval_handler = build_query_engine(
+        vector_retriever,
+        nodes,
+        address_to_node,
+        path_to_neighbors,
+        verbose=RAG_VERBOSE,
+    )
 
-def get_query_engine():
-    """Return a cached query engine, building on first call."""
-    global _vector_index, _query_engine, _graph_retriever, _retrieval_handler, _graph_data
-
-    if _query_engine is None:
-        print("[rag] First call — building index...")
-        (
-            _vector_index,
-            vector_retriever,
-            nodes,
-            address_to_node,
-            path_to_neighbors,
-        ) = build_index()
-        _graph_data = (nodes, address_to_node, path_to_neighbors)
-        _query_engine, _graph_retriever, _retrieval_handler = build_query_engine(
-            vector_retriever,
-            nodes,
-            address_to_node,
-            path_to_neighbors,
-            verbose=RAG_VERBOSE,
+    _vector_index = vector_index
+    _graph_data = (nodes, address_to_node, path_to_neighbors)
+    _graph_retriever = graph_retriever
+    _retrieval_handler = retrieval_handler
+    _graph_fingerprint = fingerprint
+    _query_engine = query_engine
+    # After the engine: a reader that sees the new hash also gets the new engine
+    _graph_hash = graph_hash
+
+
+def _run_index_build() -> None:
+    """Build (or rebuild) the index, recording state transitions and failures. Caller holds _build_lock."""
+    _set_index_status(
+        state="rebuilding" if _query_engine is not None else "building",
+        stage="starting",
+        progress=0.0,
+        started_at=time.time(),
+        finished_at=None,
+        error=None,
+    )
+    started = time.perf_counter()
+    try:
+        _install_query_engine()
+    except Exception as e:
+        RAG_INDEX_BUILD_SECONDS.observe(time.perf_counter() - started, outcome="failed")
+        logger.exception("[rag] Index build failed")
+        _set_index_status(
+            state="ready" if _query_engine is not None else "failed",
+            stage="failed",
+            finished_at=time.time(),
+            error=str(e),
         )
+    else:
+        RAG_INDEX_BUILD_SECONDS.observe(time.perf_counter() - started, outcome="ready")
+        _set_index_status(state="ready", stage="ready", progress=1.0, finished_at=time.time(), error=None)
         print("[rag] Graph RAG query engine ready")
+    finally:
+        _index_settled.set()
+
+
+def _warmup_worker() -> None:
+    # Background (re)builds yield the embedding model to interactive queries
+    with llm_priority("batch"), _build_lock:
+        # A request thread may have built the index while we waited for the lock
+        if _query_engine is None or index_is_stale():
+            _run_index_build()
+        else:
+            _index_settled.set()
+
+
+def index_is_stale() -> bool:
+    """True when the plan/DOT inputs changed since the current index was built."""
+    return _query_engine is not None and _graph_fingerprint != graph_input_fingerprint()
+
+
+def index_graph_hash() -> Optional[str]:
+    """Content hash of the plan/DOT inputs the serving index was built from; None before the first build."""
+    workspace = _workspace()
+    if workspace is not None:
+        return workspaces.registry.index_hash(workspace)
+    return _graph_hash if _query_engine is not None else None
+
+
+def start_index_warmup() -> bool:
+    """
+    Build the index in a background thread if it is cold, failed, or stale (plan changed).
+    Returns True if a build was started; a build already in flight is left alone.
+    """
+    global _warmup_thread
+
+    workspace = _workspace()
+    if workspace is not None:
+        return workspaces.registry.start_index_build(workspace)
+
+    with _index_status_lock:
+        if _warmup_thread is not None and _warmup_thread.is_alive():
+            return False
+        if _query_engine is not None and not index_is_stale():
+            return False
+        if _query_engine is None:
+            _index_settled.clear()
+        _warmup_thread = threading.Thread(target=_warmup_worker, name="rag-index-warmup", daemon=True)
+        _warmup_thread.start()
+
+    print("[rag] Index warmup started in background")
+    return True
+
+
+def wait_for_index(timeout: Optional[float]) -> bool:
+    """Block up to `timeout` seconds for the index to become ready. Returns True if ready."""
+    workspace = _workspace()
+    if workspace is not None:
+        return workspaces.registry.wait_for_index(workspace, timeout)
+    if _query_engine is not None:
+        return True
+    _index_settled.wait(timeout)
+    return _query_engine is not None
+
+
+def get_query_engine():
+    """
+    Return a cached query engine, building on first call.
+    Concurrent first callers (and the warmup thread) share a single build.
+    """
+    workspace = _workspace()
+    if workspace is not None:
+        return workspaces.registry.query_engine(workspace)
+    if _query_engine is None:
+        with _build_lock:
+            if _query_engine is None:
+                print("[rag] First call — building index...")
+                _run_index_build()
+        if _query_engine is None:
+            raise RuntimeError(f"RAG index build failed: {_index_status['error']}")
     else:
         print("[rag] Using cached index")
 
     return _query_engine
 
 
+def stream_query(question: str):
+    """
+    Streaming counterpart of get_query_engine().query(question).
+    Yields ("retrieval", trace) once the context is retrieved, then ("token", text)
+    for each answer token as the LLM produces it.
+    """
+    engine = get_query_engine()
+    with capture_retrieval_trace() as trace:
+        source_nodes = engine.retrieve(QueryBundle(question))
+    yield "retrieval", trace.last
+
+    synthesizer = get_response_synthesizer(llm=get_llm(), text_qa_template=TEXT_QA_TEMPLATE, streaming=True)
+    response = synthesizer.synthesize(question, source_nodes)
+    if getattr(response, "response_gen", None) is None:
+        # Nothing retrieved: the synthesizer answers "Empty Response" without calling the LLM
+        yield "token", str(response)
+        return
+    for token in response.response_gen:
+        yield "token", token
+
+
 def get_graph_retriever() -> Optional[TerraformGraphRetriever]:
     """Return the graph retriever (for debug endpoint). Call get_query_engine() first."""
+    workspace = _workspace()
+    if workspace is not None:
+        return workspaces.registry.graph_retriever(workspace)
     get_query_engine()
     return _graph_retriever
 
 
 def get_evaluators() -> tuple[FaithfulnessEvaluator, RelevancyEvaluator]:
     """Return evaluators for RAG performance validation."""
+    llm = get_llm()
     return FaithfulnessEvaluator(llm=llm), RelevancyEvaluator(llm=llm)
 
 
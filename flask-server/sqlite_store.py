@@ -0,0 +1,41 @@
+"""
+The per-process SQLite connection behind the on-disk stores (llm_cache, jobs).
+
+Gunicorn workers fork from a master that may already have used a store, and a
+SQLite handle must not be shared across processes. SQLiteStore opens its
+connection on first use, and reset_after_fork() (wsgi.py, in every worker)
+forgets the inherited one so the worker opens its own.
+"""
+
+import sqlite3
+import threading
+from typing import Optional
+
+
+class SQLiteStore:
+    """A SQLite file in WAL mode, with SCHEMA applied on connect; callers hold self._lock around each use."""
+
+    SCHEMA: tuple[str, ...] = ()
+    # sqlite3's default ("") opens transactions implicitly; None leaves them to the store
+    ISOLATION_LEVEL: Optional[str] = ""
+
+    def __init__(self, db_path: str):
+        self._db_path = db_path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self._db_path, check_same_thread=False, timeout=30, isolation_level=self.ISOLATION_LEVEL
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    def reset_after_fork(self) -> None:
+        """Forget a connection inherited from the parent process; the next call opens a fresh one."""
+        self._lock = threading.Lock()
+        self._conn = None
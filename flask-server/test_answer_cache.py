@@ -0,0 +1,58 @@
+from answer_cache import AnswerCache, normalize_question
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalized_question_hits_for_same_graph_only():
+    cache = AnswerCache()
+    cache.put("query", "graph-a", "What depends on the S3 bucket?", {"answer": "lambda"})
+
+    assert cache.get("query", "graph-a", "  what depends on the s3   bucket ") == {"answer": "lambda"}
+    assert cache.get("query", "graph-b", "What depends on the S3 bucket?") is None
+    assert cache.get("langgraph", "graph-a", "What depends on the S3 bucket?") is None
+    assert normalize_question("Are there bugs?!") == "are there bugs"
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = AnswerCache(ttl_seconds=10, clock=clock)
+    cache.put("query", "g", "q", "answer")
+
+    clock.now = 9
+    assert cache.contains("query", "g", "q")
+    assert cache.get("query", "g", "q") == "answer"
+    clock.now = 10
+    assert not cache.contains("query", "g", "q")
+    assert cache.get("query", "g", "q") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnswerCache(max_entries=2)
+    cache.put("query", "g", "one", 1)
+    cache.put("query", "g", "two", 2)
+    cache.get("query", "g", "one")  # "two" is now least recently used
+    cache.put("query", "g", "three", 3)
+
+    assert cache.get("query", "g", "two") is None
+    assert cache.get("query", "g", "one") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_semantic_match_for_near_duplicate_phrasing():
+    vectors = {
+        "what depends on the s3 bucket": [1.0, 0.0, 0.1],
+        "which resources depend on the s3 bucket": [0.98, 0.0, 0.15],
+        "are there bugs": [0.0, 1.0, 0.0],
+    }
+    cache = AnswerCache(similarity_threshold=0.95, embed_fn=vectors.__getitem__)
+    cache.put("query", "g", "What depends on the S3 bucket?", "lambda")
+
+    assert cache.get("query", "g", "Which resources depend on the S3 bucket?") == "lambda"
+    assert cache.get("query", "g", "Are there bugs?") is None
+    assert cache.stats()["semantic_hits"] == 1
@@ -0,0 +1,34 @@
+import json
+import re
+
+import bench_graph
+
+
+def test_synthetic_plan_runs_through_every_stage(tmp_path):
+    plan, dot = bench_graph.generate_plan(40, module_depth=2, modules_per_level=2, count_fraction=0.5, seed=1)
+    assert len(plan["resource_changes"]) == 40
+    assert any(rc["index"] is not None for rc in plan["resource_changes"])
+    assert any(rc["module_address"] and ".module." in rc["module_address"] for rc in plan["resource_changes"])
+
+    plan_path, dot_path = tmp_path / "plan.json", tmp_path / "graph.dot"
+    plan_path.write_text(json.dumps(plan))
+    dot_path.write_text(dot)
+
+    results = bench_graph.run_pipeline(str(plan_path), str(dot_path))
+
+    assert set(bench_graph.STAGES) <= set(results)
+    paths = {re.sub(r"\[\d+\]", "", rc["address"]) for rc in plan["resource_changes"]}
+    # count-expanded instances collapse into one node per block; connected blocks survive orphan removal
+    assert 0 < results["_nodes"]["count"] <= len(paths)
+    assert results["_nodes"]["edges"] > 0
+
+
+def test_regressions_respect_tolerance_and_noise_floor():
+    baseline = {"100": {**{s: 0.1 for s in bench_graph.STAGES}, "total": 0.8}}
+    result = {"resources": 100, "seconds": {s: 0.1 for s in bench_graph.STAGES}, "total": 0.8}
+    assert bench_graph.regressions([result], baseline, tolerance=0.5, min_delta=0.01) == []
+
+    result["seconds"]["dot_parse"] = 0.2
+    result["seconds"]["diffs"] = 0.105
+    problems = bench_graph.regressions([result], baseline, tolerance=0.5, min_delta=0.01)
+    assert len(problems) == 1 and "dot_parse" in problems[0]
@@ -0,0 +1,30 @@
+import json
+
+import bench_rag
+import rag
+
+
+def test_hash_embedding_is_deterministic_and_normalised():
+    embedding = bench_rag.HashEmbedding()
+    first = embedding.get_text_embedding("module.lambda-writer.aws_lambda_function.this[0]")
+    assert first == bench_rag.HashEmbedding().get_text_embedding("module.lambda-writer.aws_lambda_function.this[0]")
+    assert abs(sum(v * v for v in first) - 1.0) < 1e-9
+    assert first != embedding.get_text_embedding("aws_s3_bucket.test")
+
+
+def test_benchmark_reports_recall_and_latency_offline(monkeypatch):
+    monkeypatch.setattr(rag, "_embed_model", None)
+    monkeypatch.setattr(rag, "_llm", None)
+    with open(bench_rag.CORPUS_PATH) as f:
+        corpus = json.load(f)
+
+    result = bench_rag.run(corpus, repeat=1, datasets=["larger"])
+
+    rows = result["datasets"]["larger"]["questions"]
+    assert list(result["datasets"]) == ["larger"] and len(rows) == 3
+    for row in rows:
+        assert row["retrieval_ms"] > 0 and row["context_tokens"] > 0 and row["vector_paths"] > 0
+        assert row["recall"] == 1.0 and row["missing"] == []
+        assert len(row["hop_additions"]) == rag.RAG_GRAPH_HOPS
+    assert result["summary"]["recall"] == 1.0
+    assert result["summary"]["vector_recall"] <= result["summary"]["recall"]
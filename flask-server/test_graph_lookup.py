@@ -0,0 +1,149 @@
+import os
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "test-key")
+
+import pytest
+from langchain_core.tools import tool
+
+import LangGraph
+from graph_lookup import GraphLookup, KeywordMatcher
+from graph_provider import GraphSnapshot
+
+
+def _resource(address, after, after_unknown=None):
+    return {"address": address, "change": {"actions": ["create"], "before": None, "after": after,
+                                           "after_unknown": after_unknown or {}}}
+
+
+NODES = {
+    "aws_s3_bucket.data": {
+        "resources": {"aws_s3_bucket.data": _resource("aws_s3_bucket.data", {"bucket": "data-bucket"}, {"arn": True})},
+        "edges_new": ["module.writer.aws_iam_role_policy.inline"],
+        "edges_existing": ["aws_s3_bucket_object.seed"],
+    },
+    "aws_s3_bucket_object.seed": {
+        "resources": {"aws_s3_bucket_object.seed": _resource("aws_s3_bucket_object.seed", {"key": "seed.txt"})},
+        "edges_new": [],
+        "edges_existing": ["aws_s3_bucket.data"],
+    },
+    "module.writer.aws_iam_role.lambda": {
+        "resources": {"module.writer.aws_iam_role.lambda[0]": _resource("module.writer.aws_iam_role.lambda[0]", {"name": "writer"})},
+        "edges_new": [],
+        "edges_existing": [],
+    },
+    "module.reader.aws_iam_role.lambda": {
+        "resources": {"module.reader.aws_iam_role.lambda[0]": _resource("module.reader.aws_iam_role.lambda[0]", {"name": "reader"})},
+        "edges_new": [],
+        "edges_existing": [],
+    },
+    "module.writer.aws_iam_role_policy.inline": {
+        "resources": {},
+        "edges_new": ["aws_s3_bucket.data"],
+        "edges_existing": [],
+    },
+}
+
+
+def test_keyword_matcher_finds_overlapping_patterns_in_one_pass():
+    matcher = KeywordMatcher([("he", 1), ("she", 2), ("his", 3), ("hers", 4)])
+
+    assert sorted((m.start, m.pattern) for m in matcher.finditer("ushers")) == [(1, "she"), (2, "he"), (2, "hers")]
+    assert matcher.labels("This") == {3}
+
+    bounded = KeywordMatcher([("s3 bucket", "b"), ("s3 bucket object", "o"), ("use", "u")], word_boundary=True)
+    assert [m.pattern for m in bounded.longest("the S3 bucket object")] == ["s3 bucket object"]
+    assert bounded.labels("because") == set()
+
+
+@pytest.mark.parametrize("question", [
+    "Are there any bugs in my Terraform plan?",
+    "What resources depend on the S3 bucket?",
+    "What is the S3 bucket name?",
+    "Which Lambda reads the queue?",
+    "Is the event source mapping missing?",
+    "Why is this used because of the chain?",
+])
+def test_router_classification_matches_keyword_lists(question):
+    q = question.lower()
+    if any(p in q for p in LangGraph.ROUTE_PHRASES["analysis"]):
+        expected = "analysis"
+    elif any(p in q for p in LangGraph.ROUTE_PHRASES["complex"]):
+        expected = "complex"
+    else:
+        expected = "simple"
+    assert LangGraph.classify_question(q) == expected
+
+
+def test_lookup_answers_attributes_and_dependencies():
+    lookup = GraphLookup(NODES)
+
+    hit = lookup.answer("What is the S3 bucket name?")
+    assert hit.kind == "attribute"
+    assert hit.answer == '- `aws_s3_bucket.data` bucket = "data-bucket"'
+    assert "(known after apply)" in lookup.answer("What is the S3 bucket ARN?").answer
+    assert lookup.answer("What is the S3 bucket object key?").answer == '- `aws_s3_bucket_object.seed` key = "seed.txt"'
+    # Module + type mentions narrow to one resource; the type alone lists both
+    assert lookup.answer("What is the IAM role name in writer?").paths == ["module.writer.aws_iam_role.lambda"]
+    assert len(lookup.answer("What is the IAM role name?").paths) == 2
+
+    dependency = lookup.answer("What is connected to aws_s3_bucket.data?")
+    assert dependency.kind == "dependency"
+    assert "`module.writer.aws_iam_role_policy.inline` (new edge)" in dependency.answer
+    assert "`aws_s3_bucket_object.seed` (existing edge)" in dependency.answer
+
+
+def test_attribute_matcher_follows_each_resources_keys():
+    nodes = {
+        path: {"resources": {path: _resource(path, after)}, "edges_new": [], "edges_existing": []}
+        for path, after in [("aws_sqs_queue.a", {"name": "a"}), ("aws_sqs_queue.b", {"name": "b", "fifo_queue": True})]
+    }
+    lookup = GraphLookup(nodes)
+
+    assert lookup.answer("What is the name of aws_sqs_queue.a?").answer == '- `aws_sqs_queue.a` name = "a"'
+    # Same type, but an attribute the first queue doesn't have
+    assert lookup.answer("What is the fifo queue of aws_sqs_queue.b?").answer == "- `aws_sqs_queue.b` fifo_queue = true"
+
+
+@pytest.mark.parametrize("question", [
+    "How many resources are in the plan?",  # no resource named
+    "What uses the IAM role?",  # dependency question about two resources
+    "What is the S3 bucket versioning?",  # attribute not in the plan
+    "What encryption does the S3 bucket use?",  # "use" is not a dependency question
+    "Should the S3 bucket name be changed?",  # asks for a judgement, not the value
+    "What is the S3 bucket name and is it secure?",  # a second clause the lookup can't answer
+    "Why does aws_s3_bucket.data depend on the policy?",
+    # The edges are undirected, so one direction can't be told from the other
+    "What depends on aws_s3_bucket.data?",
+    "What are the dependents of the S3 bucket?",
+    "What is aws_s3_bucket.data used by?",
+])
+def test_lookup_falls_back_when_ambiguous(question):
+    assert GraphLookup(NODES).answer(question) is None
+
+
+def test_router_answers_lookups_without_rag_or_llm(monkeypatch):
+    import answer_cache
+    import app as app_module
+
+    @tool
+    def no_rag(question: str) -> str:
+        """Fails the test if RAG is called."""
+        raise AssertionError("RAG should not run for a graph lookup")
+
+    snapshot = GraphSnapshot(fingerprint=("fake",), nodes=NODES, types_present=frozenset(),
+                             type_pairs=(), build_seconds=0.0)
+    monkeypatch.setattr(LangGraph, "get_graph", lambda: snapshot)
+    monkeypatch.setattr(LangGraph, "terraform_rag_query", no_rag)
+    monkeypatch.setattr(answer_cache, "answer_cache", answer_cache.AnswerCache())
+    monkeypatch.setattr(app_module, "answer_cache", answer_cache.answer_cache)
+    monkeypatch.setattr(app_module, "require_rag_index", lambda: (_ for _ in ()).throw(AssertionError("index gate")))
+
+    response = app_module.app.test_client().post("/api/query/langgraph", json={"question": "What is the S3 bucket name?"})
+
+    out = response.get_json()
+    assert response.status_code == 200
+    assert out["route"] == "lookup"
+    assert out["final_answer"] == '- `aws_s3_bucket.data` bucket = "data-bucket"'
+    assert out["trace"][:2] == ["[router] Classified as 'lookup'", "[lookup] Answered attribute question from the graph (1 resources)"]
+    # Mock mode keeps the Express-compatible route
+    assert LangGraph.query_with_langgraph("What is the S3 bucket name?", mock=True)["route"] == "simple"
@@ -0,0 +1,92 @@
+import functools
+import json
+import os
+import threading
+import tracemalloc
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "test-key")
+
+import app as app_module
+import bench_graph
+import graph_profile
+from graph_profile import PipelineProfiler
+
+
+def _write_plan(tmp_path, resources=30):
+    plan, dot = bench_graph.generate_plan(resources, module_depth=1, modules_per_level=2, seed=3)
+    plan_path, dot_path = tmp_path / "plan.json", tmp_path / "graph.dot"
+    plan_path.write_text(json.dumps(plan))
+    dot_path.write_text(dot)
+    return str(plan_path), str(dot_path)
+
+
+def test_profiler_records_every_stage_with_counts_and_memory(tmp_path):
+    plan_path, dot_path = _write_plan(tmp_path)
+
+    with PipelineProfiler("test-profile", trace_memory=True) as profile:
+        nodes = app_module.build_graph3_nodes(plan_path=plan_path, dot_path=dot_path, stage=profile)
+
+    assert [r.stage for r in profile.stages] == bench_graph.STAGES
+    assert all(r.wall_seconds > 0 and r.cpu_seconds >= 0 and r.peak_bytes is not None for r in profile.stages)
+    by_stage = {r.stage: r for r in profile.stages}
+    assert by_stage["dot_parse"].nodes_in is None and by_stage["dot_parse"].edges_out > 0
+    # Each stage's input is the previous stage's output; the last one is the graph returned
+    assert by_stage["diffs"].nodes_in == by_stage["new_edges"].nodes_out
+    assert by_stage["role_links"].nodes_out == len(nodes)
+    assert by_stage["role_links"].edges_out == sum(len(n["edges_new"]) + len(n["edges_existing"]) for n in nodes.values())
+
+    aggregated = graph_profile.metrics()["test-profile"]
+    assert set(aggregated) == set(bench_graph.STAGES)
+    assert aggregated["diffs"]["count"] >= 1 and aggregated["diffs"]["last"]["nodes_out"] == by_stage["diffs"].nodes_out
+
+
+def test_graph3_profile_flag_returns_stage_timings(tmp_path, monkeypatch):
+    plan_path, dot_path = _write_plan(tmp_path)
+    monkeypatch.setattr(app_module, "build_graph3_nodes",
+                        functools.partial(app_module.build_graph3_nodes, plan_path=plan_path, dot_path=dot_path))
+    client = app_module.app.test_client()
+
+    out = client.get("/api/graph3?profile=1").get_json()
+
+    assert set(out) == {"nodes", "profile"}
+    assert out["profile"]["pipeline"] == "graph3" and not out["profile"]["memory_traced"]
+    assert [s["stage"] for s in out["profile"]["stages"]] == bench_graph.STAGES
+    assert out["profile"]["stages"][-1]["nodes_out"] == len(out["nodes"])
+
+    metrics = client.get("/api/graph/metrics").get_json()
+    assert metrics["stages"]["graph3"]["role_links"]["count"] >= 1
+
+
+def test_concurrent_memory_profiles_take_turns(tmp_path):
+    plan_path, dot_path = _write_plan(tmp_path)
+    profiles = [PipelineProfiler("test-concurrent", trace_memory=True) for _ in range(3)]
+    errors = []
+
+    def build(profile):
+        try:
+            with profile:
+                app_module.build_graph3_nodes(plan_path=plan_path, dot_path=dot_path, stage=profile)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=build, args=(p,)) for p in profiles]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors and not tracemalloc.is_tracing()
+    for profile in profiles:
+        assert [r.stage for r in profile.stages] == bench_graph.STAGES
+        assert all(r.peak_bytes is not None and r.peak_bytes >= 0 for r in profile.stages)
+
+
+def test_profile_flags_are_off_outside_a_request():
+    assert not app_module.profile_requested() and not app_module.profile_memory_requested()
+
+
+def test_graph2_profile_flag_returns_stage_timings():
+    out = app_module.app.test_client().get("/api/graph2?profile=1").get_json()
+
+    assert "error" not in out, out.get("trace")
+    assert out["profile"]["pipeline"] == "graph2" and out["profile"]["stages"][0]["stage"] == "dot_parse"
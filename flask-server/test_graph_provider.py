@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+import app
+import graph_provider
+
+FAKE_NODES = {
+    "aws_lambda_function.worker": {"edges_new": ["aws_sqs_queue.jobs"], "edges_existing": ["aws_s3_bucket.data"]},
+    "aws_sqs_queue.jobs": {"edges_new": [], "edges_existing": ["aws_lambda_function.worker"]},
+    "aws_s3_bucket.data": {"edges_new": ["external.thing"], "edges_existing": []},
+}
+
+
+@pytest.fixture
+def fake_inputs(monkeypatch):
+    """Fake graph inputs: a build counter and a fingerprint the test can bump."""
+    state = {"builds": 0, "fingerprint": (("plan", 1, 1),)}
+
+    def fake_build(stage=None):
+        state["builds"] += 1
+        time.sleep(0.1)  # wide window for racing threads to pile up
+        return {path: dict(node) for path, node in FAKE_NODES.items()}
+
+    monkeypatch.setattr(app, "build_graph3_nodes", fake_build)
+    monkeypatch.setattr(app, "graph_input_fingerprint", lambda: state["fingerprint"])
+    monkeypatch.setattr(graph_provider, "_snapshot", None)
+    return state
+
+
+def test_concurrent_callers_share_one_build(fake_inputs):
+    snapshots = []
+
+    def worker():
+        snapshots.append(graph_provider.get_graph())
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert fake_inputs["builds"] == 1
+    assert all(s is snapshots[0] for s in snapshots)
+    snapshot = snapshots[0]
+    assert snapshot.types_present == {"aws_lambda_function", "aws_sqs_queue", "aws_s3_bucket"}
+    # Edges to paths outside the graph are ignored
+    assert snapshot.type_pairs == (
+        ("aws_lambda_function", "aws_sqs_queue"),
+        ("aws_lambda_function", "aws_s3_bucket"),
+        ("aws_sqs_queue", "aws_lambda_function"),
+    )
+
+
+def test_rebuilds_when_inputs_change(fake_inputs):
+    first = graph_provider.get_graph()
+    assert graph_provider.get_graph() is first
+
+    fake_inputs["fingerprint"] = (("plan", 2, 1),)
+    second = graph_provider.get_graph()
+
+    assert second is not first
+    assert fake_inputs["builds"] == 2
+
+
+def test_mutable_nodes_do_not_touch_shared_graph(fake_inputs):
+    snapshot = graph_provider.get_graph()
+    nodes = snapshot.mutable_nodes()
+    nodes["aws_sqs_queue.jobs"]["enrichment"] = {"summary": "x"}
+    nodes["aws_sqs_queue.jobs"]["edges_existing"].append("aws_s3_bucket.data")
+
+    assert "enrichment" not in snapshot.nodes["aws_sqs_queue.jobs"]
+    assert snapshot.nodes["aws_sqs_queue.jobs"]["edges_existing"] == ["aws_lambda_function.worker"]
+
+
+def test_checklist_questions_come_from_precomputed_pairs(fake_inputs):
+    import LangGraph
+
+    questions = LangGraph._get_connection_check_questions()
+
+    assert questions[:2] == LangGraph.CONNECTION_CHECKS[("aws_lambda_function", "aws_sqs_queue")][:2]
+    assert len(questions) == len(set(questions))
+    assert fake_inputs["builds"] == 1
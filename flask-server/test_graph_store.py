@@ -0,0 +1,72 @@
+import pytest
+
+import app
+import graph_provider
+import graph_store
+
+NODES = {
+    "aws_lambda_function.worker": {
+        "resources": {"aws_lambda_function.worker": {"type": "aws_lambda_function", "values": {"name": "wörker"}}},
+        "edges_new": ["aws_sqs_queue.jobs", "aws_s3_bucket.data"],
+        "edges_existing": ["aws_s3_bucket.data"],
+    },
+    "aws_sqs_queue.jobs": {"resources": {}, "edges_new": [], "edges_existing": ["aws_lambda_function.worker"]},
+    "aws_s3_bucket.data": {"resources": {}, "edges_new": ["external.thing"]},
+}
+
+
+def test_view_round_trips_nodes_with_zero_copy_adjacency(tmp_path):
+    path = str(tmp_path / "graph.bin")
+    graph_store.write_graph(path, NODES, {"fingerprint": "x"})
+
+    view = graph_store.GraphView(path)
+
+    assert list(view) == list(NODES) and len(view) == 3 and view.meta == {"fingerprint": "x"}
+    assert view.to_dict() == NODES
+    assert "external.thing" not in view and "aws_sqs_queue.jobs" in view
+    assert view.neighbors("aws_s3_bucket.data") == ["external.thing"]
+    ids = view.neighbor_ids("aws_lambda_function.worker")
+    assert isinstance(ids, memoryview) and ids.obj is not None and list(ids) == [1, 2]
+    node = view["aws_lambda_function.worker"]
+    node["edges_new"].append("mutated")
+    assert view["aws_lambda_function.worker"] == NODES["aws_lambda_function.worker"]
+    with pytest.raises(KeyError):
+        view["external.thing"]
+
+
+def test_publish_swaps_versions_and_old_readers_keep_working(tmp_path):
+    store = graph_store.GraphStore(str(tmp_path), keep=1)
+    first = store.publish(NODES, {"fingerprint": "a"})
+    second = store.publish({"aws_s3_bucket.data": NODES["aws_s3_bucket.data"]}, {"fingerprint": "b"})
+
+    assert (first.version, second.version) == (1, 2)
+    assert graph_store.GraphStore(str(tmp_path)).current().meta == {"fingerprint": "b"}
+    assert sorted(p.name for p in tmp_path.glob("graph-*.bin")) == ["graph-00000002.bin"]
+    # The pruned version is still mapped by whoever attached to it
+    assert first["aws_sqs_queue.jobs"] == NODES["aws_sqs_queue.jobs"]
+
+
+def test_workers_attach_to_the_published_graph_instead_of_building(tmp_path, monkeypatch):
+    builds = []
+    monkeypatch.setattr(graph_store, "GRAPH_STORE_ENABLED", True)
+    monkeypatch.setattr(graph_store, "_stores", {"default": graph_store.GraphStore(str(tmp_path))})
+    monkeypatch.setattr(app, "build_graph3_nodes", lambda stage=None: builds.append(1) or dict(NODES))
+    fingerprint = [(("plan", 1, 1),)]
+    monkeypatch.setattr(app, "graph_input_fingerprint", lambda: fingerprint[0])
+    monkeypatch.setattr(graph_provider, "_snapshot", None)
+
+    built = graph_provider.get_graph()
+    graph_provider.invalidate()  # as if a second worker process
+    graph_store._stores["default"] = graph_store.GraphStore(str(tmp_path))
+    attached = graph_provider.get_graph()
+
+    assert len(builds) == 1
+    assert isinstance(attached.nodes, graph_store.GraphView) and attached.nodes.to_dict() == NODES
+    assert attached.type_pairs == built.type_pairs == (("aws_lambda_function", "aws_sqs_queue"),
+                                                       ("aws_lambda_function", "aws_s3_bucket"),
+                                                       ("aws_sqs_queue", "aws_lambda_function"))
+    assert attached.mutable_nodes() == NODES
+
+    fingerprint[0] = (("plan", 2, 1),)
+    assert graph_provider.get_graph().nodes.version == 2 and len(builds) == 2
+    assert graph_provider.stats()["store_version"] == 2
@@ -0,0 +1,156 @@
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import app as app_module
+from app import app
+import jobs
+from jobs import JobManager, JobStore
+
+
+def _parse_sse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def _wait_done(client, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(f"/api/graph4/jobs/{job_id}").get_json()
+        if status["status"] in ("done", "failed"):
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+@pytest.fixture
+def graph_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, "GRAPH_DB_PATH", str(tmp_path / "graph.db"))
+    monkeypatch.setattr(app_module, "_db_engine", None)
+    monkeypatch.setattr(app_module, "graph_input_hash", lambda: "a" * 64)
+
+
+def test_mock_job_matches_sync_route_and_streams_progress():
+    client = app.test_client()
+    expected = client.get("/api/graph4?mock=true").get_json()
+
+    response = client.post("/api/graph4/jobs", json={"mock": True})
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+    assert response.headers["Location"] == f"/api/graph4/jobs/{job_id}"
+
+    status = _wait_done(client, job_id)
+    assert status["status"] == "done"
+    assert status["result"] == expected
+    assert set(status["partial"]) <= set(expected)
+
+    # A late subscriber gets the whole log replayed
+    events = _parse_sse(client.get(f"/api/graph4/jobs/{job_id}/events").get_data(as_text=True))
+    stages = [data["stage"] for event, data in events if event == "stage"]
+    assert stages == ["graph", "analysis", "enrichment"]
+    assert any(event == "partial" for event, _ in events)
+    assert events[-1] == ("result", expected)
+
+
+def test_stored_enrichment_is_served_instantly(graph_db):
+    stored = {"aws_s3_bucket.data": {"enrichment": {"summary": "stored"}}}
+    app_module.save_enrichment("a" * 64, stored)
+    client = app.test_client()
+
+    response = client.post("/api/graph4/jobs", json={})
+    assert response.status_code == 200
+    assert client.get(response.headers["Location"]).get_json()["result"] == stored
+
+    sync = client.get("/api/graph4")
+    assert sync.headers["X-Enrichment-Store"] == "hit"
+    assert sync.get_json() == stored
+
+
+def test_analysis_from_a_stale_index_is_not_stored(graph_db, monkeypatch):
+    class Snapshot:
+        fingerprint = "fp"
+
+    monkeypatch.setattr(app_module.graph_provider, "get_graph", lambda: Snapshot())
+    monkeypatch.setattr(app_module, "build_graph4_nodes", lambda report=None, snapshot=None: {"x": {}})
+    monkeypatch.setattr(app_module, "graph_input_version", lambda: ("fp", "a" * 64))
+
+    monkeypatch.setattr(app_module, "serving_graph_hash", lambda: "b" * 64)  # old plan's index
+    assert app_module.build_and_store_graph4_nodes("a" * 64) == {"x": {}}
+    assert app_module.load_enrichment("a" * 64) is None
+
+    monkeypatch.setattr(app_module, "serving_graph_hash", lambda: "a" * 64)
+    app_module.build_and_store_graph4_nodes("a" * 64)
+    assert app_module.load_enrichment("a" * 64) == {"x": {}}
+
+
+def test_unknown_job_is_404():
+    assert app.test_client().get("/api/graph4/jobs/nope").status_code == 404
+
+
+def test_same_key_shares_the_active_job():
+    manager = JobManager("test", max_workers=2)
+    release = threading.Event()
+
+    def work(job):
+        job.emit("partial", {"a": 1})
+        release.wait(5)
+        return "done"
+
+    first = manager.submit("k", work)
+    second = manager.submit("k", work)
+    other = manager.submit("other", lambda job: "other")
+    release.set()
+
+    assert first is second and other is not first
+    assert list(first.events(heartbeat=0.01))[-1] == ("result", "done")
+    assert first.to_dict()["partial"] == {"a": 1}
+    # Once finished, the key can run again
+    assert manager.submit("k", lambda job: "again") is not first
+
+
+def test_workers_sharing_a_store_see_each_others_jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_POLL_SECONDS", 0.01)
+    # Two gunicorn workers: separate managers (and connections) over one file
+    worker_a = JobManager("test", store=JobStore(str(tmp_path / "jobs.db")))
+    worker_b = JobManager("test", store=JobStore(str(tmp_path / "jobs.db")))
+    release = threading.Event()
+
+    def work(job):
+        job.emit("partial", {"a": 1})
+        release.wait(5)
+        return "done"
+
+    first = worker_a.submit("k", work)
+    elsewhere = worker_b.submit("k", lambda job: pytest.fail("key already running in worker a"))
+    assert elsewhere.id == first.id
+    assert worker_b.get(first.id).to_dict()["status"] in ("queued", "running")
+    release.set()
+
+    assert list(worker_b.get(first.id).events(heartbeat=0.01))[-1] == ("result", "done")
+    assert worker_b.get(first.id).to_dict() == first.to_dict()
+    assert worker_b.stats()["done"] == 1 and worker_b.get("nope") is None
+
+
+def test_job_of_an_exited_worker_is_failed_and_rerun(tmp_path, monkeypatch):
+    exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                            capture_output=True, text=True, check=True)
+    store = JobStore(str(tmp_path / "jobs.db"))
+    with monkeypatch.context() as m:
+        m.setattr(jobs, "_owner", lambda: f"{socket.gethostname()}:{exited.stdout.strip()}")
+        orphan = jobs.Job("k")
+        store.claim("test", orphan)
+
+    assert store.load(orphan.id)["status"] == "failed"
+    manager = JobManager("test", store=store)
+    assert list(manager.get(orphan.id).events())[-1] == ("error", {"error": "worker process exited"})
+    rerun = manager.submit("k", lambda job: "again")
+    assert rerun.id != orphan.id
+    assert list(rerun.events(heartbeat=0.01))[-1] == ("result", "again")
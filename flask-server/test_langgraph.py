@@ -0,0 +1,294 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "test-key")
+
+import httpx
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.tools import tool
+
+import LangGraph
+import rag
+from asgi import app as asgi_app
+
+
+@pytest.mark.parametrize("question", [
+    "Are there any bugs in my Terraform plan?",
+    "What resources depend on the S3 bucket?",
+    "What is the S3 bucket name?",
+])
+def test_async_mock_run_matches_sync(question):
+    expected = LangGraph.query_with_langgraph(question, mock=True)
+    assert asyncio.run(LangGraph.aquery_with_langgraph(question, mock=True)) == expected
+
+
+def test_async_sub_questions_share_the_llm_scheduler(monkeypatch):
+    import llm_scheduler
+
+    in_flight = {"now": 0, "peak": 0}
+    scheduler = llm_scheduler.LLMScheduler("test-async", max_concurrency=2)
+
+    async def complete(question):
+        in_flight["now"] += 1
+        in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+        await asyncio.sleep(0.05)
+        in_flight["now"] -= 1
+        return f"answer to {question}"
+
+    class SlowEngine:
+        async def aquery(self, question):
+            # The engine's LLM client takes its slot like rag.ScheduledAnthropic does
+            return await scheduler.acall(complete, question)
+
+    monkeypatch.setattr(rag, "get_query_engine", lambda: SlowEngine())
+
+    sub_questions = [f"q{i}?" for i in range(6)]
+
+    async def two_requests():
+        # Two concurrent analyses on one loop draw from the same scheduler
+        return await asyncio.gather(*(
+            LangGraph._aretrieve_sub_answers(sub_questions, "multi_rag_retrieve") for _ in range(2)
+        ))
+
+    results = asyncio.run(two_requests())
+
+    assert in_flight["peak"] == 2
+    for result in results:
+        assert [a["question"] for a in result] == sub_questions
+        assert result[3]["answer"] == "answer to q3?"
+
+
+def _asgi_request(method, url, **kwargs):
+    async def send():
+        transport = httpx.ASGITransport(app=asgi_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            return await client.request(method, url, **kwargs)
+    return asyncio.run(send())
+
+
+def test_asgi_langgraph_route_runs_async_workflow():
+    question = "Are there any bugs in my Terraform plan?"
+    response = _asgi_request("POST", "/api/query/langgraph", json={"question": question, "mock": True})
+
+    assert response.status_code == 200
+    assert response.json() == LangGraph.query_with_langgraph(question, mock=True)
+
+    missing = _asgi_request("POST", "/api/query/langgraph", json={"mock": True})
+    assert missing.status_code == 400
+
+
+def test_asgi_falls_back_to_flask_routes():
+    response = _asgi_request("GET", "/healthz")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ok"
+
+
+def _parse_sse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_langgraph_stream_route_emits_steps_then_result():
+    from app import app
+
+    question = "Are there any bugs in my Terraform plan?"
+    response = app.test_client().post("/api/query/langgraph/stream", json={"question": question, "mock": True})
+
+    assert response.mimetype == "text/event-stream"
+    events = _parse_sse(response.get_data(as_text=True))
+    steps = [data["node"] for event, data in events if event == "step"]
+    assert steps == ["router", "decompose", "multi_rag_retrieve", "synthesize", "format_final"]
+    assert events[-1] == ("result", LangGraph.query_with_langgraph(question, mock=True))
+
+
+def test_stream_forwards_only_final_answer_tokens(monkeypatch):
+    import answer_cache
+
+    @tool
+    def fake_rag(question: str) -> str:
+        """Canned RAG answer."""
+        return f"answer to {question}"
+
+    monkeypatch.setattr(LangGraph, "llm", FakeListChatModel(responses=['["q1?", "q2?"]', "All good."]))
+    monkeypatch.setattr(LangGraph, "terraform_rag_query", fake_rag)
+    monkeypatch.setattr(LangGraph, "_get_connection_check_questions", lambda: [])
+    monkeypatch.setattr(answer_cache, "answer_cache", answer_cache.AnswerCache())
+
+    events = list(LangGraph.stream_langgraph("Are there any bugs?"))
+
+    tokens = [data for event, data in events if event == "token"]
+    assert {t["node"] for t in tokens} == {"synthesize"}  # decomposition JSON isn't streamed
+    assert "".join(t["text"] for t in tokens) == "All good."
+    assert events[-1][0] == "result" and events[-1][1]["final_answer"] == "All good."
+
+
+def test_stream_reports_decompose_before_its_sub_questions_are_retrieved(monkeypatch):
+    import answer_cache
+
+    @tool
+    def fake_rag(question: str) -> str:
+        """Canned RAG answer."""
+        time.sleep(0.05)
+        return f"answer to {question}"
+
+    monkeypatch.setattr(LangGraph, "llm", FakeListChatModel(responses=['["q1?", "q2?"]', "All good."]))
+    monkeypatch.setattr(LangGraph, "terraform_rag_query", fake_rag)
+    monkeypatch.setattr(LangGraph, "_get_connection_check_questions", lambda: ["Does the Lambda have IAM permissions?"])
+    monkeypatch.setattr(answer_cache, "answer_cache", answer_cache.AnswerCache())
+
+    events = list(LangGraph.stream_langgraph("Are there any bugs?"))
+    order = [data["node"] if event == "step" else data["sub_answer"]["question"]
+             for event, data in events if event in ("step", "sub_answer")]
+
+    decompose = order.index("decompose")
+    assert decompose < order.index("q1?") and decompose < order.index("q2?")
+    assert decompose < order.index("multi_rag_retrieve")
+    assert {"node": "decompose", "trace": ["[decompose] Generated 2 sub-questions"]} in [
+        data for event, data in events if event == "step"]
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_checklist_questions_retrieve_while_decompose_runs(monkeypatch, use_async):
+    import answer_cache
+
+    events = []
+    prompts = []
+
+    class SlowDecomposition(FakeListChatModel):
+        def _call(self, messages, *args, **kwargs):
+            prompts.append(messages[-1].content)
+            if "decompose it into" in messages[-1].content:
+                time.sleep(0.3)
+                events.append("decompose done")
+            return super()._call(messages, *args, **kwargs)
+
+    async def fake_arag(question):
+        events.append(f"rag {question}")
+        return f"answer to {question}"
+
+    @tool
+    def fake_rag(question: str) -> str:
+        """Canned RAG answer."""
+        events.append(f"rag {question}")
+        return f"answer to {question}"
+
+    checklist = ["Does the Lambda have IAM permissions?", "Q1?"]
+    llm = SlowDecomposition(responses=['["q1?", "q2?"]', "All good."])
+    monkeypatch.setattr(LangGraph, "llm", llm)
+    monkeypatch.setattr(LangGraph, "_final_answer_llm", lambda: llm)
+    monkeypatch.setattr(LangGraph, "terraform_rag_query", fake_rag)
+    monkeypatch.setattr(LangGraph, "aterraform_rag_query", fake_arag)
+    monkeypatch.setattr(LangGraph, "_get_connection_check_questions", lambda: list(checklist))
+    monkeypatch.setattr(answer_cache, "answer_cache", answer_cache.AnswerCache())
+
+    question = "Are there any bugs?"
+    out = (asyncio.run(LangGraph.aquery_with_langgraph(question)) if use_async
+           else LangGraph.query_with_langgraph(question))
+
+    # Checklist retrieval started before the LLM decomposition finished
+    assert events.index("rag Does the Lambda have IAM permissions?") < events.index("decompose done")
+    # Deduplicated before retrieval: "q1?" was already asked by the checklist
+    assert sorted(e for e in events if e.startswith("rag")) == ["rag Does the Lambda have IAM permissions?", "rag Q1?", "rag q2?"]
+    # LLM sub-questions first, then checklist questions they don't already cover
+    assert [a["question"] for a in out["sub_answers"]] == ["Q1?", "q2?", "Does the Lambda have IAM permissions?"]
+    assert out["sub_questions"] == [a["question"] for a in out["sub_answers"]]
+    assert any(line == "[checklist] Added 1 connection-checklist questions" for line in out["trace"])
+    # No extra LLM hop: decomposition, then synthesis over the raw checklist answers
+    assert len(prompts) == 2 and "answer to Does the Lambda have IAM permissions?" in prompts[1]
+
+
+def test_shards_follow_connected_components():
+    nodes = {
+        "aws_lambda_function.a": {"edges_new": ["aws_sqs_queue.a"], "edges_existing": []},
+        "aws_sqs_queue.a": {"edges_new": [], "edges_existing": []},
+        "aws_s3_bucket.b": {"edges_new": [], "edges_existing": ["aws_iam_role.b"]},
+        "aws_iam_role.b": {"edges_new": [], "edges_existing": []},
+        "aws_vpc.c": {"edges_new": [], "edges_existing": []},
+    }
+    paths = ["aws_lambda_function.a", "aws_s3_bucket.b", "aws_sqs_queue.a", "aws_iam_role.b", "aws_vpc.c"]
+
+    assert LangGraph.shard_resource_paths(paths, nodes, shard_size=2) == [
+        ["aws_lambda_function.a", "aws_sqs_queue.a"],
+        ["aws_s3_bucket.b", "aws_iam_role.b"],
+        ["aws_vpc.c"],
+    ]
+    # Without a graph, paths are grouped by module
+    assert LangGraph.shard_resource_paths(
+        ["module.x.aws_s3_bucket.a", "aws_vpc.c", "module.x.aws_iam_role.b"], shard_size=2,
+    ) == [["module.x.aws_s3_bucket.a", "module.x.aws_iam_role.b"], ["aws_vpc.c"]]
+
+
+def test_enrichment_retries_only_failed_shards(monkeypatch):
+    prompts = []
+    lock = threading.Lock()
+
+    class ShardChatModel(FakeListChatModel):
+        def _call(self, messages, *args, **kwargs):
+            paths = json.loads(re.search(r"resource paths from the Terraform plan:\n(\[.*\])", messages[-1].content).group(1))
+            with lock:
+                prompts.append(paths)
+            if "aws_s3_bucket.b" in paths and len(paths) > 1:
+                return '{"aws_s3_bucket.b": {"summary": "trunc'  # truncated output
+            return json.dumps({p: {"summary": f"about {p}", "issues": [], "recommendations": []} for p in paths})
+
+    monkeypatch.setattr(LangGraph, "llm", ShardChatModel(responses=[""]))
+    paths = ["aws_lambda_function.a", "aws_s3_bucket.b", "aws_iam_role.b", "aws_vpc.c"]
+    nodes = {"aws_s3_bucket.b": {"edges_existing": ["aws_iam_role.b"]}}
+    monkeypatch.setattr(LangGraph, "ENRICH_SHARD_SIZE", 2)
+
+    analysis = "\n".join(f"- {p} needs review" for p in paths)
+    result = LangGraph.parse_analysis_to_resources(analysis, [], paths, nodes=nodes)
+
+    assert list(result) == paths
+    assert result["aws_s3_bucket.b"]["summary"] == "about aws_s3_bucket.b"
+    # The failed shard was split and retried; the others ran once
+    assert sorted(map(tuple, prompts)) == sorted([
+        ("aws_lambda_function.a",),
+        ("aws_s3_bucket.b", "aws_iam_role.b"),
+        ("aws_vpc.c",),
+        ("aws_s3_bucket.b",),
+        ("aws_iam_role.b",),
+    ])
+
+
+def test_enrichment_prompts_carry_only_their_shards_context(monkeypatch):
+    prompts = {}
+
+    class ShardChatModel(FakeListChatModel):
+        def _call(self, messages, *args, **kwargs):
+            prompt = messages[-1].content
+            paths = json.loads(re.search(r"resource paths from the Terraform plan:\n(\[.*\])", prompt).group(1))
+            prompts[tuple(paths)] = prompt
+            return json.dumps({p: {"summary": f"about {p}"} for p in paths})
+
+    monkeypatch.setattr(LangGraph, "llm", ShardChatModel(responses=[""]))
+    monkeypatch.setattr(LangGraph, "ENRICH_SHARD_SIZE", 1)
+    analysis = "\n".join([
+        "## Messaging",
+        "The Lambda function has no event source mapping for aws_sqs_queue.jobs.",
+        "## Storage",
+        "The S3 bucket aws_s3_bucket.logs has no versioning.",
+    ])
+    sub_answers = [
+        {"question": "Is the SQS queue encrypted?", "answer": "No, aws_sqs_queue.jobs uses no KMS key."},
+        {"question": "Is the bucket public?", "answer": "aws_s3_bucket.logs blocks public access."},
+    ]
+    paths = ["aws_sqs_queue.jobs", "aws_s3_bucket.logs", "aws_route53_zone.main"]
+
+    result = LangGraph.parse_analysis_to_resources(analysis, sub_answers, paths)
+
+    queue, bucket = prompts[("aws_sqs_queue.jobs",)], prompts[("aws_s3_bucket.logs",)]
+    assert "## Messaging" in queue and "no KMS key" in queue
+    assert "versioning" not in queue and "public access" not in queue
+    assert "versioning" in bucket and "event source mapping" not in bucket
+    # Nothing mentions the zone: no LLM call for it
+    assert set(prompts) == {("aws_sqs_queue.jobs",), ("aws_s3_bucket.logs",)}
+    assert list(result) == ["aws_sqs_queue.jobs", "aws_s3_bucket.logs"]
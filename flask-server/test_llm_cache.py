@@ -0,0 +1,47 @@
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+
+from llm_cache import LangChainLLMCache, LLMResponseCache, make_cache_key
+
+
+def test_store_round_trip_and_lru_eviction(tmp_path):
+    store = LLMResponseCache(str(tmp_path / "cache.db"), max_entries=2)
+    store.put("a", "answer a")
+    store.put("b", "answer b")
+    assert store.get("a") == "answer a"  # "b" is now least recently used
+    store.put("c", "answer c")
+
+    assert store.get("b") is None
+    assert store.get("a") == "answer a"
+    assert store.get("c") == "answer c"
+    assert store.stats()["entries"] == 2
+
+
+def test_entries_expire_after_ttl(tmp_path):
+    store = LLMResponseCache(str(tmp_path / "cache.db"), ttl_seconds=0)
+    store.put("a", "answer a")
+    assert store.get("a") is None
+
+
+def test_cache_key_covers_model_params_and_prompt():
+    key = make_cache_key("claude", {"temperature": 0}, [("user", "hi")])
+    assert key == make_cache_key("claude", {"temperature": 0}, [("user", "hi")])
+    assert key != make_cache_key("claude", {"temperature": 1}, [("user", "hi")])
+    assert key != make_cache_key("other", {"temperature": 0}, [("user", "hi")])
+    assert key != make_cache_key("claude", {"temperature": 0}, [("user", "hello")])
+
+
+def test_langchain_chat_model_is_served_from_cache(tmp_path):
+    store = LLMResponseCache(str(tmp_path / "cache.db"))
+    llm = FakeListChatModel(responses=["first", "second"], cache=LangChainLLMCache(store))
+
+    assert llm.invoke([HumanMessage(content="decompose this")]).content == "first"
+    # Same prompt: cached, the fake's next canned response is never reached
+    assert llm.invoke([HumanMessage(content="decompose this")]).content == "first"
+    assert llm.invoke([HumanMessage(content="something else")]).content == "second"
+    assert store.stats()["hits"] == 1
+
+    # Persisted: a fresh client over the same file still hits
+    reopened = FakeListChatModel(responses=["first", "second"], cache=LangChainLLMCache(
+        LLMResponseCache(str(tmp_path / "cache.db"))))
+    assert reopened.invoke([HumanMessage(content="decompose this")]).content == "first"
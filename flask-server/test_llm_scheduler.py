@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llm_scheduler import LLMScheduler, llm_priority
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after} if retry_after else {}})()
+
+
+def _queued_threads(scheduler, names_and_priorities, order):
+    """Start one thread per (name, priority), each waiting for a slot; return once all are queued."""
+    threads = []
+    for name, priority in names_and_priorities:
+        def run(name=name, priority=priority):
+            with llm_priority(priority), scheduler.slot():
+                order.append(name)
+        thread = threading.Thread(target=run)
+        thread.start()
+        threads.append(thread)
+        while scheduler.stats()["queued"] < len(threads):
+            time.sleep(0.005)
+    return threads
+
+
+def test_interactive_waiters_are_served_before_batch():
+    scheduler = LLMScheduler("test", max_concurrency=1)
+    order = []
+
+    with scheduler.slot():
+        threads = _queued_threads(
+            scheduler,
+            [("batch-1", "batch"), ("batch-2", "batch"), ("interactive-1", "interactive"), ("interactive-2", "interactive")],
+            order,
+        )
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert order == ["interactive-1", "interactive-2", "batch-1", "batch-2"]
+    stats = scheduler.stats()
+    assert stats["queue_wait"]["batch"]["count"] == 2
+    assert stats["queue_wait"]["interactive"]["count"] == 3  # includes the holder's own (instant) grant
+    assert stats["active"] == 0 and stats["queued"] == 0
+
+
+def test_token_bucket_spaces_out_calls():
+    scheduler = LLMScheduler("test", max_concurrency=4, rate_per_minute=1200, burst=1)  # 20/s
+
+    started = time.monotonic()
+    for _ in range(5):
+        scheduler.call(lambda: None)
+
+    # One token up front, then one every 50ms
+    assert time.monotonic() - started >= 0.19
+    assert scheduler.stats()["calls"] == 5
+
+
+def test_retries_rate_limits_with_backoff_and_pauses_bucket():
+    delays = []
+    scheduler = LLMScheduler("test", max_concurrency=2, max_retries=3, sleep=delays.append)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise FakeAPIError(429, retry_after="0.01")
+        if len(attempts) == 2:
+            raise FakeAPIError(529)
+        return "ok"
+
+    assert scheduler.call(flaky) == "ok"
+    assert len(attempts) == 3
+    assert delays[0] == 0.01  # Retry-After honoured
+    stats = scheduler.stats()
+    assert stats["retries"] == 2 and stats["rate_limited"] == 1 and stats["active"] == 0
+
+
+def test_non_retryable_errors_and_exhausted_retries_raise():
+    scheduler = LLMScheduler("test", max_concurrency=1, max_retries=2, sleep=lambda _: None)
+
+    def bad_request():
+        raise FakeAPIError(400)
+
+    with pytest.raises(FakeAPIError):
+        scheduler.call(bad_request)
+
+    calls = []
+
+    def overloaded():
+        calls.append(1)
+        raise FakeAPIError(529)
+
+    with pytest.raises(FakeAPIError):
+        scheduler.call(overloaded)
+    assert len(calls) == 3
+    assert scheduler.stats()["failures"] == 2
+
+
+def test_async_slots_share_concurrency_cap():
+    scheduler = LLMScheduler("test", max_concurrency=2)
+    in_flight = {"now": 0, "peak": 0}
+
+    async def call():
+        in_flight["now"] += 1
+        in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+        await asyncio.sleep(0.02)
+        in_flight["now"] -= 1
+        return True
+
+    async def main():
+        return await asyncio.gather(*(scheduler.acall(call) for _ in range(6)))
+
+    assert asyncio.run(main()) == [True] * 6
+    assert in_flight["peak"] == 2
+    assert scheduler.stats()["active"] == 0
@@ -0,0 +1,42 @@
+import os
+import threading
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "test-key")
+
+import pytest
+from werkzeug.serving import make_server
+
+import app as app_module
+import loadtest
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, "GRAPH_DB_PATH", str(tmp_path / "graph.db"))
+    monkeypatch.setattr(app_module, "_db_engine", None)
+    httpd = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+
+
+def test_mock_scenarios_report_latency_percentiles(server):
+    for scenario in loadtest.SCENARIOS:
+        result = loadtest.run_level(server, scenario, concurrency=3, requests=9)
+
+        assert result["requests"] == 9 and result["errors"] == 0
+        assert 0 < result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"] <= result["max_ms"]
+        assert result["throughput_rps"] > 0
+    assert loadtest.check({"flask": [result]}, max_p95_ms=None, max_error_rate=0.0) == []
+
+
+def test_failures_count_as_errors_by_kind(server):
+    result = loadtest.run_level(server + "/nope", "graph4", concurrency=2, requests=4)
+    assert result["error_kinds"] == {"404": 4} and result["error_rate"] == 1.0 and result["p50_ms"] is None
+
+    refused = loadtest.run_level("http://127.0.0.1:9", "langgraph", concurrency=1, requests=2, timeout=2)
+    assert refused["errors"] == 2 and refused["error_kinds"] == {"ConnectionRefusedError": 2}
+    assert loadtest.check({"down": [refused]}, max_p95_ms=100, max_error_rate=0.01) == [
+        "down langgraph c=1: error rate 100.00% > 1.00%"
+    ]
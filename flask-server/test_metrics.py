@@ -0,0 +1,70 @@
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "test-key")
+
+import pytest
+
+import metrics
+from llm_scheduler import LLMScheduler, llm_priority
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    histogram = metrics.Histogram("op_seconds", "Op time.", ["op"], buckets=(0.1, 1.0), registry=registry)
+    counter = metrics.Counter("ops_total", 'Ops "done".', ["op"], registry=registry)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, op='say "hi"')
+    counter.inc(op="a")
+    counter.inc(2, op="a")
+
+    text = registry.render()
+
+    assert 'op_seconds_bucket{op="say \\"hi\\"",le="0.1"} 2' in text
+    assert 'op_seconds_bucket{op="say \\"hi\\"",le="1"} 3' in text
+    assert 'op_seconds_bucket{op="say \\"hi\\"",le="+Inf"} 4' in text
+    assert 'op_seconds_count{op="say \\"hi\\""} 4' in text
+    assert 'op_seconds_sum{op="say \\"hi\\""} 3.65' in text
+    assert '# TYPE ops_total counter\nops_total{op="a"} 3' in text
+    with pytest.raises(ValueError):
+        counter.inc(other="x")
+
+
+def test_scheduler_records_call_latency_and_tokens():
+    scheduler = LLMScheduler("test-metrics", max_concurrency=1)
+    message = SimpleNamespace(usage_metadata={"input_tokens": 120, "output_tokens": 30})
+    result = SimpleNamespace(generations=[SimpleNamespace(message=message)])
+
+    with llm_priority("batch"):
+        scheduler.call(lambda: result)
+    with pytest.raises(RuntimeError):
+        scheduler.call(lambda: (_ for _ in ()).throw(RuntimeError("boom")))
+
+    labels = {"scheduler": "test-metrics", "priority": "batch"}
+    assert metrics.LLM_CALL_SECONDS.count(**labels, outcome="ok") == 1
+    assert metrics.LLM_CALL_SECONDS.count(scheduler="test-metrics", priority="interactive", outcome="error") == 1
+    assert metrics.LLM_TOKENS.value(scheduler="test-metrics", direction="input") == 120
+    assert metrics.LLM_TOKENS.value(scheduler="test-metrics", direction="output") == 30
+    # llama-index responses report usage on the raw provider payload
+    assert metrics.llm_usage(SimpleNamespace(raw={"usage": {"input_tokens": 5, "output_tokens": 7}})) == (5, 7)
+
+
+def test_metrics_endpoint_covers_routes_and_langgraph_nodes():
+    import app as app_module
+    import LangGraph
+
+    client = app_module.app.test_client()
+    before = metrics.HTTP_REQUESTS.value(method="GET", route="/api/data", status="200")
+    nodes_before = metrics.LANGGRAPH_NODE_SECONDS.count(node="router", outcome="ok")
+
+    client.get("/api/data")
+    LangGraph.query_with_langgraph("Are there any bugs in my plan?", mock=True)
+    response = client.get("/metrics")
+
+    text = response.get_data(as_text=True)
+    assert response.status_code == 200 and response.mimetype == "text/plain"
+    assert metrics.HTTP_REQUESTS.value(method="GET", route="/api/data", status="200") == before + 1
+    assert metrics.LANGGRAPH_NODE_SECONDS.count(node="router", outcome="ok") == nodes_before + 1
+    assert 'langgraph_node_duration_seconds_count{node="multi_rag_retrieve",outcome="ok"}' in text
+    assert 'llm_scheduler_calls_total{scheduler="llm"}' in text
+    assert 'cache_hits_total{cache="answer"}' in text
@@ -0,0 +1,407 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import tracemalloc
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "test-key")
+
+import pytest
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+import rag
+
+
+@pytest.fixture
+def cold_rag(monkeypatch):
+    """Reset rag's module-level singletons so each test starts from a cold process."""
+    for name in ("_vector_index", "_query_engine", "_graph_retriever", "_retrieval_handler",
+                 "_graph_data", "_graph_fingerprint", "_graph_hash", "_warmup_thread", "_embed_model", "_llm"):
+        monkeypatch.setattr(rag, name, None)
+    monkeypatch.setattr(rag, "_index_status", dict(rag._index_status, state="cold", error=None))
+    monkeypatch.setattr(rag, "_index_settled", threading.Event())
+    return rag
+
+
+def _slow_fake_build(calls):
+    def fake_build_index():
+        calls.append(threading.get_ident())
+        time.sleep(0.2)  # wide window for racing threads to pile up
+        return object(), object(), {}, {}, {}
+    return fake_build_index
+
+
+def _run_concurrently(fn, n=8):
+    barrier = threading.Barrier(n)
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(fn())
+
+    threads = [threading.Thread(target=worker) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_get_query_engine_builds_index_once(cold_rag, monkeypatch):
+    calls = []
+    monkeypatch.setattr(rag, "build_index", _slow_fake_build(calls))
+    monkeypatch.setattr(rag, "build_query_engine", lambda *a, **kw: (object(), object(), object()))
+
+    engines = _run_concurrently(rag.get_query_engine)
+
+    assert len(calls) == 1
+    assert all(engine is engines[0] for engine in engines)
+    assert rag.get_index_status()["state"] == "ready"
+
+
+def test_warmup_and_requests_share_one_build(cold_rag, monkeypatch):
+    calls = []
+    monkeypatch.setattr(rag, "build_index", _slow_fake_build(calls))
+    monkeypatch.setattr(rag, "build_query_engine", lambda *a, **kw: (object(), object(), object()))
+
+    assert rag.start_index_warmup() is True
+    assert rag.start_index_warmup() is False  # already in flight
+    engines = _run_concurrently(rag.get_query_engine)
+    assert rag.wait_for_index(5)
+
+    assert len(calls) == 1
+    assert all(engine is engines[0] for engine in engines)
+
+
+def test_wait_for_index_returns_false_when_build_fails(cold_rag, monkeypatch):
+    def failing_build_index():
+        raise ValueError("bad plan")
+    monkeypatch.setattr(rag, "build_index", failing_build_index)
+
+    rag.start_index_warmup()
+
+    assert rag.wait_for_index(5) is False
+    status = rag.get_index_status()
+    assert status["state"] == "failed"
+    assert status["error"] == "bad plan"
+
+
+def test_answers_from_a_stale_index_are_not_cached(cold_rag, monkeypatch):
+    import app as app_module
+    from answer_cache import AnswerCache
+
+    class Engine:
+        def query(self, question):
+            return "answer from the serving index"
+
+    cache = AnswerCache()
+    monkeypatch.setattr(app_module, "answer_cache", cache)
+    monkeypatch.setattr(app_module, "graph_input_hash", lambda: "new")
+    monkeypatch.setattr(rag, "start_index_warmup", lambda: False)
+    monkeypatch.setattr(rag, "_query_engine", Engine())
+    monkeypatch.setattr(rag, "_graph_hash", "old")  # still rebuilding for the new plan
+    client = app_module.app.test_client()
+
+    response = client.post("/api/query", json={"question": "What is the bucket?"})
+    assert response.get_json()["answer"] == "answer from the serving index"
+    assert not cache.contains("query", "new", "What is the bucket?")
+
+    monkeypatch.setattr(rag, "_graph_hash", "new")
+    client.post("/api/query", json={"question": "What is the bucket?"})
+    assert cache.contains("query", "new", "What is the bucket?")
+
+
+def test_concurrent_get_embed_model_constructs_once(cold_rag, monkeypatch):
+    constructed = []
+
+    class SlowEmbedding:
+        def __init__(self, model_name):
+            constructed.append(model_name)
+            time.sleep(0.1)
+
+    monkeypatch.setattr(rag, "HuggingFaceEmbedding", SlowEmbedding)
+
+    models = _run_concurrently(rag.get_embed_model)
+
+    assert len(constructed) == 1
+    assert all(model is models[0] for model in models)
+
+
+class KeywordVectorRetriever(BaseRetriever):
+    """Stands in for the embedding retriever: returns nodes whose id appears in the query."""
+
+    def __init__(self, address_to_node, delay=0.0):
+        super().__init__()
+        self._address_to_node = address_to_node
+        self._delay = delay
+
+    def _retrieve(self, query_bundle):
+        time.sleep(self._delay)
+        return [
+            NodeWithScore(node=node, score=0.8)
+            for address, node in self._address_to_node.items()
+            if address in query_bundle.query_str
+        ]
+
+
+def _make_graph_retriever(nodes, delay=0.0, **kwargs):
+    address_to_node = {}
+    path_to_neighbors = {}
+    for path, node_data in nodes.items():
+        path_to_neighbors[path] = set(node_data["edges_new"]) | set(node_data["edges_existing"])
+        for address, resource in node_data["resources"].items():
+            address_to_node[address] = TextNode(
+                text=rag._resource_to_text(path, address, resource, node_data), id_=address
+            )
+    return rag.TerraformGraphRetriever(
+        vector_retriever=KeywordVectorRetriever(address_to_node, delay),
+        nodes=nodes,
+        address_to_node=address_to_node,
+        path_to_neighbors=path_to_neighbors,
+        **kwargs,
+    )
+
+
+def _chain_graph(length):
+    """aws_sqs_queue.q0 <-> q1 <-> ... <-> q{length-1}"""
+    nodes = {}
+    for i in range(length):
+        path = f"aws_sqs_queue.q{i}"
+        neighbors = [f"aws_sqs_queue.q{j}" for j in (i - 1, i + 1) if 0 <= j < length]
+        nodes[path] = {
+            "resources": {path: {"address": path, "type": "aws_sqs_queue",
+                                 "change": {"actions": ["no-op"], "before": {}, "after": {}, "diff": {}}}},
+            "edges_new": neighbors,
+            "edges_existing": [],
+        }
+    return nodes
+
+
+def test_concurrent_retrievals_record_separate_traces():
+    retriever = _make_graph_retriever(_chain_graph(6), delay=0.05)
+    queries = [f"what is aws_sqs_queue.q{i}?" for i in range(6)]
+    traces = {}
+    seen_by_retriever = {}
+
+    def worker(query):
+        with rag.capture_retrieval_trace() as trace:
+            retriever.retrieve(QueryBundle(query))
+            seen_by_retriever[query] = retriever.last_trace["query"]
+        traces[query] = trace
+
+    threads = [threading.Thread(target=worker, args=(q,)) for q in queries]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for query in queries:
+        assert seen_by_retriever[query] == query
+        assert len(traces[query].retrievals) == 1
+        assert traces[query].last["query"] == query
+    assert retriever.last_trace is None  # nothing leaks into the caller's context
+
+
+def test_nested_trace_merges_into_parent():
+    retriever = _make_graph_retriever(_chain_graph(3))
+
+    with rag.capture_retrieval_trace() as parent:
+        with rag.capture_retrieval_trace() as child:
+            retriever.retrieve(QueryBundle("aws_sqs_queue.q0"))
+        retriever.retrieve(QueryBundle("aws_sqs_queue.q2"))
+
+    assert [t["query"] for t in child.retrievals] == ["aws_sqs_queue.q0"]
+    assert [t["query"] for t in parent.retrievals] == ["aws_sqs_queue.q0", "aws_sqs_queue.q2"]
+
+
+def _bfs_distances(path_to_neighbors, nodes, seeds, hops):
+    distances = {seed: 0 for seed in seeds}
+    frontier = list(seeds)
+    for hop in range(1, hops + 1):
+        next_frontier = []
+        for path in frontier:
+            for neighbour in path_to_neighbors.get(path, ()):
+                if neighbour in nodes and neighbour not in distances:
+                    distances[neighbour] = hop
+                    next_frontier.append(neighbour)
+        frontier = next_frontier
+    return distances
+
+
+@pytest.mark.parametrize("hops", [1, 2, 3])
+def test_neighbourhood_index_matches_bfs(hops):
+    rng = random.Random(hops)
+    paths = [f"aws_s3_bucket.b{i}" for i in range(60)]
+    nodes = {path: {} for path in paths}
+    path_to_neighbors = {path: set(rng.sample(paths, 2)) for path in paths}
+    path_to_neighbors[paths[0]].add("provider[aws]")  # neighbours outside the graph are ignored
+    index = rag.NeighbourhoodIndex(nodes, path_to_neighbors, max_hops=hops)
+
+    for _ in range(10):
+        seeds = rng.sample(paths, 3)
+        rings, reached = index.expand({seed: 1.0 for seed in seeds}, hops)
+        expected = _bfs_distances(path_to_neighbors, nodes, seeds, hops)
+
+        assert {path: hop for path, (hop, _) in reached.items()} == {
+            path: hop for path, hop in expected.items() if hop > 0
+        }
+        for hop, ring in enumerate(rings, 1):
+            assert set(index.ids_to_paths(ring)) == {p for p, d in expected.items() if d == hop}
+
+
+def test_neighbourhood_index_memory_is_linear_in_the_graph():
+    paths = [f"aws_s3_bucket.b{i}" for i in range(20000)]
+    chain = {path: {paths[i - 1]} if i else set() for i, path in enumerate(paths)}
+    nodes = {path: {} for path in paths}
+
+    tracemalloc.start()
+    try:
+        index = rag.NeighbourhoodIndex(nodes, chain, max_hops=2)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    # The names and id map dominate; a quadratic structure would be ~50 MB per hop
+    assert peak < 10 * 1024 * 1024
+    rings, reached = index.expand({paths[100]: 0.5, paths[102]: 0.9}, 2)
+    assert [set(index.ids_to_paths(ring)) for ring in rings] == [{paths[99], paths[101]}, {paths[98]}]
+    assert reached[paths[101]] == (1, 0.9) and reached[paths[98]] == (2, 0.5)
+
+
+def test_graph_hops_label_and_decay_scores():
+    retriever = _make_graph_retriever(_chain_graph(5), graph_hops=3, hop_decay=0.5)
+
+    with rag.capture_retrieval_trace() as trace:
+        results = retriever.retrieve(QueryBundle("aws_sqs_queue.q0"))
+
+    by_id = {nws.node.node_id: nws for nws in results}
+    assert by_id["aws_sqs_queue.q0"].node.metadata["retrieval_source"] == "vector"
+    for hop in (1, 2, 3):
+        nws = by_id[f"aws_sqs_queue.q{hop}"]
+        assert nws.node.metadata["retrieval_source"] == f"graph_hop_{hop}"
+        assert nws.score == pytest.approx(0.8 * 0.5 ** hop)
+    assert "aws_sqs_queue.q4" not in by_id
+    assert trace.last["hop_additions"] == [["aws_sqs_queue.q1"], ["aws_sqs_queue.q2"], ["aws_sqs_queue.q3"]]
+
+
+def test_async_retrieval_matches_sync():
+    retriever = _make_graph_retriever(_chain_graph(5), graph_hops=2)
+
+    with rag.capture_retrieval_trace() as sync_trace:
+        expected = retriever.retrieve(QueryBundle("aws_sqs_queue.q2"))
+
+    async def aretrieve():
+        with rag.capture_retrieval_trace() as trace:
+            return await retriever.aretrieve(QueryBundle("aws_sqs_queue.q2")), trace
+
+    results, async_trace = asyncio.run(aretrieve())
+
+    assert [(n.node.node_id, n.score) for n in results] == [(n.node.node_id, n.score) for n in expected]
+    assert async_trace.last == sync_trace.last
+
+
+def _hub_graph(spokes):
+    """One hub bucket updated in place, connected to `spokes` unchanged queues with bulky values."""
+    hub = "aws_s3_bucket.hub"
+    nodes = {
+        hub: {
+            "resources": {hub: {"address": hub, "type": "aws_s3_bucket", "change": {
+                "actions": ["update"],
+                "before": {"bucket": "hub", "tags": {"env": "dev"}, "policy": "x" * 2000},
+                "after": {"bucket": "hub", "tags": {"env": "prod"}, "policy": "x" * 2000},
+                "diff": {"tags": {"before": {"env": "dev"}, "after": {"env": "prod"}}},
+            }}},
+            "edges_new": [f"aws_sqs_queue.s{i}" for i in range(spokes)],
+            "edges_existing": [],
+        }
+    }
+    for i in range(spokes):
+        path = f"aws_sqs_queue.s{i}"
+        nodes[path] = {
+            "resources": {path: {"address": path, "type": "aws_sqs_queue", "change": {
+                "actions": ["no-op"], "before": {"name": path, "policy": "y" * 1500},
+                "after": {"name": path, "policy": "y" * 1500}, "diff": {},
+            }}},
+            "edges_new": [hub],
+            "edges_existing": [],
+        }
+    return nodes
+
+
+def test_context_is_compressed_and_cut_to_token_budget():
+    retriever = _make_graph_retriever(_hub_graph(200), token_budget=1000)
+
+    with rag.capture_retrieval_trace() as trace:
+        results = retriever.retrieve(QueryBundle("aws_s3_bucket.hub"))
+
+    packing = trace.last["packing"]
+    assert packing["candidate_count"] == 201
+    assert packing["context_tokens"] <= 1000
+    assert sum(rag._estimate_tokens(nws.node.text) for nws in results) == packing["context_tokens"]
+    assert len(results) == packing["packed_count"] < 201
+    # vector hit first, rendered with only its changed field
+    assert results[0].node.node_id == "aws_s3_bucket.hub"
+    assert "tags" in results[0].node.text and "x" * 100 not in results[0].node.text
+
+
+def test_context_ranking_prefers_changed_resources():
+    nodes = _chain_graph(3)
+    nodes["aws_sqs_queue.q2"]["resources"]["aws_sqs_queue.q2"]["change"]["actions"] = ["create"]
+    packer = rag.ContextPacker(nodes, token_budget=0)
+
+    packed, stats = packer.pack([
+        ("aws_sqs_queue.q0", "aws_sqs_queue.q0", 1, 0.7),
+        ("aws_sqs_queue.q2", "aws_sqs_queue.q2", 1, 0.7),
+        ("aws_sqs_queue.q1", "aws_sqs_queue.q1", 0, 0.5),
+    ])
+
+    assert [nws.node.node_id for nws in packed] == ["aws_sqs_queue.q1", "aws_sqs_queue.q2", "aws_sqs_queue.q0"]
+    assert stats["dropped_addresses"] == []
+
+
+def test_cached_anthropic_serves_repeat_chats_from_cache(monkeypatch, tmp_path):
+    from llama_index.core.base.llms.types import ChatMessage
+    from llama_index.llms.anthropic.base import AnthropicChatResponse
+    from llm_cache import LLMResponseCache
+
+    monkeypatch.setattr(rag, "llm_response_cache", LLMResponseCache(str(tmp_path / "cache.db")))
+    remote_calls = []
+
+    def fake_remote_chat(self, messages, **kwargs):
+        remote_calls.append(messages)
+        return AnthropicChatResponse(message=ChatMessage(role="assistant", content=f"answer {len(remote_calls)}"))
+
+    monkeypatch.setattr(rag.Anthropic, "chat", fake_remote_chat)
+    llm = rag.CachedAnthropic(model="claude-sonnet-4-20250514", api_key="test-key")
+    question = [ChatMessage(role="user", content="What depends on the bucket?")]
+
+    assert llm.chat(question).message.content == "answer 1"
+    assert llm.chat(question).message.content == "answer 1"
+    assert llm.complete("What depends on the bucket?").text == "answer 1"  # completions route through chat
+    assert len(remote_calls) == 1
+
+
+def test_cached_anthropic_streams_then_serves_from_cache(monkeypatch, tmp_path):
+    from llama_index.core.base.llms.types import ChatMessage
+    from llama_index.llms.anthropic.base import AnthropicChatResponse
+    from llm_cache import LLMResponseCache
+
+    monkeypatch.setattr(rag, "llm_response_cache", LLMResponseCache(str(tmp_path / "cache.db")))
+    remote_streams = []
+
+    def fake_remote_stream(self, messages, **kwargs):
+        remote_streams.append(messages)
+        content = ""
+        for token in ["The ", "bucket ", "is ", "used."]:
+            content += token
+            yield AnthropicChatResponse(message=ChatMessage(role="assistant", content=content), delta=token)
+
+    monkeypatch.setattr(rag.Anthropic, "stream_chat", fake_remote_stream)
+    llm = rag.CachedAnthropic(model="claude-sonnet-4-20250514", api_key="test-key")
+    question = [ChatMessage(role="user", content="What uses the bucket?")]
+
+    assert [r.delta for r in llm.stream_chat(question)] == ["The ", "bucket ", "is ", "used."]
+    assert [r.delta for r in llm.stream_chat(question)] == ["The bucket is used."]
+    assert len(remote_streams) == 1
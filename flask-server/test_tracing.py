@@ -0,0 +1,70 @@
+import os
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "test-key")
+
+import pytest
+from langchain_core.tools import tool
+
+import LangGraph
+import tracing
+from llm_scheduler import LLMScheduler
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracing.configure(True, str(path))
+    yield path
+    tracing.configure(False)
+
+
+def _attributes(span):
+    return {a["key"]: next(iter(a["value"].values())) for a in span["attributes"]}
+
+
+def test_langgraph_run_exports_one_trace_with_a_span_per_node(trace_file):
+    LangGraph.query_with_langgraph("Are there any bugs in my plan?", mock=True)
+
+    lines = trace_file.read_text().splitlines()
+    spans = tracing.load_spans(str(trace_file))
+    assert len(lines) == 1
+    root = next(s for s in spans if s["name"] == "langgraph.query")
+    assert "parentSpanId" not in root and _attributes(root)["langgraph.route"] == "analysis"
+    nodes = {s["name"]: s for s in spans if s is not root}
+    assert {"router", "multi_rag_retrieve", "synthesize", "format_final"} <= set(nodes)
+    assert all(s["traceId"] == root["traceId"] and s["parentSpanId"] == root["spanId"] for s in nodes.values())
+    assert _attributes(nodes["router"])["langgraph.trace"]["values"][0] == {"stringValue": "[router] Classified as 'analysis'"}
+    assert all(int(s["endTimeUnixNano"]) >= int(s["startTimeUnixNano"]) for s in spans)
+
+
+def test_sub_question_spans_show_achieved_parallelism(trace_file, monkeypatch):
+    @tool
+    def slow_rag(question: str) -> str:
+        """Stand-in RAG query."""
+        with tracing.span("rag.query"):
+            time.sleep(0.1)
+        return "answer"
+
+    monkeypatch.setattr(LangGraph, "terraform_rag_query", slow_rag)
+    with tracing.span("multi_rag_retrieve"):
+        LangGraph._retrieve_sub_answers([f"q{i}" for i in range(4)], "multi_rag_retrieve")
+
+    summary = tracing.summarize(tracing.load_spans(str(trace_file)))
+    assert summary["rag.query"]["count"] == 4
+    assert summary["multi_rag_retrieve"]["parallelism"] > 2
+
+
+def test_llm_call_spans_carry_tokens_and_errors(trace_file):
+    scheduler = LLMScheduler("test-tracing", max_concurrency=1)
+    message = SimpleNamespace(usage_metadata={"input_tokens": 11, "output_tokens": 4})
+
+    with tracing.span("request"):
+        scheduler.call(lambda: SimpleNamespace(generations=[SimpleNamespace(message=message)]))
+        with pytest.raises(ValueError):
+            scheduler.call(lambda: (_ for _ in ()).throw(ValueError("bad request")))
+
+    ok, failed = [s for s in tracing.load_spans(str(trace_file)) if s["name"] == "test-tracing.call"]
+    assert _attributes(ok)["gen_ai.usage.input_tokens"] == "11" and _attributes(ok)["gen_ai.usage.output_tokens"] == "4"
+    assert failed["status"] == {"code": tracing.STATUS_ERROR, "message": "ValueError: bad request"}
@@ -0,0 +1,176 @@
+import gzip
+import io
+import os
+import time
+
+import pytest
+
+import app as app_module
+import bench_rag
+import graph_provider
+import rag
+import workspaces
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    registry = workspaces.WorkspaceRegistry(str(tmp_path / "workspaces"), path_roots=[HERE])
+    monkeypatch.setattr(workspaces, "registry", registry)
+    registry.register("small", os.path.join(HERE, "plan-larger.json"), os.path.join(HERE, "graph.dot"))
+    return registry
+
+
+@pytest.fixture
+def client():
+    app_module.app.config["TESTING"] = True
+    return app_module.app.test_client()
+
+
+def test_requests_are_served_from_the_selected_workspace(registry, client):
+    default = client.get("/api/graph3").get_json()
+    small = client.get("/api/graph3?workspace=small").get_json()
+
+    assert small and small != default
+    assert set(small) == set(app_module.build_graph3_nodes(
+        plan_path=os.path.join(HERE, "plan-larger.json"), dot_path=os.path.join(HERE, "graph.dot")
+    ))
+    assert workspaces.current_workspace() == workspaces.DEFAULT_WORKSPACE
+    assert client.get("/api/graph3?workspace=missing").status_code == 404
+    assert [w["id"] for w in client.get("/api/workspaces").get_json()["workspaces"]] == ["small"]
+    with workspaces.use_workspace("small"):
+        small_hash = app_module.graph_input_hash()
+    assert small_hash != app_module.graph_input_hash()
+
+
+def test_workspace_routes_register_and_remove(registry, client):
+    plan, dot = os.path.join(HERE, "planexisting-larger.json"), os.path.join(HERE, "graphexisting.dot")
+
+    assert client.put("/api/workspaces/bad id", json={"plan_path": plan, "dot_path": dot}).status_code == 400
+    assert client.put("/api/workspaces/prod", json={"plan_path": plan}).status_code == 400
+    outside = client.put("/api/workspaces/prod", json={"plan_path": "/etc/passwd", "dot_path": dot})
+    assert outside.status_code == 400 and "must be under" in outside.get_json()["error"]
+    link = os.path.join(registry.directory, "plan.json")
+    os.symlink("/etc/passwd", link)
+    assert client.put("/api/workspaces/prod", json={"plan_path": link, "dot_path": dot}).status_code == 400
+    created = client.put("/api/workspaces/prod", json={"plan_path": plan, "dot_path": dot})
+    assert created.status_code == 201 and created.get_json()["plan_path"] == plan
+
+    assert client.get("/api/workspaces/prod").get_json()["index"]["workspace"] == "prod"
+    assert client.delete("/api/workspaces/prod").status_code == 204
+    assert client.get("/api/workspaces/prod").status_code == 404
+    assert not os.path.exists(registry.workspace_dir("prod"))
+
+
+def test_least_recently_used_workspace_is_evicted_over_budget(registry):
+    registry.register("existing", os.path.join(HERE, "planexisting-larger.json"), os.path.join(HERE, "graphexisting.dot"))
+    registry.budget_bytes = 1
+
+    small = registry.graph("small")
+    assert list(registry.stats()["loaded"]) == ["small"]
+    registry.graph("existing")
+
+    stats = registry.stats()
+    assert list(stats["loaded"]) == ["existing"] and stats["evictions"] == 1
+    # Reloaded on demand, from the same inputs
+    assert registry.graph("small").nodes.keys() == small.nodes.keys()
+    with workspaces.use_workspace("small"):
+        assert graph_provider.get_graph().fingerprint == small.fingerprint
+
+
+def test_workspace_index_is_persisted_and_reloaded(registry, monkeypatch):
+    monkeypatch.setattr(rag, "_embed_model", rag.ScheduledEmbedding(bench_rag.HashEmbedding()))
+    monkeypatch.setattr(rag, "_llm", bench_rag.CannedLLM())
+
+    with workspaces.use_workspace("small"):
+        assert rag.get_query_engine() is not None
+        assert rag.get_index_status()["state"] == "ready"
+    persisted = os.listdir(os.path.join(registry.workspace_dir("small"), "index"))
+    assert len(persisted) == 1
+
+    reopened = workspaces.WorkspaceRegistry(registry.directory)
+    monkeypatch.setattr(workspaces, "registry", reopened)
+    monkeypatch.setattr(rag, "build_index", lambda nodes=None: pytest.fail("index should load from disk"))
+    with workspaces.use_workspace("small"):
+        retriever = rag.get_graph_retriever()
+        assert retriever is not None
+    assert reopened.stats()["loaded"]["small"]["index"]
+
+
+def _wait(job_id, client, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/api/workspaces/jobs/{job_id}").get_json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.1)
+    pytest.fail(f"job {job_id} did not finish")
+
+
+def test_uploaded_plan_is_built_in_the_background(registry, client, monkeypatch):
+    monkeypatch.setattr(rag, "_embed_model", rag.ScheduledEmbedding(bench_rag.HashEmbedding()))
+    monkeypatch.setattr(rag, "_llm", bench_rag.CannedLLM())
+    with open(os.path.join(HERE, "plan-larger.json"), "rb") as f:
+        plan = gzip.compress(f.read())
+    with open(os.path.join(HERE, "graph.dot"), "rb") as f:
+        dot = f.read()
+
+    response = client.post("/api/workspaces/ci/upload", data={
+        "plan": (io.BytesIO(plan), "plan.json.gz"),
+        "dot": (io.BytesIO(dot), "graph.dot"),
+    })
+
+    assert response.status_code == 202 and response.headers["Location"].endswith(response.get_json()["job_id"])
+    job = _wait(response.get_json()["job_id"], client)
+    assert job["status"] == "done", job["error"]
+    assert job["result"]["index"]["ready"] and job["result"]["resources"] == job["partial"]["resources"]
+    with open(registry.get("ci").plan_path, "rb") as f:
+        assert f.read() == gzip.decompress(plan)
+    small = client.get("/api/graph3?workspace=small").get_json()
+    assert client.get("/api/graph3?workspace=ci").get_json() == small
+
+
+def test_invalid_uploads_are_rejected(registry, client, monkeypatch):
+    def upload(plan, dot=b"digraph {}"):
+        return client.post("/api/workspaces/ci/upload", data={
+            "plan": (io.BytesIO(plan), "plan.json"), "dot": (io.BytesIO(dot), "graph.dot"), "index": "false",
+        })
+
+    assert client.post("/api/workspaces/ci/upload", data={}).status_code == 400
+    assert upload(b"not json").status_code == 400
+    assert upload(b"{}", dot=b"{}").status_code == 400
+    assert upload(b"\x1f\x8bcorrupt").status_code == 400
+    monkeypatch.setattr(workspaces, "UPLOAD_MAX_MB", 1 / 1024)
+    assert upload(gzip.compress(b"{" + b" " * 4096 + b"}")).status_code == 413
+    # Under the limit decompressed, over it as sent
+    incompressible = gzip.compress(b"{" + os.urandom(1020))
+    assert len(incompressible) > 1024 and upload(incompressible).status_code == 413
+    assert not registry.exists("ci") and os.listdir(registry.workspace_dir("ci")) == []
+
+
+def test_oversized_upload_request_is_refused_unread(registry, client, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, "MAX_CONTENT_LENGTH", 1024)
+    monkeypatch.setattr(workspaces.WorkspaceRegistry, "upload", lambda *args: pytest.fail("body should not be read"))
+
+    response = client.post("/api/workspaces/ci/upload", data={
+        "plan": (io.BytesIO(b"{" + b" " * 4096 + b"}"), "plan.json"), "dot": (io.BytesIO(b"digraph {}"), "graph.dot"),
+    })
+
+    assert response.status_code == 413 and "larger than" in response.get_json()["error"]
+
+
+def test_half_written_persisted_index_is_rebuilt(registry, monkeypatch):
+    monkeypatch.setattr(rag, "_embed_model", rag.ScheduledEmbedding(bench_rag.HashEmbedding()))
+    monkeypatch.setattr(rag, "_llm", bench_rag.CannedLLM())
+    with workspaces.use_workspace("small"):
+        persist_dir = os.path.join(registry.workspace_dir("small"), "index", app_module.graph_input_hash()[:16])
+    os.makedirs(persist_dir)
+    with open(os.path.join(persist_dir, "docstore.json"), "w") as f:
+        f.write('{"docstore/data": {')  # a crash mid-persist
+
+    with workspaces.use_workspace("small"):
+        assert rag.get_query_engine() is not None
+    assert registry.index_status("small")["state"] == "ready"
+    assert sorted(os.listdir(os.path.dirname(persist_dir))) == [os.path.basename(persist_dir)]
+    assert registry._load_persisted_index(persist_dir, registry.graph("small").nodes) is not None
@@ -0,0 +1,40 @@
+import os
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "test-key")
+
+import app as app_module
+import graph_provider
+import llm_cache
+
+
+def test_worker_reopens_connections_after_fork(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, "GRAPH_DB_PATH", str(tmp_path / "graph.db"))
+    monkeypatch.setattr(app_module, "_db_engine", None)
+    cache = llm_cache.LLMResponseCache(str(tmp_path / "llm_cache.db"))
+    monkeypatch.setattr(llm_cache, "llm_response_cache", cache)
+    import wsgi
+
+    wsgi.preload()
+    assert graph_provider.stats()["cached"]
+    app_module.save_enrichment("master", {"a": 1})
+    cache.put("k", "master")
+    master_conn = cache._conn
+
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            wsgi.reset_after_fork()
+            assert cache._conn is None
+            assert app_module.load_enrichment("master") == {"a": 1}
+            app_module.save_enrichment("worker", {"b": 2})
+            assert cache.get("k") == "master" and cache._conn is not master_conn
+            cache.put("k2", "worker")
+            status = 0
+        finally:
+            os._exit(status)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert app_module.load_enrichment("worker") == {"b": 2}
+    assert cache.get("k2") == "worker"
@@ -0,0 +1,278 @@
+"""
+Request tracing: OpenTelemetry-compatible spans for LangGraph nodes, LLM calls and
+RAG retrievals, exported as OTLP/JSON lines to a local file.
+
+Enable with TRACING=1. Spans nest through a context variable, so they follow work
+into threads started with contextvars.copy_context() (multi_rag_retrieve's pool,
+LangGraph's executor) and into asyncio tasks. A trace is written when its root span
+ends, as one line in the OTLP/JSON format the OpenTelemetry collector's
+otlpjsonfile receiver reads — so the file can be replayed into Jaeger / Tempo —
+or summarised locally:
+
+  python tracing.py traces.jsonl        # time per span name, and sub-span parallelism
+
+The opentelemetry SDK isn't a dependency; this module produces the same data for
+the three span sources above without it. When tracing is off, span() does not
+touch the context and costs one attribute check.
+"""
+
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.environ.get("TRACING", "0").lower() in ("1", "true", "yes")
+TRACE_FILE = os.environ.get(
+    "TRACE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces.jsonl")
+)
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "terraform-graph-viewer")
+
+STATUS_UNSET, STATUS_ERROR = 0, 2
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "status",
+                 "_trace")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: dict[str, Any]):
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        if parent is None:
+            self.trace_id = f"{random.getrandbits(128):032x}"
+            self.parent_id = None
+            self._trace = _TraceBuffer(self)
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self._trace = parent._trace
+        self.attributes = dict(attributes)
+        self.status: dict[str, Any] = {"code": STATUS_UNSET}
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes: dict[str, Any]) -> None:
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_error(self, exc: BaseException) -> None:
+        self.status = {"code": STATUS_ERROR, "message": f"{type(exc).__name__}: {exc}"}
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self._trace.finished(self)
+
+    def to_otlp(self) -> dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": self.status,
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """What span() yields while tracing is off."""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: dict[str, Any]) -> None:
+        pass
+
+    def record_error(self, exc: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+class _TraceBuffer:
+    """Finished spans of one trace, held until the root ends (late spans are written on their own)."""
+
+    def __init__(self, root: Span):
+        self._root = root
+        self._spans: list[Span] = []
+        self._flushed = False
+        self._lock = threading.Lock()
+
+    def finished(self, span: Span) -> None:
+        with self._lock:
+            if self._flushed:
+                batch = [span]
+            else:
+                self._spans.append(span)
+                if span is not self._root:
+                    return
+                batch, self._spans, self._flushed = self._spans, [], True
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(batch)
+
+
+class FileSpanExporter:
+    """Appends one OTLP/JSON ExportTraceServiceRequest per line."""
+
+    def __init__(self, path: str, service_name: str = TRACE_SERVICE_NAME):
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+
+    def export(self, spans: list[Span]) -> None:
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": "tracing"}, "spans": [s.to_otlp() for s in spans]}],
+            }]
+        }
+        line = json.dumps(payload, separators=(",", ":"))
+        try:
+            with self._lock, open(self.path, "a") as f:
+                f.write(line + "\n")
+        except OSError:
+            logger.exception("[tracing] Could not write spans to %s", self.path)
+
+
+_exporter: Optional[FileSpanExporter] = FileSpanExporter(TRACE_FILE) if TRACING_ENABLED else None
+_current_span: ContextVar[Optional[Span]] = ContextVar("tracing_current_span", default=None)
+
+
+def configure(enabled: bool, path: Optional[str] = None) -> None:
+    """Turn tracing on or off at runtime (e.g. from tests or a CLI), optionally with a new output file."""
+    global TRACING_ENABLED, _exporter
+    TRACING_ENABLED = enabled
+    _exporter = FileSpanExporter(path or TRACE_FILE) if enabled else None
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get() if TRACING_ENABLED else None
+
+
+def start_span(name: str, **attributes) -> Span | _NoopSpan:
+    """A child of the current span that is not made current; call .end() yourself (e.g. around a stream)."""
+    if not TRACING_ENABLED:
+        return NOOP_SPAN
+    return Span(name, _current_span.get(), attributes)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span | _NoopSpan]:
+    """Run the block in a new span (a child of the current one); exceptions mark it as failed."""
+    if not TRACING_ENABLED:
+        yield NOOP_SPAN
+        return
+    parent = _current_span.get()
+    current = Span(name, parent, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as exc:
+        if not isinstance(exc, GeneratorExit):
+            current.record_error(exc)
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Ended from another context (a generator finished elsewhere)
+            _current_span.set(parent)
+        current.end()
+
+
+# ---------------------------------------------------------------------------
+# Local summary of an exported file
+# ---------------------------------------------------------------------------
+
+
+def load_spans(path: str) -> list[dict[str, Any]]:
+    spans = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for resource_spans in json.loads(line)["resourceSpans"]:
+                for scope_spans in resource_spans["scopeSpans"]:
+                    spans.extend(scope_spans["spans"])
+    return spans
+
+
+def _duration(span: dict[str, Any]) -> float:
+    return (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e9
+
+
+def summarize(spans: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Per span name: count, total / max seconds, and — for spans with children — the
+    achieved parallelism (children's summed time / the parent's wall time).
+    """
+    children: dict[str, list[dict[str, Any]]] = {}
+    for s in spans:
+        if s.get("parentSpanId"):
+            children.setdefault(s["parentSpanId"], []).append(s)
+
+    by_name: dict[str, dict[str, Any]] = {}
+    for s in spans:
+        d = _duration(s)
+        entry = by_name.setdefault(s["name"], {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0,
+                                               "errors": 0, "child_seconds": 0.0})
+        entry["count"] += 1
+        entry["total_seconds"] += d
+        entry["max_seconds"] = max(entry["max_seconds"], d)
+        entry["errors"] += s.get("status", {}).get("code") == STATUS_ERROR
+        entry["child_seconds"] += sum(_duration(c) for c in children.get(s["spanId"], ()))
+
+    for entry in by_name.values():
+        child_seconds = entry.pop("child_seconds")
+        entry["parallelism"] = round(child_seconds / entry["total_seconds"], 2) if child_seconds and entry["total_seconds"] else None
+    return dict(sorted(by_name.items(), key=lambda kv: -kv[1]["total_seconds"]))
+
+
+def main(argv: list[str]) -> int:
+    path = argv[1] if len(argv) > 1 else TRACE_FILE
+    spans = load_spans(path)
+    roots = [s for s in spans if not s.get("parentSpanId")]
+    print(f"{len(roots)} traces, {len(spans)} spans in {path}\n")
+    print(f"  {'span':<40}{'count':>7}{'total s':>10}{'max s':>9}{'errors':>8}{'parallel':>10}")
+    for name, entry in summarize(spans).items():
+        parallel = f"{entry['parallelism']:.2f}x" if entry["parallelism"] is not None else ""
+        print(f"  {name:<40}{entry['count']:>7}{entry['total_seconds']:>10.3f}{entry['max_seconds']:>9.3f}"
+              f"{entry['errors']:>8}{parallel:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,534 @@
+"""
+Workspaces: many Terraform plans served by one process.
+
+A workspace is an id with a plan JSON (`tofu show -json`) and a DOT graph
+(`tofu graph`). Its registration lives on disk in WORKSPACES_DIR/<id>/workspace.json,
+so every worker process sees it. The "default" workspace is the pair of files next
+to app.py (PLAN_FILE / DOT_FILE) and keeps the process-wide graph and RAG index
+from graph_provider and rag.
+
+Requests select a workspace with ?workspace=<id> or a "workspace" field in the JSON
+body. The id is held in a context variable, like llm_priority, so it follows the
+request into LangGraph's worker threads and asyncio tasks. graph_input_paths(),
+graph_provider.get_graph() and the rag index functions then resolve to that
+workspace.
+
+Each other workspace gets its own cached graph and RAG index in this registry. They
+are loaded on first use, the least recently used ones are evicted once their
+estimated size passes WORKSPACE_CACHE_MB, and they are rebuilt from disk on
+demand. Built vector indexes are persisted under the workspace directory, keyed by
+the inputs' content hash, so reloading an evicted workspace doesn't re-embed it.
+
+Plans can also be uploaded (registry.upload): the files are copied in chunks into a
+new inputs-<n> directory under the workspace, gunzipped on the way when compressed,
+and the manifest is then re-pointed at them in one rename, so a reader never sees
+a new plan with an old DOT file.
+"""
+
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import asdict, dataclass
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+WORKSPACES_DIR = os.environ.get(
+    "WORKSPACES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "workspaces")
+)
+# Estimated memory for loaded workspace graphs and indexes before the least recently used are evicted
+WORKSPACE_CACHE_MB = float(os.environ.get("WORKSPACE_CACHE_MB", "1024"))
+# Extra directories (os.pathsep-separated) whose files PUT /api/workspaces/<id> may register;
+# WORKSPACES_DIR itself is always allowed, anything else on the host never is
+WORKSPACE_PATH_ROOTS = [root for root in os.environ.get("WORKSPACE_PATH_ROOTS", "").split(os.pathsep) if root]
+
+# Largest uploaded plan or DOT file, after decompression
+UPLOAD_MAX_MB = float(os.environ.get("UPLOAD_MAX_MB", "512"))
+# Largest upload request body (both files as sent); app.py sets it as MAX_CONTENT_LENGTH so
+# Werkzeug refuses a bigger body before spooling it
+UPLOAD_MAX_REQUEST_MB = float(os.environ.get("UPLOAD_MAX_REQUEST_MB", str(2 * UPLOAD_MAX_MB + 1)))
+UPLOAD_PLAN_FILE = "plan.json"
+UPLOAD_DOT_FILE = "graph.dot"
+
+DEFAULT_WORKSPACE = "default"
+WORKSPACE_ID = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]{0,63}")
+
+_current_workspace: ContextVar[str] = ContextVar("workspace", default=DEFAULT_WORKSPACE)
+
+
+def current_workspace() -> str:
+    return _current_workspace.get()
+
+
+def set_current_workspace(workspace_id: str) -> Token:
+    """Select a workspace for the rest of this context; pass the token to reset_current_workspace()."""
+    return _current_workspace.set(workspace_id)
+
+
+def reset_current_workspace(token: Token) -> None:
+    _current_workspace.reset(token)
+
+
+@contextmanager
+def use_workspace(workspace_id: str):
+    token = _current_workspace.set(workspace_id)
+    try:
+        yield
+    finally:
+        _current_workspace.reset(token)
+
+
+class WorkspaceNotFound(KeyError):
+    pass
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_COPY_CHUNK = 1 << 20
+_DOT_HEADER = re.compile(rb"\s*(?://[^\n]*\n\s*|#[^\n]*\n\s*)*(strict\s+)?(di)?graph\b", re.IGNORECASE)
+
+
+def _save_upload(stream, directory: str, label: str, max_bytes: int) -> str:
+    """
+    Copy a seekable upload stream into a temp file in `directory`, 1 MB at a time,
+    gunzipping it when it starts with the gzip magic. Returns the temp file's path.
+    """
+    stream.seek(0, os.SEEK_END)
+    if stream.tell() > max_bytes:
+        # Checked before decompressing: a gzip file is never larger than its content's limit
+        raise UploadTooLarge(f"{label} file is larger than {max_bytes // (1024 * 1024)} MB")
+    stream.seek(0)
+    head = stream.read(2)
+    stream.seek(0)
+    source = gzip.GzipFile(fileobj=stream, mode="rb") if head == _GZIP_MAGIC else stream
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{label}-", suffix=".upload")
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                try:
+                    chunk = source.read(_COPY_CHUNK)
+                except (OSError, EOFError) as e:  # gzip.BadGzipFile is an OSError
+                    raise ValueError(f"{label} file is not valid gzip: {e}") from e
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(f"{label} file is larger than {max_bytes // (1024 * 1024)} MB")
+                f.write(chunk)
+        with open(tmp_path, "rb") as f:
+            start = f.read(4096)
+        if label == "plan" and not start.lstrip().startswith(b"{"):
+            raise ValueError("plan file is not JSON (expected `tofu show -json` output)")
+        if label == "DOT" and not _DOT_HEADER.match(start):
+            raise ValueError("DOT file does not start with a graph (expected `tofu graph` output)")
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path
+
+
+@dataclass(frozen=True)
+class Workspace:
+    id: str
+    plan_path: str
+    dot_path: str
+    created_at: float
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+class _LoadedWorkspace:
+    """In-memory graph and RAG index of one workspace; mirrors the default index state in rag.py."""
+
+    def __init__(self):
+        self.graph_lock = threading.Lock()
+        self.snapshot = None
+        self.graph_bytes = 0
+
+        self.build_lock = threading.Lock()
+        self.settled = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.engine = None
+        self.retriever = None
+        self.index_fingerprint = None
+        self.index_hash = None
+        self.index_bytes = 0
+        self.status: dict[str, Any] = {
+            "state": "cold", "stage": None, "progress": 0.0, "started_at": None, "finished_at": None, "error": None,
+        }
+        self.status_lock = threading.Lock()
+
+    @property
+    def estimated_bytes(self) -> int:
+        return self.graph_bytes + self.index_bytes
+
+
+def _graph_bytes(snapshot) -> int:
+    """Rough in-memory size of a graph: its mapped file, or its JSON size times Python's object overhead."""
+    path = getattr(snapshot.nodes, "path", None)
+    if path is not None:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    return 4 * len(json.dumps(snapshot.nodes))
+
+
+def _index_bytes(vector_index) -> int:
+    """Rough in-memory size of a SimpleVectorStore index: embeddings as lists of floats, plus node text."""
+    embeddings = getattr(getattr(vector_index.vector_store, "data", None), "embedding_dict", {})
+    texts = sum(len(node.get_content()) for node in vector_index.docstore.docs.values())
+    return 32 * sum(len(vector) for vector in embeddings.values()) + texts
+
+
+def _persist_index(vector_index, persist_dir: str) -> None:
+    """
+    Persist into a temp directory and rename it into place, so persist_dir is either
+    absent or complete. When another process got there first, its copy is kept.
+    """
+    parent = os.path.dirname(persist_dir)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix=".persist-")
+    try:
+        vector_index.storage_context.persist(persist_dir=tmp_dir)
+        os.rename(tmp_dir, persist_dir)
+    except OSError:
+        if not os.path.isdir(persist_dir):
+            raise
+        logger.info("[workspace] Index %s was persisted concurrently; keeping that copy", persist_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class WorkspaceRegistry:
+    def __init__(self, directory: str = WORKSPACES_DIR, budget_bytes: float = WORKSPACE_CACHE_MB * 1024 * 1024,
+                 path_roots: Optional[list[str]] = None):
+        self.directory = directory
+        self.path_roots = [os.path.realpath(root) for root in [directory, *(path_roots or WORKSPACE_PATH_ROOTS)]]
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self._known: dict[str, tuple[int, Workspace]] = {}  # id -> (workspace.json mtime_ns, workspace)
+        self._loaded: "OrderedDict[str, _LoadedWorkspace]" = OrderedDict()
+        self._evictions = 0
+
+    # -- registration ------------------------------------------------------
+
+    def workspace_dir(self, workspace_id: str) -> str:
+        return os.path.join(self.directory, workspace_id)
+
+    def _manifest(self, workspace_id: str) -> str:
+        return os.path.join(self.workspace_dir(workspace_id), "workspace.json")
+
+    def register(self, workspace_id: str, plan_path: str, dot_path: str) -> Workspace:
+        """
+        Register (or re-point) a workspace at a plan JSON and DOT file on this host. Both
+        must resolve (symlinks included) to files under WORKSPACES_DIR or a WORKSPACE_PATH_ROOTS
+        directory, so the API can't be pointed at arbitrary files.
+        """
+        if workspace_id == DEFAULT_WORKSPACE or not WORKSPACE_ID.fullmatch(workspace_id):
+            raise ValueError(f"Invalid workspace id {workspace_id!r}")
+        plan_path, dot_path = os.path.realpath(plan_path), os.path.realpath(dot_path)
+        for label, path in (("plan", plan_path), ("DOT", dot_path)):
+            if not any(os.path.commonpath([root, path]) == root for root in self.path_roots):
+                raise ValueError(f"{label} file must be under WORKSPACES_DIR or WORKSPACE_PATH_ROOTS")
+            if not os.path.isfile(path):
+                raise ValueError(f"{label} file not found: {path}")
+
+        workspace = Workspace(workspace_id, plan_path, dot_path, time.time())
+        os.makedirs(self.workspace_dir(workspace_id), exist_ok=True)
+        manifest = self._manifest(workspace_id)
+        with open(manifest + ".tmp", "w") as f:
+            json.dump(workspace.to_dict(), f)
+        os.replace(manifest + ".tmp", manifest)
+        logger.info("[workspace] Registered %s (plan %s, DOT %s)", workspace_id, workspace.plan_path, workspace.dot_path)
+        return workspace
+
+    def upload(self, workspace_id: str, plan_stream, dot_stream) -> Workspace:
+        """
+        Store an uploaded plan JSON and DOT file (either optionally gzipped) in the
+        workspace directory and register the workspace at them. Raises ValueError for
+        an invalid id or file, UploadTooLarge past UPLOAD_MAX_MB.
+        """
+        if workspace_id == DEFAULT_WORKSPACE or not WORKSPACE_ID.fullmatch(workspace_id):
+            raise ValueError(f"Invalid workspace id {workspace_id!r}")
+        directory = os.path.join(self.workspace_dir(workspace_id), f"inputs-{time.time_ns()}")
+        os.makedirs(directory)
+        max_bytes = int(UPLOAD_MAX_MB * 1024 * 1024)
+        try:
+            plan_tmp = _save_upload(plan_stream, directory, "plan", max_bytes)
+            dot_tmp = _save_upload(dot_stream, directory, "DOT", max_bytes)
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        plan_path, dot_path = os.path.join(directory, UPLOAD_PLAN_FILE), os.path.join(directory, UPLOAD_DOT_FILE)
+        os.replace(plan_tmp, plan_path)
+        os.replace(dot_tmp, dot_path)
+        workspace = self.register(workspace_id, plan_path, dot_path)
+        self._prune_inputs(workspace_id)
+        return workspace
+
+    def _prune_inputs(self, workspace_id: str, keep: int = 2) -> None:
+        """Delete all but the newest uploads (the previous one may still be mid-build elsewhere)."""
+        root = self.workspace_dir(workspace_id)
+        uploads = sorted(
+            (name for name in os.listdir(root) if name.startswith("inputs-")),
+            key=lambda name: int(name[len("inputs-"):]) if name[len("inputs-"):].isdigit() else 0,
+        )
+        for name in uploads[:-keep]:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+    def get(self, workspace_id: str) -> Workspace:
+        """The registered workspace, re-read from disk when another process changed it."""
+        try:
+            mtime = os.stat(self._manifest(workspace_id)).st_mtime_ns if WORKSPACE_ID.fullmatch(workspace_id) else None
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime is None:
+                self._known.pop(workspace_id, None)
+                self._loaded.pop(workspace_id, None)
+                raise WorkspaceNotFound(workspace_id)
+            known = self._known.get(workspace_id)
+            if known is not None and known[0] == mtime:
+                return known[1]
+        with open(self._manifest(workspace_id)) as f:
+            workspace = Workspace(**json.load(f))
+        with self._lock:
+            self._known[workspace_id] = (mtime, workspace)
+        return workspace
+
+    def exists(self, workspace_id: str) -> bool:
+        try:
+            self.get(workspace_id)
+        except WorkspaceNotFound:
+            return False
+        return True
+
+    def list(self) -> list[Workspace]:
+        if not os.path.isdir(self.directory):
+            return []
+        workspaces = []
+        for name in sorted(os.listdir(self.directory)):
+            try:
+                workspaces.append(self.get(name))
+            except WorkspaceNotFound:
+                continue
+        return workspaces
+
+    def remove(self, workspace_id: str) -> None:
+        """Unregister a workspace and delete its directory (persisted indexes, uploaded files)."""
+        self.get(workspace_id)
+        shutil.rmtree(self.workspace_dir(workspace_id), ignore_errors=True)
+        with self._lock:
+            self._known.pop(workspace_id, None)
+            self._loaded.pop(workspace_id, None)
+
+    # -- loaded state, LRU under the memory budget -------------------------
+
+    def _touch(self, workspace_id: str) -> _LoadedWorkspace:
+        with self._lock:
+            loaded = self._loaded.get(workspace_id)
+            if loaded is None:
+                loaded = self._loaded[workspace_id] = _LoadedWorkspace()
+            self._loaded.move_to_end(workspace_id)
+            return loaded
+
+    def _evict(self) -> None:
+        """Drop least recently used workspaces (never the most recent) until under budget."""
+        with self._lock:
+            while len(self._loaded) > 1 and sum(w.estimated_bytes for w in self._loaded.values()) > self.budget_bytes:
+                workspace_id, _ = self._loaded.popitem(last=False)
+                self._evictions += 1
+                logger.info("[workspace] Evicted %s from memory", workspace_id)
+
+    def graph(self, workspace_id: str):
+        """graph_provider.GraphSnapshot for a workspace, (re)built when its inputs changed."""
+        import graph_provider
+        from app import graph_input_fingerprint
+
+        loaded = self._touch(workspace_id)
+        with use_workspace(workspace_id):
+            fingerprint = graph_input_fingerprint()
+            snapshot = loaded.snapshot
+            if snapshot is not None and snapshot.fingerprint == fingerprint:
+                return snapshot
+            with loaded.graph_lock:
+                if loaded.snapshot is None or loaded.snapshot.fingerprint != fingerprint:
+                    loaded.snapshot = graph_provider.load_snapshot(fingerprint)
+                    loaded.graph_bytes = _graph_bytes(loaded.snapshot)
+                snapshot = loaded.snapshot
+        self._evict()
+        return snapshot
+
+    # -- RAG index: the same contract as rag.start_index_warmup / wait_for_index / get_query_engine
+
+    def set_index_status(self, workspace_id: str, **fields) -> None:
+        loaded = self._touch(workspace_id)
+        with loaded.status_lock:
+            loaded.status.update(fields)
+
+    def index_status(self, workspace_id: str) -> dict[str, Any]:
+        loaded = self._touch(workspace_id)
+        with loaded.status_lock:
+            status = dict(loaded.status)
+        status["ready"] = loaded.engine is not None
+        status["workspace"] = workspace_id
+        if status["started_at"] is not None:
+            end = status["finished_at"] or time.time()
+            status["elapsed_seconds"] = round(end - status["started_at"], 3)
+        return status
+
+    def _index_is_stale(self, workspace_id: str, loaded: _LoadedWorkspace) -> bool:
+        from app import graph_input_fingerprint
+
+        with use_workspace(workspace_id):
+            return loaded.engine is not None and loaded.index_fingerprint != graph_input_fingerprint()
+
+    def _build_index(self, workspace_id: str, loaded: _LoadedWorkspace) -> None:
+        """Load the persisted index for the current inputs, or build and persist it. Caller holds build_lock."""
+        import rag
+        from app import graph_input_version
+
+        with use_workspace(workspace_id):
+            self.set_index_status(
+                workspace_id, state="rebuilding" if loaded.engine is not None else "building", stage="starting",
+                progress=0.0, started_at=time.time(), finished_at=None, error=None,
+            )
+            try:
+                fingerprint, graph_hash = graph_input_version()
+                persist_dir = os.path.join(self.workspace_dir(workspace_id), "index", graph_hash[:16])
+                self.set_index_status(workspace_id, stage="building graph", progress=0.05)
+                nodes = self.graph(workspace_id).nodes
+                built = self._load_persisted_index(persist_dir, nodes)
+                if built is None:
+                    built = rag.build_index(nodes)
+                    _persist_index(built[0], persist_dir)
+                vector_index, vector_retriever, nodes, address_to_node, path_to_neighbors = built
+                self.set_index_status(workspace_id, stage="building query engine", progress=0.97)
+                engine, retriever, _ = rag.build_query_engine(
+                    vector_retriever, nodes, address_to_node, path_to_neighbors, verbose=rag.RAG_VERBOSE
+                )
+            except Exception as e:
+                logger.exception("[workspace] Index build failed for %s", workspace_id)
+                self.set_index_status(
+                    workspace_id, state="ready" if loaded.engine is not None else "failed", stage="failed",
+                    finished_at=time.time(), error=str(e),
+                )
+            else:
+                loaded.engine, loaded.retriever, loaded.index_fingerprint = engine, retriever, fingerprint
+                loaded.index_hash = graph_hash  # after the engine, as in rag._install_query_engine
+                loaded.index_bytes = _index_bytes(vector_index)
+                self.set_index_status(
+                    workspace_id, state="ready", stage="ready", progress=1.0, finished_at=time.time(), error=None
+                )
+            finally:
+                loaded.settled.set()
+        self._evict()
+
+    @staticmethod
+    def _load_persisted_index(persist_dir: str, nodes):
+        """The index persisted for these inputs, or None to build it (missing, or unreadable and discarded)."""
+        import rag
+
+        if not os.path.isdir(persist_dir):
+            return None
+        try:
+            return rag.load_index(persist_dir, nodes)
+        except Exception:
+            logger.exception("[workspace] Persisted index %s is unreadable; rebuilding it", persist_dir)
+            shutil.rmtree(persist_dir, ignore_errors=True)
+            return None
+
+    def start_index_build(self, workspace_id: str) -> bool:
+        """Build the workspace's index in a background thread if it is cold, failed or stale."""
+        from llm_scheduler import llm_priority
+
+        loaded = self._touch(workspace_id)
+        with loaded.status_lock:
+            if loaded.thread is not None and loaded.thread.is_alive():
+                return False
+            if loaded.engine is not None and not self._index_is_stale(workspace_id, loaded):
+                return False
+            if loaded.engine is None:
+                loaded.settled.clear()
+
+            def worker() -> None:
+                with llm_priority("batch"), loaded.build_lock:
+                    if loaded.engine is None or self._index_is_stale(workspace_id, loaded):
+                        self._build_index(workspace_id, loaded)
+                    else:
+                        loaded.settled.set()
+
+            loaded.thread = threading.Thread(target=worker, name=f"rag-index-{workspace_id}", daemon=True)
+            loaded.thread.start()
+        return True
+
+    def ensure_index(self, workspace_id: str) -> None:
+        """Build (or load) the index in this thread unless it matches the current inputs; raises if that fails."""
+        loaded = self._touch(workspace_id)
+        with loaded.build_lock:
+            if loaded.engine is None or self._index_is_stale(workspace_id, loaded):
+                self._build_index(workspace_id, loaded)
+        error = self.index_status(workspace_id)["error"]
+        if error is not None:
+            raise RuntimeError(f"RAG index build failed for workspace {workspace_id}: {error}")
+
+    def wait_for_index(self, workspace_id: str, timeout: Optional[float]) -> bool:
+        loaded = self._touch(workspace_id)
+        if loaded.engine is not None:
+            return True
+        loaded.settled.wait(timeout)
+        return loaded.engine is not None
+
+    def query_engine(self, workspace_id: str):
+        """The workspace's query engine, building the index in this thread on first use."""
+        loaded = self._touch(workspace_id)
+        if loaded.engine is None:
+            with loaded.build_lock:
+                if loaded.engine is None:
+                    self._build_index(workspace_id, loaded)
+            if loaded.engine is None:
+                raise RuntimeError(f"RAG index build failed for workspace {workspace_id}: {loaded.status['error']}")
+        return loaded.engine
+
+    def index_hash(self, workspace_id: str) -> Optional[str]:
+        loaded = self._touch(workspace_id)
+        return loaded.index_hash if loaded.engine is not None else None
+
+    def graph_retriever(self, workspace_id: str):
+        self.query_engine(workspace_id)
+        return self._touch(workspace_id).retriever
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            loaded = {
+                workspace_id: {
+                    "graph": w.snapshot is not None,
+                    "index": w.engine is not None,
+                    "estimated_bytes": w.estimated_bytes,
+                }
+                for workspace_id, w in self._loaded.items()
+            }
+            return {
+                "loaded": loaded,
+                "estimated_bytes": sum(w["estimated_bytes"] for w in loaded.values()),
+                "budget_bytes": int(self.budget_bytes),
+                "evictions": self._evictions,
+            }
+
+
+registry = WorkspaceRegistry()
@@ -0,0 +1,72 @@
+"""
+Production WSGI entry point: the Flask app, with the graph (and optionally the RAG
+index) loaded before the server forks its workers.
+
+Usage:
+  gunicorn wsgi:app          # settings in gunicorn.conf.py, read from the working directory
+
+With preload_app (on in gunicorn.conf.py) this module is imported once in the
+master. The langchain / LangGraph imports, the parsed graph and, with
+PRELOAD_RAG_INDEX=1, the vector index and embedding model then live in memory the
+workers inherit copy-on-write, instead of each worker importing, parsing the DOT
+file and building the index on its own.
+
+reset_after_fork() runs in every worker (gunicorn's post_fork hook) and drops the
+state that must not cross a fork: the SQLAlchemy engine's pooled sqlite
+connections and the LLM response cache's connection.
+"""
+
+import importlib
+import logging
+import os
+import time
+
+from app import app, init_db
+
+__all__ = ["app"]  # the WSGI callable
+
+logger = logging.getLogger(__name__)
+
+PRELOAD_GRAPH = os.environ.get("PRELOAD_GRAPH", "1").lower() in ("1", "true", "yes")
+PRELOAD_RAG_INDEX = os.environ.get("PRELOAD_RAG_INDEX", "0").lower() in ("1", "true", "yes")
+
+
+def preload() -> None:
+    """Build what the workers should share. Failures are logged; workers then build lazily as before."""
+    init_db()
+    # The LangGraph workflow pulls in langchain / langgraph: seconds of imports each worker would repeat
+    importlib.import_module("LangGraph")
+
+    if PRELOAD_GRAPH:
+        import graph_provider
+
+        try:
+            graph_provider.get_graph()
+        except Exception:
+            logger.exception("[graph] Preloading the graph failed")
+    if PRELOAD_RAG_INDEX:
+        import rag
+
+        started = time.perf_counter()
+        try:
+            # Synchronously: a warmup thread would not survive the fork
+            rag.get_query_engine()
+        except Exception:
+            logger.exception("[rag] Preloading the index failed")
+        else:
+            print(f"[rag] Index preloaded in {time.perf_counter() - started:.1f}s")
+
+
+def reset_after_fork() -> None:
+    """Drop connections inherited from the master; each worker reopens its own on first use."""
+    import app as app_module
+    from llm_cache import llm_response_cache
+
+    if app_module._db_engine is not None:
+        # close=False: leave the master's connections alone, just stop this process using them
+        app_module._db_engine.dispose(close=False)
+    llm_response_cache.reset_after_fork()
+    app_module.job_store.reset_after_fork()
+
+
+preload()